@@ -0,0 +1,293 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from flask import request, session
+
+from intent_gate import classify_risk
+from telemetry import increment, observe, register_gauge, span
+from therapeutic_assistant import SUPPORTED_LANGUAGES, generate_therapeutic_response
+
+# Load environment variables
+load_dotenv()
+
+# Configuration
+# Responses generated at the same time, per process
+MAX_CONCURRENT_GENERATIONS = int(os.environ.get("ADMISSION_MAX_CONCURRENT", "8"))
+# Messages allowed to wait for a generation slot before new ones are turned away
+MAX_QUEUE_LENGTH = int(os.environ.get("ADMISSION_MAX_QUEUE", "32"))
+# How long a message may wait before it gets the "high demand" reply instead
+MAX_QUEUE_WAIT_SECONDS = float(os.environ.get("ADMISSION_MAX_WAIT", "10"))
+MAX_PENDING_PER_USER = 2  # Messages one user may have waiting or generating
+
+# Queue priorities; lower values are served first
+PRIORITIES = {"crisis": 0, "normal": 1, "batch": 2}
+
+HIGH_DEMAND_MESSAGES = {
+    "english": "EchoMind is receiving a lot of messages right now. Please send yours again in a moment.",
+    "arabic": "يتلقى إيكو مايند الكثير من الرسائل في الوقت الحالي. يرجى إرسال رسالتك مرة أخرى بعد لحظات.",
+    "french": "EchoMind reçoit beaucoup de messages en ce moment. Veuillez renvoyer le vôtre dans un instant.",
+}
+
+SAFETY_RESPONSES = {
+    "english": "It sounds like you're going through something really painful, and I'm glad you told me. If you might act on thoughts of hurting yourself, please call your local emergency number now. You can also talk to someone at a crisis line at any time; findahelpline.com lists free, confidential services in your country. I'm here with you too.",
+    "arabic": "يبدو أنك تمر بشيء مؤلم حقاً، وأنا سعيد لأنك أخبرتني. إذا كنت قد تتصرف بناءً على أفكار إيذاء نفسك، يرجى الاتصال برقم الطوارئ المحلي الآن. يمكنك أيضاً التحدث إلى شخص ما عبر خط المساعدة في الأزمات في أي وقت؛ يعرض موقع findahelpline.com خدمات مجانية وسرية في بلدك. أنا هنا معك أيضاً.",
+    "french": "On dirait que vous traversez quelque chose de vraiment douloureux, et je suis content que vous me l'ayez dit. Si vous risquez de passer à l'acte, appelez dès maintenant le numéro d'urgence local. Vous pouvez aussi parler à quelqu'un sur une ligne d'écoute à tout moment ; findahelpline.com répertorie les services gratuits et confidentiels de votre pays. Je suis là avec vous aussi.",
+}
+
+
+class _Waiter:
+    """A message waiting in the admission queue for a generation slot."""
+
+    __slots__ = ("event", "state")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.state = "waiting"  # Then "admitted" or "evicted"
+
+
+class AdmissionController:
+    """
+    Bounded priority queue in front of response generation.
+
+    Up to `max_concurrent` messages are generated at once; the rest wait in
+    a queue ordered by priority, then by how many messages their client
+    already has pending, so one busy client can't starve the others. Normal
+    messages are turned away when the queue is full, when their client
+    already has `max_pending_per_client` messages pending, or after waiting
+    `max_wait` seconds. Batch messages (/api/batch) follow the same rules but
+    wait behind chat messages. Crisis messages are never turned away: they
+    jump the queue, and if it is full, take the place of the normal message
+    that would have been served last.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT_GENERATIONS,
+        max_queue: int = MAX_QUEUE_LENGTH,
+        max_wait: float = MAX_QUEUE_WAIT_SECONDS,
+        max_pending_per_client: int = MAX_PENDING_PER_USER,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_pending_per_client = max_pending_per_client
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        # Heap of (priority, client's pending count, sequence number, waiter)
+        self.queue: List[Tuple[int, int, int, _Waiter]] = []
+        self.sequence = itertools.count()
+        # Messages waiting or generating, per client
+        self.pending: Dict[str, int] = {}
+
+    def _add_pending(self, client: str, count: int):
+        pending = self.pending.get(client, 0) + count
+        if pending:
+            self.pending[client] = pending
+        else:
+            del self.pending[client]
+
+    def _shed(self, reason: str) -> Tuple[bool, float]:
+        increment("echomind_admission_shed_total", reason=reason)
+        return False, 0.0
+
+    def acquire(self, client: str, priority: str = "normal") -> Tuple[bool, float]:
+        """
+        Wait for a generation slot.
+
+        Args:
+            client: Who the message is from, for fairness (e.g. a session ID)
+            priority: "crisis", "normal" or "batch"
+
+        Returns:
+            Whether the message was admitted, and how many seconds it waited;
+            admitted messages must call release() when done
+        """
+        crisis = priority == "crisis"
+        start = time.perf_counter()
+        with self.lock:
+            if self.in_flight < self.max_concurrent and not self.queue:
+                self.in_flight += 1
+                self._add_pending(client, 1)
+                observe("echomind_admission_wait_seconds", 0.0, priority=priority)
+                return True, 0.0
+
+            if not crisis:
+                if self.pending.get(client, 0) >= self.max_pending_per_client:
+                    return self._shed("client_pending")
+                if len(self.queue) >= self.max_queue:
+                    return self._shed("queue_full")
+            elif len(self.queue) >= self.max_queue:
+                # Make room by turning away the last normal message in line
+                normal = [
+                    entry for entry in self.queue if entry[0] != PRIORITIES["crisis"]
+                ]
+                if normal:
+                    evicted = max(normal)
+                    self.queue.remove(evicted)
+                    heapq.heapify(self.queue)
+                    evicted[3].state = "evicted"
+                    evicted[3].event.set()
+
+            waiter = _Waiter()
+            entry = (
+                PRIORITIES[priority],
+                self.pending.get(client, 0),
+                next(self.sequence),
+                waiter,
+            )
+            heapq.heappush(self.queue, entry)
+            self._add_pending(client, 1)
+
+        # Crisis messages wait as long as it takes; they are next in line
+        waiter.event.wait(None if crisis else self.max_wait)
+        waited = time.perf_counter() - start
+        observe("echomind_admission_wait_seconds", waited, priority=priority)
+
+        with self.lock:
+            if waiter.state == "admitted":
+                return True, waited
+            if waiter.state == "waiting":
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+            self._add_pending(client, -1)
+        return self._shed("timeout" if waiter.state == "waiting" else "evicted")
+
+    def release(self, client: str):
+        """Free a generation slot, handing it to the next message in the queue."""
+        with self.lock:
+            self._add_pending(client, -1)
+            if self.queue:
+                waiter = heapq.heappop(self.queue)[3]
+                waiter.state = "admitted"
+                waiter.event.set()
+            else:
+                self.in_flight -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """Current number of generating and queued messages."""
+        with self.lock:
+            return {"in_flight": self.in_flight, "queued": len(self.queue)}
+
+
+# Shared by all requests in this process
+admission_controller = AdmissionController()
+
+
+def client_key() -> str:
+    """
+    Identify who a chat message is from, for fair scheduling between users.
+
+    Must be called while handling a Flask request.
+    """
+    user = session.get("user")
+    if user:
+        return user["email"]
+    return getattr(session, "sid", None) or request.remote_addr or "unknown"
+
+
+def safety_response(user_query: str, language: str = "english") -> Optional[str]:
+    """
+    The precomputed safety response for a message showing signs of suicide
+    or self-harm risk, or None for any other message.
+    """
+    if language not in SUPPORTED_LANGUAGES:
+        language = "english"
+    if classify_risk(user_query)["crisis"]:
+        return SAFETY_RESPONSES[language]
+    return None
+
+
+def generate_admitted_response(
+    client: str,
+    user_query: str,
+    conversation_history=None,
+    language: str = "english",
+    temperature: float = 0.3,
+    on_token=None,
+    on_safety=None,
+    controller: Optional[AdmissionController] = None,
+) -> Dict[str, Any]:
+    """
+    Generate a response once the admission controller lets the message through.
+
+    Messages showing signs of suicide or self-harm risk get a precomputed
+    safety response straight away (through `on_safety`, and in the result),
+    and their response is generated ahead of everyone else's.
+
+    Args:
+        client: Who the message is from, for per-client fairness
+        user_query: The user's message
+        conversation_history: Optional list of previous messages for context
+        language: Language for the response
+        temperature: Temperature for the response
+        on_token: Optional callback streaming the response
+        on_safety: Optional callback called with the safety response as soon
+                   as a crisis message is recognized
+        controller: Admission controller to use (the shared one if not given)
+
+    Returns:
+        The result of generate_therapeutic_response with "queue_ms" added to
+        its timings, "safety" set to the safety response for crisis messages,
+        and "shed" set to True if the message was turned away; the response
+        is then a "high demand" notice that shouldn't be kept in the history
+    """
+    if controller is None:
+        controller = admission_controller
+    if language not in SUPPORTED_LANGUAGES:
+        language = "english"
+
+    timings = {}
+    with span("risk", timings):
+        safety = safety_response(user_query, language)
+    if safety:
+        increment("echomind_crisis_messages_total", language=language)
+        if on_safety:
+            on_safety(safety)
+
+    priority = "crisis" if safety else "normal"
+    admitted, waited = controller.acquire(client, priority)
+    timings["queue_ms"] = waited * 1000
+    if not admitted:
+        return {
+            "response": HIGH_DEMAND_MESSAGES[language],
+            "sources": [],
+            "timings": timings,
+            "shed": True,
+        }
+
+    try:
+        result = generate_therapeutic_response(
+            user_query,
+            conversation_history=conversation_history,
+            language=language,
+            temperature=temperature,
+            on_token=on_token,
+        )
+    finally:
+        controller.release(client)
+
+    result["timings"] = {**timings, **result["timings"]}
+    if safety:
+        result["safety"] = safety
+    return result
+
+
+def _queue_gauge(key: str):
+    return lambda: [({}, admission_controller.stats()[key])]
+
+
+register_gauge(
+    "echomind_admission_in_flight",
+    "Responses being generated in this worker",
+    _queue_gauge("in_flight"),
+)
+register_gauge(
+    "echomind_admission_queued",
+    "Messages waiting for a generation slot in this worker",
+    _queue_gauge("queued"),
+)
@@ -1,15 +1,51 @@
 import os
 import json
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+import time
+import ipaddress
+from flask import (
+    Flask,
+    Response,
+    g,
+    render_template,
+    request,
+    jsonify,
+    session,
+    redirect,
+    url_for,
+)
 from flask_session import Session
 from dotenv import load_dotenv
-from werkzeug.security import generate_password_hash, check_password_hash
 
 from therapeutic_assistant import (
-    generate_therapeutic_response,
     generate_positive_reflection,
+    get_not_enough_history_text,
     SUPPORTED_LANGUAGES,
 )
+from telemetry import METRICS_ENABLED, observe, render_prometheus
+from preload import memory_report
+from knowledge_base import KnowledgeBaseWatcher
+from batch_inference import (
+    API_GENERATION_WORKERS,
+    MAX_API_BATCH,
+    api_limiter,
+    process_batch,
+)
+from throttle import TokenBucketLimiter
+from user_store import PasswordHashingBusy, UserStore
+from chat_socket import ChatSocketMiddleware
+from admission import (
+    admission_controller,
+    client_key,
+    generate_admitted_response,
+    safety_response,
+)
+from prefetch import prefetcher
+from conversation_store import (
+    HISTORY_PAGE_SIZE,
+    MAX_HISTORY_PAGE_SIZE,
+    conversation_store,
+    session_conversation_id,
+)
 
 # Load environment variables
 load_dotenv()
@@ -22,22 +58,80 @@ if os.name == "nt":
     # Use Flask's built-in cookie-based sessions (no Flask-Session)
     pass
 else:
-    # Use Flask-Session with Redis for non-Windows
-    app.config["SESSION_TYPE"] = "redis"
+    # Use Flask-Session with Redis for non-Windows (SESSION_TYPE can override it,
+    # e.g. "filesystem" for local benchmarks without a Redis server)
+    app.config["SESSION_TYPE"] = os.environ.get("SESSION_TYPE", "redis")
+    # Directory of filesystem sessions
+    app.config["SESSION_FILE_DIR"] = os.environ.get(
+        "SESSION_FILE_DIR", os.path.join(os.getcwd(), "flask_session")
+    )
     app.config["SESSION_PERMANENT"] = True
     app.config["SESSION_USE_SIGNER"] = True
     Session(app)
 
-# Mock user database - in production, use a real database
-users_db = {}
+# WebSocket chat channel at /ws (served by python chat_server.py)
+app.wsgi_app = ChatSocketMiddleware(app, app.wsgi_app)
+
+# Registered users, persisted in SQLite (USER_DB_PATH)
+user_store = UserStore()
+
+# Login and signup attempts: bursts of 10 per IP then 1 every 6 seconds, and
+# 5 per account then 1 per minute
+ip_limiter = TokenBucketLimiter("auth_ip", capacity=10, refill_per_second=1 / 6)
+account_limiter = TokenBucketLimiter(
+    "auth_account", capacity=5, refill_per_second=1 / 60
+)
+
+
+def throttle_auth(email: str):
+    """
+    Apply the per-IP and per-account limits to a login or signup attempt.
+
+    Args:
+        email: Account the attempt is for
+
+    Returns:
+        A 429 response if the attempt is over a limit, otherwise None
+    """
+    for limiter, key in (
+        (ip_limiter, request.remote_addr or "unknown"),
+        (account_limiter, email.strip().lower()),
+    ):
+        allowed, retry_after = limiter.allow(key)
+        if not allowed:
+            response = jsonify(
+                {"error": "Too many attempts. Please try again in a moment."}
+            )
+            response.headers["Retry-After"] = str(int(retry_after) + 1)
+            return response, 429
+    return None
+
+
+@app.before_request
+def start_request_timer():
+    """Remember when the request started, for the request duration metric."""
+    if METRICS_ENABLED:
+        g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_duration(response):
+    """Record how long each endpoint took to respond."""
+    if METRICS_ENABLED and "request_start" in g:
+        observe(
+            "echomind_http_request_duration_seconds",
+            time.perf_counter() - g.request_start,
+            endpoint=request.endpoint or "unknown",
+            status=str(response.status_code),
+        )
+    return response
 
 
 @app.route("/")
 def index():
     """Main page - chat interface."""
     # Initialize session variables if not present
-    if "messages" not in session:
-        session["messages"] = []
+    conversation_id = session_conversation_id()
     if "language" not in session:
         session["language"] = "english"
     if "reflection" not in session:
@@ -61,9 +155,13 @@ def index():
     # Get logged in user if available
     current_user = session.get("user", None)
 
+    # Only the latest messages; older ones are loaded from /api/history on scroll
+    history = conversation_store.page(conversation_id, limit=HISTORY_PAGE_SIZE)
+
     return render_template(
         "index.html",
-        messages=session["messages"],
+        messages=list(reversed(history["messages"])),
+        history_cursor=history["next_cursor"],
         reflection=session["reflection"],
         language=language,
         language_name=language_info["name"],
@@ -78,7 +176,13 @@ def index():
 
 @app.route("/api/send_message", methods=["POST"])
 def send_message():
-    """API endpoint to send a message and get a response."""
+    """
+    API endpoint to send a message and get a response.
+
+    Messages showing signs of crisis get their safety response straight
+    away: the reply is then streamed as JSON lines, first {"safety"}, then
+    the generated {"response", "sources"} (or {"error"}).
+    """
     data = request.json
     user_message = data.get("message", "")
     language = session.get("language", "english")
@@ -89,40 +193,186 @@ def send_message():
     if not user_message:
         return jsonify({"error": "Message is required"}), 400
 
-    # Add user message to history
-    messages = session.get("messages", [])
-    messages.append({"role": "user", "content": user_message})
-    session["messages"] = messages
+    conversation_id = session_conversation_id()
+    history = conversation_store.messages(conversation_id)
+    client = client_key()
 
-    # Clear any previous reflection when new message is sent
-    session["reflection"] = None
+    # Drafts of this message that are still waiting to be prefetched are stale
+    prefetcher.cancel(client)
 
-    # Generate response
-    try:
-        result = generate_therapeutic_response(
+    def respond():
+        # Generate response, waiting for a slot if many messages are being answered
+        result = generate_admitted_response(
+            client,
             user_message,
-            conversation_history=messages[:-1],  # Exclude the current message
+            conversation_history=history,
             language=language,
             temperature=temperature,  # Pass temperature to the function
         )
+        prefetcher.record_send(client, user_message, result["timings"])
 
         response_text = result["response"]
         sources = result["sources"]
 
-        # Add AI response to history
+        # Turned away under load: the user sends the message again later
+        if result.get("shed"):
+            return {"response": response_text, "sources": [], "shed": True}
+
+        # Add user message and AI response to history
+        messages = [{"role": "user", "content": user_message}]
+        if result.get("safety"):
+            messages.append({"role": "assistant", "content": result["safety"]})
         messages.append({"role": "assistant", "content": response_text})
-        session["messages"] = messages
+        conversation_store.append(conversation_id, messages)
+        return {"response": response_text, "sources": sources}
 
-        return jsonify({"response": response_text, "sources": sources})
+    safety = safety_response(user_message, language)
+    if safety:
+        # Crisis messages are never turned away, so the turn will be kept;
+        # the session is saved before the stream starts
+        session["reflection"] = None
 
+        def stream():
+            yield json.dumps({"safety": safety}, ensure_ascii=False) + "\n"
+            try:
+                reply = respond()
+            except Exception as e:
+                reply = {"error": f"Error generating response: {str(e)}"}
+            yield json.dumps(reply, ensure_ascii=False) + "\n"
+
+        return Response(stream(), mimetype="application/x-ndjson")
+
+    try:
+        reply = respond()
     except Exception as e:
         return jsonify({"error": f"Error generating response: {str(e)}"}), 500
 
+    if not reply.get("shed"):
+        # Clear any previous reflection when new message is sent
+        session["reflection"] = None
+    return jsonify(reply)
+
+
+@app.route("/api/history", methods=["GET"])
+def history():
+    """API endpoint to page through the conversation, newest messages first."""
+    before = request.args.get("before")
+    try:
+        before = int(before) if before else None
+        limit = int(request.args.get("limit", HISTORY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "Invalid cursor or limit value"}), 400
+    limit = max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+
+    return jsonify(
+        conversation_store.page(session_conversation_id(), before=before, limit=limit)
+    )
+
+
+@app.route("/api/prefetch", methods=["POST"])
+def prefetch():
+    """API endpoint to warm the retrieval caches with a draft message while typing."""
+    data = request.json or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "A JSON object is required"}), 400
+    text = data.get("text", "")
+    if not isinstance(text, str):
+        return jsonify({"error": "Text must be a string"}), 400
+    try:
+        generation = int(data.get("generation"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid generation value"}), 400
+
+    status = prefetcher.schedule(
+        client_key(), text, session.get("language", "english"), generation
+    )
+    status_codes = {"scheduled": 202, "throttled": 429}
+    return jsonify({"status": status}), status_codes.get(status, 200)
+
+
+def _batch_settings_error(settings) -> str:
+    """Check the language and temperature of a batch or batch request."""
+    if "language" in settings and (
+        not isinstance(settings["language"], str)
+        or settings["language"] not in SUPPORTED_LANGUAGES
+    ):
+        return "Unsupported language"
+    if "temperature" in settings:
+        try:
+            temperature = float(settings["temperature"])
+        except (TypeError, ValueError):
+            return "Invalid temperature value"
+        if temperature < 0.0 or temperature > 1.0:
+            return "Temperature must be between 0.0 and 1.0"
+    return ""
+
+
+@app.route("/api/batch", methods=["POST"])
+def batch():
+    """
+    API endpoint to generate responses for many messages at once.
+
+    Expects {"requests": [{"id", "message", "language"?, "temperature"?,
+    "history"?}, ...]} and streams one JSON result per line as soon as each
+    is ready. Requests without an id are numbered by position; resubmit
+    the ids missing from an interrupted stream, or that failed, to resume it.
+    Each user's Gemini calls share one rate limit across their batches, and
+    wait behind chat messages in the admission queue.
+    """
+    if not session.get("user"):
+        return jsonify({"error": "Login required"}), 401
+
+    data = request.json or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "A JSON object is required"}), 400
+    items = data.get("requests")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "A list of requests is required"}), 400
+    if len(items) > MAX_API_BATCH:
+        return (
+            jsonify({"error": f"At most {MAX_API_BATCH} requests per batch"}),
+            400,
+        )
+    error = _batch_settings_error(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    batch_requests = []
+    for position, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get("message"):
+            return jsonify({"error": f"Request {position} has no message"}), 400
+        error = _batch_settings_error(item)
+        if error:
+            return jsonify({"error": f"Request {position}: {error}"}), 400
+        batch_request = {**item, "id": str(item.get("id", position))}
+        if "temperature" in item:
+            batch_request["temperature"] = float(item["temperature"])
+        batch_requests.append(batch_request)
+
+    language = data.get("language", session.get("language", "english"))
+    temperature = float(data.get("temperature", session.get("temperature", 0.3)))
+    client = client_key()
+
+    def stream():
+        results = process_batch(
+            batch_requests,
+            language,
+            temperature,
+            generation_workers=API_GENERATION_WORKERS,
+            limiter=api_limiter,
+            client=client,
+            controller=admission_controller,
+        )
+        for result in results:
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return Response(stream(), mimetype="application/x-ndjson")
+
 
 @app.route("/api/generate_reflection", methods=["POST"])
 def generate_reflection():
     """API endpoint to generate a reflection based on conversation history."""
-    messages = session.get("messages", [])
+    messages = conversation_store.messages(session_conversation_id())
     language = session.get("language", "english")
     temperature = session.get(
         "temperature", 0.3
@@ -150,7 +400,7 @@ def generate_reflection():
 @app.route("/api/clear_conversation", methods=["POST"])
 def clear_conversation():
     """API endpoint to clear the conversation history."""
-    session["messages"] = []
+    conversation_store.clear(session_conversation_id())
     session["reflection"] = None
     return jsonify({"status": "cleared"})
 
@@ -223,14 +473,17 @@ def signup():
     if not all([name, email, password]):
         return jsonify({"error": "All fields are required"}), 400
 
-    if email in users_db:
-        return jsonify({"error": "User already exists"}), 400
+    throttled = throttle_auth(email)
+    if throttled:
+        return throttled
 
-    # Hash the password
-    hashed_password = generate_password_hash(password)
-
-    # In production, store in a real database
-    users_db[email] = {"name": name, "password": hashed_password}
+    # Hash the password off the request thread and store the user
+    try:
+        created = user_store.create_user(name, email, password)
+    except PasswordHashingBusy:
+        return jsonify({"error": "Server is busy. Please try again in a moment."}), 503
+    if not created:
+        return jsonify({"error": "User already exists"}), 400
 
     # Create user session
     session["user"] = {"email": email, "name": name}
@@ -249,12 +502,22 @@ def login():
     if not all([email, password]):
         return jsonify({"error": "Email and password are required"}), 400
 
-    user = users_db.get(email)
-    if not user or not check_password_hash(user["password"], password):
+    throttled = throttle_auth(email)
+    if throttled:
+        return throttled
+
+    try:
+        user = user_store.authenticate(email, password)
+    except PasswordHashingBusy:
+        return jsonify({"error": "Server is busy. Please try again in a moment."}), 503
+    if not user:
         return jsonify({"error": "Invalid email or password"}), 401
 
+    # A successful login refills the account's attempts
+    account_limiter.reset(email.strip().lower())
+
     # Create user session
-    session["user"] = {"email": email, "name": user["name"]}
+    session["user"] = user
 
     return jsonify({"message": "Login successful", "username": user["name"]})
 
@@ -282,6 +545,28 @@ def auth_status():
         return jsonify({"isAuthenticated": False})
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus metrics endpoint (populated when ECHOMIND_METRICS is enabled)."""
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/memory", methods=["GET"])
+def memory():
+    """
+    API endpoint reporting the memory usage of the worker serving the request.
+
+    Only answers requests from the machine itself, e.g. an operator's curl.
+    """
+    try:
+        local = ipaddress.ip_address(request.remote_addr or "").is_loopback
+    except ValueError:
+        local = False
+    if not local:
+        return jsonify({"error": "Only available from localhost"}), 403
+    return jsonify({"pid": os.getpid(), "memory": memory_report()})
+
+
 # Helper functions for multilingual support
 def get_welcome_message(language):
     """Get welcome message based on language."""
@@ -318,16 +603,6 @@ def get_placeholder_text(language):
     return placeholders.get(language, placeholders["english"])
 
 
-def get_not_enough_history_text(language):
-    """Get message for not enough history for reflection."""
-    texts = {
-        "english": "We need to chat a bit more before I can offer a meaningful reflection.",
-        "arabic": "نحتاج إلى الدردشة قليلاً أكثر قبل أن أتمكن من تقديم تفكير مفيد.",
-        "french": "Nous devons discuter un peu plus avant que je puisse offrir une réflexion significative.",
-    }
-    return texts.get(language, texts["english"])
-
-
 if __name__ == "__main__":
     # Check for API key
     gemini_api_key = os.environ.get("GEMINI_API_KEY")
@@ -348,4 +623,11 @@ if __name__ == "__main__":
                 "For full functionality, please add ASTRA_DB_APPLICATION_TOKEN and ASTRA_DB_API_ENDPOINT to your .env file."
             )
 
+        # Rebuild the knowledge base in the background when dataset/ changes
+        # (with gunicorn, run `python knowledge_base.py watch` alongside instead).
+        # The debug reloader runs this twice; only watch from the serving process.
+        watch = os.environ.get("ECHOMIND_KB_WATCH", "").lower() in ("1", "true", "yes")
+        if watch and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            KnowledgeBaseWatcher().start()
+
         app.run(debug=True)
@@ -0,0 +1,398 @@
+import os
+import json
+import time
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set
+
+from dotenv import load_dotenv
+
+from admission import HIGH_DEMAND_MESSAGES, AdmissionController
+from astra_connection import connect_to_astradb
+from intent_gate import classify_turn
+from offload import run_cpu_bound
+from knowledge_base import get_active_index, language_index
+from text_to_vector_db import get_embedding_model
+from telemetry import span
+from throttle import TokenBucketLimiter
+from therapeutic_assistant import (
+    SUPPORTED_LANGUAGES,
+    generate_therapeutic_response,
+    retrieve_knowledge,
+)
+
+# Load environment variables
+load_dotenv()
+
+# Configuration
+BATCH_SIZE = 64  # Messages encoded and searched together
+SEARCH_WORKERS = 16  # Concurrent AstraDB searches
+GENERATION_WORKERS = 8  # Concurrent Gemini calls
+# Gemini requests per minute allowed by the provider quota
+REQUESTS_PER_MINUTE = float(os.environ.get("BATCH_REQUESTS_PER_MINUTE", "60"))
+# Gemini requests per minute allowed to each user of /api/batch
+API_REQUESTS_PER_MINUTE = float(os.environ.get("BATCH_API_REQUESTS_PER_MINUTE", "20"))
+API_GENERATION_WORKERS = 2  # Concurrent Gemini calls per /api/batch stream
+API_BATCH_SECONDS = 20  # Longest a batch may take, within gunicorn's 30 s timeout
+# Largest batch accepted by the /api/batch endpoint: what the per-user rate
+# allows in API_BATCH_SECONDS, even when the user's bucket starts out empty
+MAX_API_BATCH = max(1, int(API_REQUESTS_PER_MINUTE * API_BATCH_SECONDS / 60))
+
+# Shared by all /api/batch requests in this process, one bucket per user
+api_limiter = TokenBucketLimiter(
+    "batch_api",
+    capacity=API_GENERATION_WORKERS,
+    refill_per_second=API_REQUESTS_PER_MINUTE / 60,
+)
+
+
+def load_requests(path: str) -> List[Dict[str, Any]]:
+    """
+    Read messages to process from a JSONL file such as requests.jsonl.
+
+    Each line needs the message in a "message", "body" or "content" field.
+    Optional fields are "id" or "request_id" (the line number is used
+    otherwise), "language", "temperature" and "history" (a list of
+    {"role", "content"} messages).
+
+    Args:
+        path: JSONL file to read
+
+    Returns:
+        List of requests with "id" and "message" set
+    """
+    requests = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            message = entry.get("message") or entry.get("body") or entry.get("content")
+            if not message:
+                continue
+            request_id = entry.get("id") or entry.get("request_id")
+            requests.append(
+                {
+                    **entry,
+                    "id": str(request_id or f"line-{line_number}"),
+                    "message": message,
+                }
+            )
+    return requests
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """
+    Find the requests an earlier, interrupted run already answered.
+
+    Args:
+        output_path: JSONL results file of the earlier run
+
+    Returns:
+        IDs of results without an "error"; failed requests are retried
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut off when the earlier run was killed
+                continue
+            if "error" not in result:
+                done.add(result["id"])
+    return done
+
+
+def _batches(items: List[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def retrieve_batch(
+    db, requests: List[Dict[str, Any]], executor: ThreadPoolExecutor, language: str
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Retrieve context for a batch of messages.
+
+    Messages are encoded in one pass per encoder, and their searches run
+    concurrently on the executor. Small talk is skipped, as in
+    generate_therapeutic_response.
+
+    Args:
+        db: AstraDB database client
+        requests: Requests from load_requests
+        executor: Thread pool to run the searches on
+        language: Language of requests that don't specify one
+
+    Returns:
+        One retrieve_knowledge result per request; None where no retrieval is
+        needed, or where it failed and will be retried during generation
+    """
+    index = get_active_index()
+    by_model: Dict[str, List[int]] = {}
+    for i, request in enumerate(requests):
+        if classify_turn(request["message"])["retrieve"]:
+            target = language_index(index, request.get("language", language))
+            model_name = target["model_name"]
+            by_model.setdefault(model_name, []).append(i)
+
+    embeddings = {}
+    with span("batch_embed"):
+        for model_name, indexes in by_model.items():
+            encoded = run_cpu_bound(
+                get_embedding_model(model_name).encode,
+                [requests[i]["message"] for i in indexes],
+                batch_size=BATCH_SIZE,
+            )
+            embeddings.update(zip(indexes, encoded))
+
+    futures = {
+        i: executor.submit(
+            retrieve_knowledge,
+            db,
+            requests[i]["message"],
+            requests[i].get("language", language),
+            query_embedding=embedding,
+        )
+        for i, embedding in embeddings.items()
+    }
+
+    retrievals: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+    for i, future in futures.items():
+        try:
+            retrievals[i] = future.result()
+        except Exception as e:
+            print(f"Search failed for request {requests[i]['id']}: {e}")
+    return retrievals
+
+
+def _generate(
+    request: Dict[str, Any],
+    retrieval: Optional[Dict[str, Any]],
+    limiter: TokenBucketLimiter,
+    language: str,
+    temperature: float,
+    client: str = "",
+    controller: Optional[AdmissionController] = None,
+) -> Dict[str, Any]:
+    """Generate the response to one request once the rate limit allows it."""
+    limiter.wait(client)
+    start = time.perf_counter()
+    if controller is not None:
+        admitted, _ = controller.acquire(client, "batch")
+        if not admitted:
+            message = HIGH_DEMAND_MESSAGES[request.get("language", language)]
+            return {
+                "id": request["id"],
+                "message": request["message"],
+                "error": message,
+                "shed": True,
+                "elapsed_ms": (time.perf_counter() - start) * 1000,
+            }
+    try:
+        result = generate_therapeutic_response(
+            request["message"],
+            conversation_history=request.get("history"),
+            language=request.get("language", language),
+            temperature=request.get("temperature", temperature),
+            retrieval=retrieval,
+        )
+    finally:
+        if controller is not None:
+            controller.release(client)
+    output = {
+        "id": request["id"],
+        "message": request["message"],
+        "response": result["response"],
+        "sources": result["sources"],
+        "timings": result["timings"],
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+    }
+    if result.get("error"):
+        output["error"] = result["error"]
+    return output
+
+
+def process_batch(
+    requests: Iterable[Dict[str, Any]],
+    language: str = "english",
+    temperature: float = 0.3,
+    batch_size: int = BATCH_SIZE,
+    search_workers: int = SEARCH_WORKERS,
+    generation_workers: int = GENERATION_WORKERS,
+    requests_per_minute: float = REQUESTS_PER_MINUTE,
+    db=None,
+    limiter: Optional[TokenBucketLimiter] = None,
+    client: str = "",
+    controller: Optional[AdmissionController] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Generate responses for many messages, yielding each result as soon as it's ready.
+
+    While one batch is being generated, the next one is already encoded and
+    searched. Gemini calls are capped by both `generation_workers` and
+    `requests_per_minute`, so throughput is set by the provider quota.
+
+    Args:
+        requests: Requests from load_requests
+        language: Language of requests that don't specify one
+        temperature: Temperature of requests that don't specify one
+        batch_size: Messages encoded and searched together
+        search_workers: Concurrent AstraDB searches
+        generation_workers: Concurrent Gemini calls
+        requests_per_minute: Maximum Gemini calls per minute
+        db: AstraDB database client (connects if not given)
+        limiter: Rate limiter to take the Gemini calls from, e.g. one shared
+                 between users (a new one per call if not given)
+        client: Key of the limiter's bucket, and who the requests are from
+        controller: Admission controller to queue each Gemini call behind
+                    chat messages (none if not given)
+
+    Yields:
+        Result dictionaries with "id", "message", "response", "sources" and
+        "timings", plus "error" if generation failed (and "shed" if the
+        admission controller turned it away); in completion order
+    """
+    if language not in SUPPORTED_LANGUAGES:
+        language = "english"
+    requests = list(requests)
+    if not requests:
+        return
+
+    if db is None:
+        db = connect_to_astradb()
+    if limiter is None:
+        limiter = TokenBucketLimiter(
+            "batch_generation",
+            capacity=generation_workers,
+            refill_per_second=requests_per_minute / 60,
+        )
+
+    with ThreadPoolExecutor(max_workers=search_workers) as searchers:
+        with ThreadPoolExecutor(max_workers=generation_workers) as generators:
+            pending = set()
+            for batch in _batches(requests, batch_size):
+                retrievals = retrieve_batch(db, batch, searchers, language)
+                for request, retrieval in zip(batch, retrievals):
+                    pending.add(
+                        generators.submit(
+                            _generate,
+                            request,
+                            retrieval,
+                            limiter,
+                            language,
+                            temperature,
+                            client,
+                            controller,
+                        )
+                    )
+
+                # Don't search further ahead than generation can keep up with
+                while len(pending) > batch_size:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    language: str = "english",
+    temperature: float = 0.3,
+    **options,
+) -> Dict[str, Any]:
+    """
+    Process a JSONL file of messages and append the results to a JSONL file.
+
+    Each result is written and flushed as soon as it's ready. Running the
+    same command again after an interruption skips the requests that already
+    have a result and retries the ones that failed.
+
+    Args:
+        input_path: JSONL file of requests (see load_requests)
+        output_path: JSONL file to append results to
+        language: Language of requests that don't specify one
+        temperature: Temperature of requests that don't specify one
+        **options: Concurrency settings passed on to process_batch
+
+    Returns:
+        Summary with the number of requests processed, skipped and failed,
+        and the throughput
+    """
+    requests = load_requests(input_path)
+    done = completed_ids(output_path)
+    todo = [request for request in requests if request["id"] not in done]
+    print(f"{len(todo)} requests to process ({len(requests) - len(todo)} already done)")
+
+    # Finish a line cut off by an interrupted run, so it doesn't swallow the next result
+    cut_off = False
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            cut_off = file.read(1) != b"\n"
+
+    processed = failed = 0
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as file:
+        if cut_off:
+            file.write("\n")
+        for result in process_batch(todo, language, temperature, **options):
+            file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            file.flush()
+            processed += 1
+            failed += "error" in result
+            if processed % 50 == 0:
+                print(f"Processed {processed}/{len(todo)}")
+    duration = time.perf_counter() - start
+
+    return {
+        "processed": processed,
+        "skipped": len(requests) - len(todo),
+        "failed": failed,
+        "duration_s": duration,
+        "requests_per_s": processed / duration if duration else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate EchoMind responses for a JSONL file of messages"
+    )
+    parser.add_argument("input", help="JSONL file of requests, e.g. requests.jsonl")
+    parser.add_argument("output", help="JSONL file to append results to")
+    parser.add_argument("--language", default="english")
+    parser.add_argument("--temperature", type=float, default=0.3)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--search-workers", type=int, default=SEARCH_WORKERS)
+    parser.add_argument("--generation-workers", type=int, default=GENERATION_WORKERS)
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        default=REQUESTS_PER_MINUTE,
+        help="Gemini quota to stay within",
+    )
+    args = parser.parse_args()
+
+    summary = run_batch(
+        args.input,
+        args.output,
+        language=args.language,
+        temperature=args.temperature,
+        batch_size=args.batch_size,
+        search_workers=args.search_workers,
+        generation_workers=args.generation_workers,
+        requests_per_minute=args.requests_per_minute,
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,708 @@
+import os
+import sys
+import json
+import glob
+import time
+import zlib
+import random
+import argparse
+import tempfile
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from bm25_index import BM25Index, tokenize
+from conversation_archive import ConversationArchive
+from knowledge_base import DEFAULT_INDEX
+
+# Default latency distributions, loosely based on production measurements
+DEFAULT_EMBED_LATENCY = "lognormal:15,0.3"
+DEFAULT_CONNECT_LATENCY = "lognormal:120,0.4"
+DEFAULT_SEARCH_LATENCY = "lognormal:60,0.4"
+DEFAULT_GEMINI_LATENCY = "lognormal:900,0.35"
+DEFAULT_RESPONSE_WORDS = 150
+BENCHMARK_PASSWORD = "benchmark-password"  # Password of the login scenario's users
+VECTOR_DIMENSION = 384
+
+
+class LatencyDistribution:
+    """
+    Samples simulated backend latencies.
+
+    Specs look like "fixed:MS", "uniform:LOW_MS,HIGH_MS", "normal:MEAN_MS,STD_MS"
+    or "lognormal:MEDIAN_MS,SIGMA".
+    """
+
+    def __init__(self, spec: str, seed: Optional[int] = None):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        """Return a latency in seconds."""
+        with self._lock:
+            if self.kind == "fixed":
+                ms = self.params[0]
+            elif self.kind == "uniform":
+                ms = self._random.uniform(self.params[0], self.params[1])
+            elif self.kind == "normal":
+                ms = self._random.gauss(self.params[0], self.params[1])
+            else:
+                ms = self.params[0] * np.exp(self._random.gauss(0.0, self.params[1]))
+        return max(ms, 0.0) / 1000
+
+    def sleep(self):
+        """Block for one sampled latency."""
+        time.sleep(self.sample())
+
+
+class FakeEmbeddingModel:
+    """Stand-in for SentenceTransformer using signed feature hashing of BM25 terms."""
+
+    def __init__(self, latency: LatencyDistribution, dimension: int = VECTOR_DIMENSION):
+        self.latency = latency
+        self.dimension = dimension
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for term in tokenize(text):
+            h = zlib.crc32(term.encode("utf-8"))
+            vector[h % self.dimension] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, sentences, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        # One simulated forward pass per call, however many texts are batched
+        self.latency.sleep()
+        vectors = np.array([self._embed(text) for text in texts], dtype=np.float32)
+        return vectors[0] if single else vectors
+
+
+class FakeCollection:
+    """In-memory stand-in for an AstraDB vector collection."""
+
+    def __init__(self, chunks: List[Dict[str, Any]], latency: LatencyDistribution):
+        self.chunks = chunks
+        self.latency = latency
+        self.matrix = np.array([chunk["$vector"] for chunk in chunks], dtype=np.float32)
+
+    def find(
+        self,
+        filter=None,
+        sort=None,
+        limit: int = 5,
+        include_similarity: bool = False,
+        projection=None,
+        **kwargs,
+    ):
+        self.latency.sleep()
+        query = np.asarray(sort["$vector"], dtype=np.float32)
+        cosines = self.matrix @ (query / max(np.linalg.norm(query), 1e-12))
+        fields = list(projection or self.chunks[0].keys())
+
+        results = []
+        for i in np.argsort(-cosines, kind="stable")[:limit]:
+            doc = {"_id": self.chunks[i]["_id"]}
+            doc.update({f: self.chunks[i][f] for f in fields if f in self.chunks[i]})
+            if include_similarity:
+                doc["$similarity"] = (1.0 + float(cosines[i])) / 2.0
+            results.append(doc)
+        return results
+
+    def insert_many(self, documents, **kwargs):
+        self.latency.sleep()
+
+
+class FakeDatabase:
+    """In-memory stand-in for an AstraDB database holding one collection."""
+
+    def __init__(self, collection: FakeCollection, name: str = "text_vectors"):
+        self.collections = {name: collection}
+
+    def get_collection(self, name: str) -> FakeCollection:
+        return self.collections[name]
+
+    def list_collection_names(self) -> List[str]:
+        return list(self.collections)
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt: str):
+        self.text = text
+        self.usage_metadata = FakeUsage(len(prompt) // 4, len(text) // 4)
+
+
+class FakeGenerativeModel:
+    """Stand-in for a Gemini GenerativeModel returning canned text."""
+
+    def __init__(
+        self, latency: LatencyDistribution, response_words: int = DEFAULT_RESPONSE_WORDS
+    ):
+        self.latency = latency
+        self.text = " ".join(
+            ["I hear you, and what you're feeling makes sense."]
+            * (response_words // 10 + 1)
+        )
+
+    def generate_content(
+        self, prompt: str, generation_config=None, stream: bool = False, **kwargs
+    ):
+        if stream:
+            return self._stream(prompt)
+        self.latency.sleep()
+        return FakeResponse(self.text, prompt)
+
+    def _stream(self, prompt: str):
+        # Spread the sampled latency over ten chunks of the response
+        words = self.text.split(" ")
+        step = len(words) // 10 + 1
+        delay = self.latency.sample() / 10
+        for start in range(0, len(words), step):
+            time.sleep(delay)
+            yield FakeResponse(" ".join(words[start : start + step]) + " ", prompt)
+
+
+def load_fake_chunks(
+    directory: str, embedding_model: FakeEmbeddingModel
+) -> List[Dict[str, Any]]:
+    """Chunk the knowledge base text files and embed them with the fake encoder."""
+    from text_to_vector_db import chunk_text
+
+    chunks = []
+    for file_path in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+        with open(file_path, "r", encoding="utf-8") as file:
+            texts = chunk_text(file.read())
+        for i, text in enumerate(texts):
+            chunks.append(
+                {
+                    "_id": f"{os.path.basename(file_path)}:{i}",
+                    "file_path": os.path.basename(file_path),
+                    "chunk_index": i,
+                    "chunk_text": text,
+                    "$vector": embedding_model._embed(text).tolist(),
+                }
+            )
+    return chunks
+
+
+def install_fake_backends(
+    dataset_dir: str = "dataset",
+    embed_latency: str = DEFAULT_EMBED_LATENCY,
+    connect_latency: str = DEFAULT_CONNECT_LATENCY,
+    search_latency: str = DEFAULT_SEARCH_LATENCY,
+    gemini_latency: str = DEFAULT_GEMINI_LATENCY,
+    response_words: int = DEFAULT_RESPONSE_WORDS,
+    seed: Optional[int] = None,
+):
+    """
+    Replace the embedding model, AstraDB and Gemini with local stand-ins.
+
+    Args:
+        dataset_dir: Directory of .txt files to serve as the knowledge base
+        embed_latency: Latency distribution of one encoder call
+        connect_latency: Latency distribution of connect_to_astradb
+        search_latency: Latency distribution of one vector search
+        gemini_latency: Latency distribution of one Gemini generation
+        response_words: Approximate length of generated responses
+        seed: Seed for the latency samplers
+    """
+    import bm25_index
+    import prefetch
+    import response_cache
+    import retrieval
+    import text_to_vector_db
+    import therapeutic_assistant
+
+    embedding_model = FakeEmbeddingModel(LatencyDistribution(embed_latency, seed))
+    chunks = load_fake_chunks(dataset_dir, embedding_model)
+    database = FakeDatabase(
+        FakeCollection(chunks, LatencyDistribution(search_latency, seed))
+    )
+    connect = LatencyDistribution(connect_latency, seed)
+    model = FakeGenerativeModel(
+        LatencyDistribution(gemini_latency, seed), response_words
+    )
+
+    def fake_connect_to_astradb():
+        connect.sleep()
+        return database
+
+    text_to_vector_db.get_embedding_model = lambda *args, **kwargs: embedding_model
+    retrieval.get_embedding_model = text_to_vector_db.get_embedding_model
+    therapeutic_assistant.connect_to_astradb = fake_connect_to_astradb
+    prefetch.connect_to_astradb = fake_connect_to_astradb
+    therapeutic_assistant.get_generative_model = lambda *args, **kwargs: model
+    bm25_index._cached_indexes[bm25_index.BM25_INDEX_PATH] = BM25Index.build(chunks)
+    # Ignore any versioned knowledge base built locally
+    therapeutic_assistant.get_active_index = lambda *args, **kwargs: DEFAULT_INDEX
+    response_cache.get_active_index = therapeutic_assistant.get_active_index
+
+
+def load_traces(
+    paths: List[str], sample: Optional[int] = None, seed: Optional[int] = None
+) -> List[List[str]]:
+    """
+    Load conversation traces as lists of user messages.
+
+    Accepts conversation JSON files (or directories of them) with a "messages"
+    list, conversation archives (see conversation_archive.py), and JSONL files
+    with one message per line in a "message", "body" or "content" field.
+    JSONL lines sharing a "session_id" or "conversation_id" form one
+    conversation; other lines are single-turn conversations.
+
+    Args:
+        paths: Files or directories to load
+        sample: Only keep a random sample of this many conversations; archives
+                are sampled through their index instead of being read whole
+        seed: Random seed for the sample
+
+    Returns:
+        List of conversations, each a list of user messages in order
+    """
+    traces = []
+    for path in paths:
+        if ConversationArchive.exists(path):
+            archive = ConversationArchive(path)
+            conversations = (
+                archive.sample(sample, seed) if sample else archive.conversations()
+            )
+            for conversation in conversations:
+                messages = [
+                    m["content"]
+                    for m in conversation["messages"]
+                    if m["role"] == "user"
+                ]
+                if messages:
+                    traces.append(messages)
+            continue
+
+        files = (
+            sorted(glob.glob(os.path.join(path, "*.json")))
+            if os.path.isdir(path)
+            else [path]
+        )
+        for file_path in files:
+            with open(file_path, "r", encoding="utf-8") as file:
+                if file_path.endswith(".jsonl"):
+                    sessions: Dict[str, List[str]] = {}
+                    for line_number, line in enumerate(file):
+                        if not line.strip():
+                            continue
+                        entry = json.loads(line)
+                        message = (
+                            entry.get("message")
+                            or entry.get("body")
+                            or entry.get("content")
+                        )
+                        if not message:
+                            continue
+                        key = (
+                            entry.get("session_id")
+                            or entry.get("conversation_id")
+                            or f"line-{line_number}"
+                        )
+                        sessions.setdefault(str(key), []).append(message)
+                    traces.extend(sessions.values())
+                else:
+                    conversation = json.load(file)
+                    messages = [
+                        m["content"]
+                        for m in conversation.get("messages", [])
+                        if m["role"] == "user"
+                    ]
+                    if messages:
+                        traces.append(messages)
+
+    if sample and len(traces) > sample:
+        traces = random.Random(seed).sample(traces, sample)
+    return traces
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Return count, mean and p50/p95/p99 of a list of millisecond timings."""
+    if not values:
+        return {"count": 0}
+    array = np.array(values)
+    return {
+        "count": len(values),
+        "mean_ms": float(array.mean()),
+        "p50_ms": float(np.percentile(array, 50)),
+        "p95_ms": float(np.percentile(array, 95)),
+        "p99_ms": float(np.percentile(array, 99)),
+    }
+
+
+class BenchmarkRecorder:
+    """Thread-safe collector of per-request timings."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.end_to_end: List[float] = []
+        self.stages: Dict[str, List[float]] = {}
+        self.errors = 0
+
+    def record(self, elapsed_ms: float, timings: Dict[str, float], ok: bool = True):
+        with self.lock:
+            self.end_to_end.append(elapsed_ms)
+            for stage, ms in timings.items():
+                self.stages.setdefault(stage, []).append(ms)
+            if not ok:
+                self.errors += 1
+
+
+def replay_function(
+    trace: List[str], recorder: BenchmarkRecorder, language: str, temperature: float
+):
+    """Replay one conversation by calling generate_therapeutic_response directly."""
+    from therapeutic_assistant import generate_therapeutic_response
+
+    history = []
+    for message in trace:
+        start = time.perf_counter()
+        result = generate_therapeutic_response(
+            message,
+            conversation_history=history,
+            language=language,
+            temperature=temperature,
+        )
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        recorder.record(elapsed_ms, result["timings"], ok=not result.get("error"))
+        history.append({"role": "user", "content": message})
+        history.append({"role": "assistant", "content": result["response"]})
+
+
+# Stage timings of the response generated by the current thread's Flask request
+_flask_timings = threading.local()
+
+
+def replay_flask(
+    trace: List[str],
+    recorder: BenchmarkRecorder,
+    language: str,
+    temperature: float,
+    prefetch_lead: float = 0.0,
+):
+    """
+    Replay one conversation through the Flask endpoints with its own session.
+
+    With prefetch_lead, each message is first sent to /api/prefetch as a
+    draft, and sent for real that many seconds later, as if the user paused
+    typing and then pressed send. The pause isn't part of the measured latency.
+    """
+    import app_flask
+
+    client = app_flask.app.test_client()
+    client.post("/api/set_language", json={"language": language})
+    client.post("/api/set_temperature", json={"temperature": temperature})
+
+    for generation, message in enumerate(trace):
+        if prefetch_lead:
+            client.post(
+                "/api/prefetch", json={"text": message, "generation": generation}
+            )
+            time.sleep(prefetch_lead)
+        _flask_timings.value = {}
+        start = time.perf_counter()
+        response = client.post(
+            "/api/send_message", json={"message": message}, buffered=False
+        )
+        safety_ms = None
+        if response.mimetype == "application/x-ndjson":
+            # Crisis messages: the safety line comes first, then the reply
+            reply = {}
+            for line in response.response:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if "safety" in data:
+                    safety_ms = (time.perf_counter() - start) * 1000
+                else:
+                    reply = data
+        else:
+            reply = response.get_json(silent=True) or {}
+        response.close()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        timings = dict(_flask_timings.value)
+        if safety_ms is not None:
+            timings["safety_ms"] = safety_ms
+        # Messages turned away by admission control count as errors
+        ok = (
+            response.status_code == 200
+            and not reply.get("shed")
+            and not reply.get("error")
+        )
+        recorder.record(elapsed_ms, timings, ok=ok)
+
+
+def _record_flask_timings():
+    """Wrap the Flask app's response generator so stage timings can be collected."""
+    import app_flask
+
+    generate = app_flask.generate_admitted_response
+
+    def recording_generate(*args, **kwargs):
+        result = generate(*args, **kwargs)
+        _flask_timings.value = result.get("timings", {})
+        return result
+
+    app_flask.generate_admitted_response = recording_generate
+
+
+def isolate_conversations():
+    """Point the Flask app at a throwaway conversation store for the run."""
+    import app_flask
+    from conversation_store import ConversationStore
+
+    directory = tempfile.mkdtemp(prefix="echomind-benchmark-")
+    app_flask.conversation_store = ConversationStore(
+        os.path.join(directory, "conversations.db")
+    )
+
+
+def prepare_login_load(users: int):
+    """
+    Point the Flask app at a throwaway user store holding the login scenario's users.
+
+    Rate limiting is lifted so only password hashing limits the login rate.
+    """
+    import app_flask
+    from throttle import TokenBucketLimiter
+    from user_store import UserStore
+
+    directory = tempfile.mkdtemp(prefix="echomind-benchmark-")
+    app_flask.user_store = UserStore(os.path.join(directory, "users.db"))
+    for worker in range(users):
+        app_flask.user_store.create_user(
+            f"Benchmark {worker}", f"bench-{worker}@example.com", BENCHMARK_PASSWORD
+        )
+    for name in ("ip_limiter", "account_limiter"):
+        setattr(app_flask, name, TokenBucketLimiter(name, float("inf"), 1.0))
+
+
+def login_load(worker: int, recorder: BenchmarkRecorder, stop: threading.Event):
+    """Log in through the Flask endpoint over and over until `stop` is set."""
+    import app_flask
+
+    client = app_flask.app.test_client()
+    credentials = {
+        "email": f"bench-{worker}@example.com",
+        "password": BENCHMARK_PASSWORD,
+    }
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = client.post("/api/auth/login", json=credentials)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        recorder.record(elapsed_ms, {}, ok=response.status_code == 200)
+
+
+def run_benchmark(
+    traces: List[List[str]],
+    target: str = "function",
+    concurrency: int = 4,
+    iterations: int = 1,
+    language: str = "english",
+    temperature: float = 0.3,
+    login_concurrency: int = 0,
+    prefetch_lead: float = 0.0,
+) -> Dict[str, Any]:
+    """
+    Replay traces concurrently and measure latency and throughput.
+
+    With login_concurrency, that many clients also log in continuously while
+    the traces are replayed, to measure login latency under chat load (and
+    the chat latency cost of the password hashing).
+
+    Args:
+        traces: Conversations to replay, as returned by load_traces
+        target: "function" to call generate_therapeutic_response, or "flask"
+                to go through the /api/send_message endpoint
+        concurrency: Number of conversations replayed at the same time
+        iterations: Number of times to replay the whole set of traces
+        language: Session language
+        temperature: Session temperature
+        login_concurrency: Number of clients logging in during the replay
+        prefetch_lead: Seconds between prefetching each message as a draft and
+                       sending it (flask target only; 0 disables prefetching)
+
+    Returns:
+        Machine-readable results with requests/s and per-stage percentiles
+    """
+    if target == "flask":
+        isolate_conversations()
+        _record_flask_timings()
+        replay = partial(replay_flask, prefetch_lead=prefetch_lead)
+    else:
+        replay = replay_function
+
+    recorder = BenchmarkRecorder()
+    login_recorder = BenchmarkRecorder()
+    jobs = traces * iterations
+
+    stop_logins = threading.Event()
+    login_threads = []
+    if login_concurrency:
+        prepare_login_load(login_concurrency)
+        for worker in range(login_concurrency):
+            thread = threading.Thread(
+                target=login_load, args=(worker, login_recorder, stop_logins)
+            )
+            thread.start()
+            login_threads.append(thread)
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(replay, trace, recorder, language, temperature)
+                for trace in jobs
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        stop_logins.set()
+        for thread in login_threads:
+            thread.join()
+    duration = time.perf_counter() - start
+
+    requests = len(recorder.end_to_end)
+    results = {
+        "target": target,
+        "concurrency": concurrency,
+        "conversations": len(jobs),
+        "requests": requests,
+        "errors": recorder.errors,
+        "duration_s": duration,
+        "requests_per_s": requests / duration if duration else 0.0,
+        "end_to_end": summarize(recorder.end_to_end),
+        "stages": {
+            stage: summarize(values)
+            for stage, values in sorted(recorder.stages.items())
+        },
+    }
+    if target == "flask" and prefetch_lead:
+        from prefetch import prefetcher
+
+        results["prefetch"] = {"lead_s": prefetch_lead, **prefetcher.stats()}
+    from response_cache import response_cache
+
+    if response_cache.enabled:
+        results["response_cache"] = response_cache.stats()
+    if login_concurrency:
+        results["login"] = {
+            "concurrency": login_concurrency,
+            "errors": login_recorder.errors,
+            **summarize(login_recorder.end_to_end),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline EchoMind latency benchmark")
+    parser.add_argument(
+        "traces",
+        nargs="*",
+        default=["conversations"],
+        help="Conversation JSON/JSONL files, directories or archives",
+    )
+    parser.add_argument("--target", choices=["function", "flask"], default="function")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=1)
+    parser.add_argument(
+        "--sample", type=int, help="Replay a random sample of this many conversations"
+    )
+    parser.add_argument("--language", default="english")
+    parser.add_argument("--temperature", type=float, default=0.3)
+    parser.add_argument(
+        "--login-concurrency",
+        type=int,
+        default=0,
+        help="Clients logging in continuously during the replay",
+    )
+    parser.add_argument(
+        "--prefetch-lead",
+        type=float,
+        default=0.0,
+        help="Prefetch each message this many seconds before sending it (flask target)",
+    )
+    parser.add_argument(
+        "--dataset",
+        default="dataset",
+        help="Knowledge base directory for the fake vector store",
+    )
+    parser.add_argument("--embed-latency", default=DEFAULT_EMBED_LATENCY)
+    parser.add_argument("--connect-latency", default=DEFAULT_CONNECT_LATENCY)
+    parser.add_argument("--search-latency", default=DEFAULT_SEARCH_LATENCY)
+    parser.add_argument("--gemini-latency", default=DEFAULT_GEMINI_LATENCY)
+    parser.add_argument("--response-words", type=int, default=DEFAULT_RESPONSE_WORDS)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--output", help="Write results JSON to this file instead of stdout"
+    )
+    args = parser.parse_args()
+
+    # Keep Flask sessions in a throwaway directory so no Redis server is needed
+    if args.target == "flask" or args.login_concurrency:
+        os.environ.setdefault("SESSION_TYPE", "filesystem")
+        os.environ.setdefault(
+            "SESSION_FILE_DIR", tempfile.mkdtemp(prefix="echomind-benchmark-")
+        )
+
+    traces = load_traces(args.traces, sample=args.sample, seed=args.seed)
+    if not traces:
+        print("No conversation traces found.", file=sys.stderr)
+        sys.exit(1)
+
+    install_fake_backends(
+        dataset_dir=args.dataset,
+        embed_latency=args.embed_latency,
+        connect_latency=args.connect_latency,
+        search_latency=args.search_latency,
+        gemini_latency=args.gemini_latency,
+        response_words=args.response_words,
+        seed=args.seed,
+    )
+
+    results = run_benchmark(
+        traces,
+        target=args.target,
+        concurrency=args.concurrency,
+        iterations=args.iterations,
+        language=args.language,
+        temperature=args.temperature,
+        login_concurrency=args.login_concurrency,
+        prefetch_lead=args.prefetch_lead,
+    )
+    results["latency_config"] = {
+        "embed": args.embed_latency,
+        "connect": args.connect_latency,
+        "search": args.search_latency,
+        "gemini": args.gemini_latency,
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
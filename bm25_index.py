@@ -0,0 +1,641 @@
+import os
+import re
+import json
+import time
+import unicodedata
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+# Configuration
+BM25_INDEX_PATH = "bm25_index"  # Directory the lexical index is saved to
+BM25_K1 = 1.5  # Term frequency saturation
+BM25_B = 0.75  # Document length normalization
+RRF_K = 60  # Rank constant for reciprocal rank fusion
+
+# Very common words that carry no retrieval signal
+STOPWORDS = {
+    "english": {
+        "a",
+        "about",
+        "am",
+        "an",
+        "and",
+        "are",
+        "as",
+        "at",
+        "be",
+        "been",
+        "but",
+        "by",
+        "can",
+        "do",
+        "does",
+        "for",
+        "from",
+        "had",
+        "has",
+        "have",
+        "he",
+        "her",
+        "him",
+        "his",
+        "how",
+        "i",
+        "if",
+        "im",
+        "in",
+        "into",
+        "is",
+        "it",
+        "its",
+        "me",
+        "my",
+        "of",
+        "on",
+        "or",
+        "our",
+        "she",
+        "so",
+        "that",
+        "the",
+        "their",
+        "them",
+        "there",
+        "they",
+        "this",
+        "to",
+        "was",
+        "we",
+        "were",
+        "what",
+        "when",
+        "which",
+        "who",
+        "will",
+        "with",
+        "you",
+        "your",
+    },
+    "french": {
+        "a",
+        "au",
+        "aux",
+        "avec",
+        "ce",
+        "ces",
+        "cette",
+        "dans",
+        "de",
+        "des",
+        "du",
+        "elle",
+        "en",
+        "est",
+        "et",
+        "être",
+        "il",
+        "ils",
+        "je",
+        "la",
+        "le",
+        "les",
+        "leur",
+        "lui",
+        "ma",
+        "mais",
+        "me",
+        "mes",
+        "moi",
+        "mon",
+        "ne",
+        "nous",
+        "on",
+        "ou",
+        "par",
+        "pas",
+        "pour",
+        "qu",
+        "que",
+        "qui",
+        "sa",
+        "se",
+        "ses",
+        "son",
+        "sur",
+        "ta",
+        "te",
+        "tes",
+        "toi",
+        "ton",
+        "tu",
+        "un",
+        "une",
+        "vos",
+        "votre",
+        "vous",
+        "y",
+    },
+    "arabic": {
+        "في",
+        "من",
+        "على",
+        "الى",
+        "عن",
+        "مع",
+        "هذا",
+        "هذه",
+        "ذلك",
+        "تلك",
+        "التي",
+        "الذي",
+        "هو",
+        "هي",
+        "انا",
+        "انت",
+        "نحن",
+        "هم",
+        "ما",
+        "لا",
+        "لم",
+        "لن",
+        "ان",
+        "او",
+        "ثم",
+        "كان",
+        "كانت",
+        "قد",
+        "كل",
+        "بعد",
+        "قبل",
+        "عند",
+        "اذا",
+    },
+}
+
+# French elided articles and pronouns (l'anxiété -> anxiété)
+FRENCH_ELISIONS = ("l'", "d'", "j'", "m'", "n'", "s'", "t'", "c'", "qu'")
+
+# Arabic definite article and attached prepositions, longest first
+ARABIC_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+ARABIC_DIACRITICS = re.compile(r"[\u064B-\u0652\u0670\u0640]")
+ARABIC_CHARS = re.compile(r"[\u0600-\u06FF]")
+TOKEN_PATTERN = re.compile(r"[\w']+", re.UNICODE)
+
+# Lazily loaded indexes shared by all queries in this process, by directory
+_cached_indexes: Dict[str, "BM25Index"] = {}
+
+
+def detect_language(text: str) -> str:
+    """
+    Guess whether a text is English, French or Arabic.
+
+    Args:
+        text: The text to inspect
+
+    Returns:
+        One of "english", "french" or "arabic"
+    """
+    letters = [ch for ch in text if ch.isalpha()]
+    if not letters:
+        return "english"
+
+    # Arabic script is unambiguous
+    arabic_letters = sum(1 for ch in letters if ARABIC_CHARS.match(ch))
+    if arabic_letters / len(letters) > 0.3:
+        return "arabic"
+
+    # Compare stopword hits for the two Latin-script languages
+    words = TOKEN_PATTERN.findall(text.lower())
+    french_hits = sum(1 for w in words if w in STOPWORDS["french"])
+    english_hits = sum(1 for w in words if w in STOPWORDS["english"])
+    if re.search(r"[éèêàùçôîœ]", text.lower()):
+        french_hits += 1
+
+    return "french" if french_hits > english_hits else "english"
+
+
+def _normalize_arabic(token: str) -> str:
+    """Strip diacritics, unify letter variants and remove the definite article."""
+    token = ARABIC_DIACRITICS.sub("", token)
+    token = re.sub("[أإآ]", "ا", token)
+    token = token.replace("ى", "ي").replace("ة", "ه")
+    for prefix in ARABIC_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix) :]
+    return token
+
+
+def _stem_english(token: str) -> str:
+    """Light suffix stripping so plurals and verb forms share a term."""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 5 and token.endswith("ing"):
+        return token[:-3]
+    if len(token) > 4 and token.endswith("ed"):
+        return token[:-2]
+    if (
+        len(token) > 3
+        and token.endswith("s")
+        and not token.endswith(("ss", "us", "is"))
+    ):
+        return token[:-1]
+    return token
+
+
+def _stem_french(token: str) -> str:
+    """Light plural stripping for French nouns and adjectives."""
+    if len(token) > 3 and token[-1] in "sx":
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str, language: Optional[str] = None) -> List[str]:
+    """
+    Split text into normalized search terms.
+
+    Args:
+        text: The text to tokenize
+        language: Language of the text; detected automatically if not given
+
+    Returns:
+        List of terms with stopwords removed
+    """
+    if language is None:
+        language = detect_language(text)
+
+    text = unicodedata.normalize("NFKC", text).lower().replace("’", "'")
+    stopwords = STOPWORDS.get(language, STOPWORDS["english"])
+
+    terms = []
+    for token in TOKEN_PATTERN.findall(text):
+        # Arabic words are normalized by script, whatever the session language
+        if ARABIC_CHARS.match(token):
+            token = _normalize_arabic(token)
+            if token in STOPWORDS["arabic"]:
+                continue
+            terms.append(token)
+            continue
+
+        if language == "french":
+            for elision in FRENCH_ELISIONS:
+                if token.startswith(elision):
+                    token = token[len(elision) :]
+                    break
+        token = token.strip("'").replace("'", "")
+
+        if not token or token in stopwords:
+            continue
+
+        if language == "french":
+            token = _stem_french(token)
+        else:
+            token = _stem_english(token)
+        terms.append(token)
+
+    return terms
+
+
+class BM25Index:
+    """
+    In-process inverted index scored with Okapi BM25.
+
+    Postings are stored as flat numpy arrays (one slice per term) so a query
+    only touches the documents that contain its terms.
+    """
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        term_offsets: np.ndarray,
+        postings_docs: np.ndarray,
+        postings_tf: np.ndarray,
+        doc_lengths: np.ndarray,
+        documents: List[Dict[str, Any]],
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ):
+        self.vocabulary = vocabulary
+        self.term_offsets = term_offsets
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf
+        self.doc_lengths = doc_lengths
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+
+        # Precompute the parts of the BM25 formula that don't depend on the query
+        num_docs = len(documents)
+        doc_freqs = np.diff(term_offsets).astype(np.float32)
+        self.idf = np.log1p((num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        avg_length = float(doc_lengths.mean()) if num_docs else 0.0
+        self.length_norm = k1 * (1 - b + b * doc_lengths / max(avg_length, 1.0))
+
+    @classmethod
+    def build(
+        cls,
+        chunks: List[Dict[str, Any]],
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        language: Optional[str] = None,
+    ) -> "BM25Index":
+        """
+        Build an index from ingested chunks.
+
+        Args:
+            chunks: Chunk dictionaries as produced by process_text_files
+            k1: Term frequency saturation parameter
+            b: Document length normalization parameter
+            language: Language of the chunks, so they are stemmed like the
+                      queries searching them (detected per chunk if not given)
+
+        Returns:
+            A BM25Index over the chunk texts
+        """
+        term_postings: Dict[str, List[tuple]] = {}
+        doc_lengths = []
+        documents = []
+
+        for doc_id, chunk in enumerate(chunks):
+            terms = tokenize(chunk["chunk_text"], language)
+            doc_lengths.append(len(terms))
+            documents.append(
+                {
+                    "_id": chunk["_id"],
+                    "file_path": chunk["file_path"],
+                    "chunk_index": chunk["chunk_index"],
+                    "chunk_text": chunk["chunk_text"],
+                }
+            )
+
+            counts: Dict[str, int] = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                term_postings.setdefault(term, []).append((doc_id, count))
+
+        # Flatten the postings lists into CSR-style arrays
+        vocabulary = {}
+        offsets = [0]
+        docs = []
+        tfs = []
+        for term_id, term in enumerate(sorted(term_postings)):
+            vocabulary[term] = term_id
+            for doc_id, count in term_postings[term]:
+                docs.append(doc_id)
+                tfs.append(count)
+            offsets.append(len(docs))
+
+        return cls(
+            vocabulary=vocabulary,
+            term_offsets=np.array(offsets, dtype=np.int64),
+            postings_docs=np.array(docs, dtype=np.int32),
+            postings_tf=np.array(tfs, dtype=np.float32),
+            doc_lengths=np.array(doc_lengths, dtype=np.float32),
+            documents=documents,
+            k1=k1,
+            b=b,
+        )
+
+    def search(
+        self, query: str, limit: int = 5, language: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Find the chunks that best match the query terms.
+
+        Args:
+            query: Text to search for
+            limit: Maximum number of results to return
+            language: Language of the query; detected automatically if not given
+
+        Returns:
+            List of chunk dictionaries with a "$bm25_score" key, best first
+        """
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        matched = False
+
+        for term in set(tokenize(query, language)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end]
+            scores[docs] += (
+                self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.length_norm[docs])
+            )
+            matched = True
+
+        if not matched:
+            return []
+
+        # Partial sort: only the top `limit` candidates need ordering
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > limit:
+            top = np.argpartition(-scores[candidates], limit - 1)[:limit]
+            candidates = candidates[top]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        return [{**self.documents[i], "$bm25_score": float(scores[i])} for i in ranked]
+
+    def save(self, path: str = BM25_INDEX_PATH):
+        """
+        Save the index to a directory.
+
+        Args:
+            path: Directory to write the index files to
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "term_offsets.npy"), self.term_offsets)
+        np.save(os.path.join(path, "postings_docs.npy"), self.postings_docs)
+        np.save(os.path.join(path, "postings_tf.npy"), self.postings_tf)
+        np.save(os.path.join(path, "doc_lengths.npy"), self.doc_lengths)
+
+        vocabulary = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "k1": self.k1,
+                    "b": self.b,
+                    "vocabulary": vocabulary,
+                    "documents": self.documents,
+                },
+                file,
+                ensure_ascii=False,
+            )
+
+    @classmethod
+    def load(
+        cls, path: str = BM25_INDEX_PATH, mmap_mode: Optional[str] = None
+    ) -> "BM25Index":
+        """
+        Load an index previously written with save().
+
+        Args:
+            path: Directory containing the index files
+            mmap_mode: Memory-map the postings arrays instead of copying them
+                       into memory ("r" for read-only); mapped pages are shared
+                       between all processes that load the same files
+
+        Returns:
+            The loaded BM25Index
+        """
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as file:
+            meta = json.load(file)
+
+        def load_array(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        return cls(
+            vocabulary={term: i for i, term in enumerate(meta["vocabulary"])},
+            term_offsets=load_array("term_offsets"),
+            postings_docs=load_array("postings_docs"),
+            postings_tf=load_array("postings_tf"),
+            doc_lengths=load_array("doc_lengths"),
+            documents=meta["documents"],
+            k1=meta["k1"],
+            b=meta["b"],
+        )
+
+
+def get_bm25_index(
+    path: str = BM25_INDEX_PATH, mmap_mode: Optional[str] = "r"
+) -> Optional[BM25Index]:
+    """
+    Return the process-wide BM25 index stored in a directory, loading it on
+    first use.
+
+    Args:
+        path: Directory containing the index files
+        mmap_mode: How to map the postings arrays (see BM25Index.load)
+
+    Returns:
+        The index, or None if it hasn't been built yet
+    """
+    index = _cached_indexes.get(path)
+    if index is None:
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        index = _cached_indexes[path] = BM25Index.load(path, mmap_mode=mmap_mode)
+    return index
+
+
+def release_bm25_index(path: str):
+    """
+    Drop a cached index, e.g. once a newer knowledge base version replaced it.
+
+    Args:
+        path: Directory the index was loaded from
+    """
+    _cached_indexes.pop(path, None)
+
+
+def reciprocal_rank_fusion(
+    result_lists: List[List[Dict[str, Any]]],
+    limit: int = 5,
+    k: int = RRF_K,
+) -> List[Dict[str, Any]]:
+    """
+    Merge several ranked result lists with reciprocal rank fusion.
+
+    Each document scores sum(1 / (k + rank)) over the lists it appears in,
+    so results ranked highly by either retriever rise to the top.
+
+    Args:
+        result_lists: Ranked lists of chunk dictionaries keyed by "_id"
+        limit: Maximum number of fused results to return
+        k: Rank constant; larger values flatten the contribution of top ranks
+
+    Returns:
+        Fused list of chunk dictionaries with a "$rrf_score" key, best first
+    """
+    fused_scores: Dict[str, float] = {}
+    merged: Dict[str, Dict[str, Any]] = {}
+
+    for results in result_lists:
+        for rank, doc in enumerate(results, 1):
+            doc_id = doc["_id"]
+            fused_scores[doc_id] = fused_scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+            # Keep every retriever's fields (e.g. $similarity and $bm25_score)
+            merged.setdefault(doc_id, {}).update(doc)
+
+    ranked = sorted(fused_scores, key=fused_scores.get, reverse=True)[:limit]
+    return [{**merged[doc_id], "$rrf_score": fused_scores[doc_id]} for doc_id in ranked]
+
+
+def benchmark_query_latency(
+    index: BM25Index, queries: List[str], repeat: int = 100, limit: int = 5
+) -> Dict[str, float]:
+    """
+    Measure BM25 query latency over a set of sample queries.
+
+    Args:
+        index: The index to query
+        queries: Sample queries to run
+        repeat: Number of times to run each query
+        limit: Number of results requested per query
+
+    Returns:
+        Dictionary with mean, p50, p95 and p99 latency in microseconds
+    """
+    timings = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, limit=limit)
+            timings.append((time.perf_counter() - start) * 1e6)
+
+    timings = np.array(timings)
+    return {
+        "queries": len(timings),
+        "mean_us": float(timings.mean()),
+        "p50_us": float(np.percentile(timings, 50)),
+        "p95_us": float(np.percentile(timings, 95)),
+        "p99_us": float(np.percentile(timings, 99)),
+    }
+
+
+def main():
+    index = get_bm25_index()
+    if index is None:
+        print(
+            f"No BM25 index found at '{BM25_INDEX_PATH}'. "
+            "Run text_to_vector_db.py to ingest your text files first."
+        )
+        return
+
+    print(
+        f"Loaded BM25 index: {len(index.documents)} chunks, "
+        f"{len(index.vocabulary)} terms"
+    )
+
+    sample_queries = [
+        "CBT",
+        "panic attack",
+        "exams",
+        "I feel anxious about my exams",
+        "l'anxiété me paralyse",
+        "أشعر بالقلق",
+    ]
+    stats = benchmark_query_latency(index, sample_queries)
+    print(
+        f"{stats['queries']} queries: mean {stats['mean_us']:.1f}µs, "
+        f"p50 {stats['p50_us']:.1f}µs, p95 {stats['p95_us']:.1f}µs, "
+        f"p99 {stats['p99_us']:.1f}µs"
+    )
+
+    while True:
+        query = input("\nEnter a search query (or 'quit' to exit): ")
+        if query.lower() == "quit":
+            break
+
+        for i, result in enumerate(index.search(query), 1):
+            print(
+                f"\n{i}. From: {result['file_path']} (score {result['$bm25_score']:.2f})"
+            )
+            print(f"Chunk: {result['chunk_text'][:200]}...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import os
+
+if __name__ == "__main__":
+    # sentence-transformers imports libraries that need the unpatched select
+    # module (epoll), so load it first; models are loaded once at startup
+    import sentence_transformers
+
+    # Patch the standard library before anything else imports it, and keep
+    # Gemini off gRPC, whose blocking calls can't yield to other connections
+    import eventlet
+
+    eventlet.monkey_patch()
+    os.environ.setdefault("GEMINI_TRANSPORT", "rest")
+
+import eventlet
+import eventlet.wsgi
+
+from app_flask import app
+
+
+def main():
+    """Serve the app, with the WebSocket chat channel, on the eventlet server."""
+    host, _, port = os.environ.get("ECHOMIND_BIND", "0.0.0.0:5000").rpartition(":")
+    print(f"Serving EchoMind with the WebSocket chat channel on {host}:{port}")
+    eventlet.wsgi.server(eventlet.listen((host, int(port))), app)
+
+
+if __name__ == "__main__":
+    main()
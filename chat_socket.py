@@ -0,0 +1,340 @@
+import os
+
+import json
+from typing import Dict, Any
+from urllib.parse import urlsplit
+
+import eventlet
+from eventlet.semaphore import Semaphore
+from eventlet.websocket import WebSocketWSGI
+from flask import session
+
+from admission import client_key, generate_admitted_response
+from prefetch import prefetcher
+from conversation_store import conversation_store, session_conversation_id
+from telemetry import increment, register_gauge, span
+from therapeutic_assistant import (
+    SUPPORTED_LANGUAGES,
+    generate_positive_reflection,
+    get_not_enough_history_text,
+)
+
+# Configuration
+CHAT_SOCKET_PATH = "/ws"  # URL of the WebSocket chat channel
+WRITE_BEHIND_SECONDS = 2.0  # How long session changes may stay unsaved
+REFLECTION_EVERY = 3  # Push a reflection after every this many user messages
+# Pages allowed to open the channel besides the app's own host, comma-separated
+# (e.g. "https://echomind.example" behind a proxy that rewrites Host)
+ALLOWED_ORIGINS = {
+    origin.strip().rstrip("/").lower()
+    for origin in os.environ.get("CHAT_SOCKET_ALLOWED_ORIGINS", "").split(",")
+    if origin.strip()
+}
+
+# Session keys held by a connection, with their defaults
+SESSION_DEFAULTS = {
+    "language": "english",
+    "temperature": 0.3,
+    "tts_enabled": False,
+    "theme": "light",
+    "reflection": None,
+}
+
+_open_connections = 0
+
+
+class ChatConnection:
+    """
+    State of one WebSocket chat connection.
+
+    The connection reads the user's Flask session once when it opens and then
+    works on its in-memory copy; messages go straight to the conversation
+    store. Changes are written back to the session at most every
+    WRITE_BEHIND_SECONDS, and when the connection closes. Only the keys the
+    connection changed are written, so settings changed over HTTP in the
+    meantime are kept. This needs server-side sessions (Flask-Session); with
+    cookie sessions, changes last only as long as the connection.
+    """
+
+    def __init__(self, app, ws):
+        self.app = app
+        self.ws = ws
+        self.send_lock = Semaphore()
+        self.dirty = set()
+        self.generating = False
+        self.closed = False
+        with app.request_context(ws.environ):
+            self.client = client_key()
+            new_conversation = "conversation_id" not in session
+            self.state = {
+                key: session.get(key, default)
+                for key, default in SESSION_DEFAULTS.items()
+            }
+            self.state["conversation_id"] = session_conversation_id()
+        if new_conversation:
+            self.dirty.add("conversation_id")
+        self.handlers = {
+            "message": self.on_message,
+            "settings": self.on_settings,
+            "reflection": self.on_reflection,
+            "clear": self.on_clear,
+            "prefetch": self.on_prefetch,
+        }
+
+    def send(self, payload: Dict[str, Any]):
+        """Send a JSON message to the client, ignoring closed connections."""
+        if self.closed:
+            return
+        with self.send_lock:
+            try:
+                self.ws.send(json.dumps(payload, ensure_ascii=False))
+            except OSError:
+                self.closed = True
+
+    def send_error(self, request: str, error: str):
+        """Tell the client that one of its requests failed."""
+        self.send({"type": "error", "request": request, "error": error})
+
+    def update(self, **changes):
+        """Change session values in memory; they are saved by the next flush."""
+        self.state.update(changes)
+        self.dirty.update(changes)
+
+    def flush(self):
+        """Write the changed session values back to the Flask session."""
+        if not self.dirty:
+            return
+        changed, self.dirty = self.dirty, set()
+        with span("session_flush"):
+            with self.app.request_context(self.ws.environ):
+                for key in changed:
+                    session[key] = self.state[key]
+                self.app.session_interface.save_session(
+                    self.app, session, self.app.response_class()
+                )
+
+    def settings(self) -> Dict[str, Any]:
+        return {
+            key: self.state[key]
+            for key in ("language", "temperature", "tts_enabled", "theme")
+        }
+
+    def run(self):
+        """Handle the client's messages until the connection closes."""
+        global _open_connections
+        _open_connections += 1
+        flusher = eventlet.spawn(self._flush_periodically)
+        self.send({"type": "ready", "settings": self.settings()})
+        try:
+            while True:
+                raw = self.ws.wait()
+                if raw is None:
+                    break
+                try:
+                    data = json.loads(raw)
+                    handler = self.handlers[data["type"]]
+                except (ValueError, KeyError, TypeError):
+                    self.send_error("", "Unknown message")
+                    continue
+                increment("echomind_websocket_messages_total", type=data["type"])
+                handler(data)
+        finally:
+            self.closed = True
+            _open_connections -= 1
+            flusher.kill()
+            self.flush()
+
+    def _flush_periodically(self):
+        while not self.closed:
+            eventlet.sleep(WRITE_BEHIND_SECONDS)
+            self.flush()
+
+    def on_message(self, data: Dict[str, Any]):
+        """Generate a response to a chat message, streaming it token by token."""
+        message = (data.get("message") or "").strip()
+        if not message:
+            self.send_error("message", "Message is required")
+            return
+        if self.generating:
+            self.send_error("message", "Please wait for the current response")
+            return
+        self.generating = True
+        eventlet.spawn(self._respond, message)
+
+    def _respond(self, message: str):
+        conversation_id = self.state["conversation_id"]
+        history = conversation_store.messages(conversation_id)
+        prefetcher.cancel(self.client)
+
+        try:
+            result = generate_admitted_response(
+                self.client,
+                message,
+                conversation_history=history,
+                language=self.state["language"],
+                temperature=self.state["temperature"],
+                on_token=lambda text: self.send({"type": "token", "text": text}),
+                on_safety=lambda text: self.send({"type": "safety", "text": text}),
+            )
+        except Exception as e:
+            self.send_error("message", f"Error generating response: {str(e)}")
+            return
+        finally:
+            self.generating = False
+        prefetcher.record_send(self.client, message, result["timings"])
+
+        if not result.get("shed"):
+            messages = [{"role": "user", "content": message}]
+            if result.get("safety"):
+                messages.append({"role": "assistant", "content": result["safety"]})
+            messages.append({"role": "assistant", "content": result["response"]})
+            conversation_store.append(conversation_id, messages)
+            # Clear any previous reflection when new message is sent
+            self.update(reflection=None)
+        self.send(
+            {
+                "type": "response",
+                "response": result["response"],
+                "sources": result["sources"],
+                "shed": bool(result.get("shed")),
+            }
+        )
+
+        # Offer a reflection every few messages without being asked
+        user_messages = sum(1 for m in history if m["role"] == "user") + 1
+        if not result.get("shed") and user_messages % REFLECTION_EVERY == 0:
+            self.on_reflection({"background": True})
+
+    def on_settings(self, data: Dict[str, Any]):
+        """Validate and apply setting changes, then acknowledge them."""
+        changes = {}
+        if "language" in data:
+            language = data["language"]
+            if not isinstance(language, str) or language not in SUPPORTED_LANGUAGES:
+                self.send_error("settings", "Unsupported language")
+                return
+            changes["language"] = data["language"]
+        if "temperature" in data:
+            try:
+                temperature = float(data["temperature"])
+            except (TypeError, ValueError):
+                self.send_error("settings", "Invalid temperature value")
+                return
+            if temperature < 0.0 or temperature > 1.0:
+                self.send_error("settings", "Temperature must be between 0.0 and 1.0")
+                return
+            changes["temperature"] = temperature
+        if "theme" in data:
+            if data["theme"] not in ["light", "dark"]:
+                self.send_error("settings", "Invalid theme value")
+                return
+            changes["theme"] = data["theme"]
+        if "tts_enabled" in data:
+            changes["tts_enabled"] = bool(data["tts_enabled"])
+
+        self.update(**changes)
+        if "language" in changes:
+            # The page reloads to switch language, so save before acknowledging
+            self.flush()
+        self.send({"type": "settings", "settings": self.settings()})
+
+    def on_reflection(self, data: Dict[str, Any]):
+        """Generate a reflection on the conversation and push it to the client."""
+        eventlet.spawn(self._reflect, bool(data.get("background")))
+
+    def _reflect(self, background: bool):
+        messages = conversation_store.messages(self.state["conversation_id"])
+        if len(messages) < 4:
+            if not background:
+                text = get_not_enough_history_text(self.state["language"])
+                self.send_error("reflection", text)
+            return
+
+        try:
+            result = generate_positive_reflection(
+                messages,
+                language=self.state["language"],
+                temperature=self.state["temperature"],
+            )
+        except Exception as e:
+            if not background:
+                self.send_error("reflection", f"Error generating reflection: {str(e)}")
+            return
+
+        self.update(reflection=result["reflection"])
+        self.send(
+            {
+                "type": "reflection",
+                "reflection": result["reflection"],
+                "background": background,
+            }
+        )
+
+    def on_prefetch(self, data: Dict[str, Any]):
+        """Warm the retrieval caches with the draft the user is typing."""
+        text = data.get("text") or ""
+        if not isinstance(text, str):
+            return
+        try:
+            generation = int(data.get("generation"))
+        except (TypeError, ValueError):
+            return
+        prefetcher.schedule(self.client, text, self.state["language"], generation)
+
+    def on_clear(self, data: Dict[str, Any]):
+        """Clear the conversation history."""
+        conversation_store.clear(self.state["conversation_id"])
+        self.update(reflection=None)
+        self.send({"type": "cleared"})
+
+
+class ChatSocketMiddleware:
+    """
+    WSGI middleware serving the WebSocket chat channel next to the Flask app.
+
+    WebSockets need the eventlet server (python chat_server.py). Under other
+    servers the channel answers 400 and the browser falls back to the HTTP
+    endpoints.
+
+    Browsers send the session cookie with WebSocket handshakes from any
+    site, so handshakes from pages on another origin are refused with 403.
+    """
+
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.websocket_app = WebSocketWSGI(self.handle)
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO") != CHAT_SOCKET_PATH:
+            return self.wsgi_app(environ, start_response)
+        if "eventlet.input" not in environ:
+            start_response("400 Bad Request", [("Content-Type", "text/plain")])
+            return [b"The chat channel needs the eventlet server"]
+        if not self.origin_allowed(environ):
+            start_response("403 Forbidden", [("Content-Type", "text/plain")])
+            return [b"Cross-origin chat connections are not allowed"]
+        return self.websocket_app(environ, start_response)
+
+    @staticmethod
+    def origin_allowed(environ) -> bool:
+        """Whether the page opening the channel is served by this app."""
+        origin = environ.get("HTTP_ORIGIN")
+        if not origin:
+            # Not a browser, so no cookie was attached on someone else's behalf
+            return True
+        origin = origin.rstrip("/").lower()
+        if origin in ALLOWED_ORIGINS:
+            return True
+        host = environ.get("HTTP_HOST", "").lower()
+        return bool(host) and urlsplit(origin).netloc == host
+
+    def handle(self, ws):
+        ChatConnection(self.app, ws).run()
+
+
+register_gauge(
+    "echomind_websocket_connections",
+    "Open WebSocket chat connections in this worker",
+    lambda: [({}, _open_connections)],
+)
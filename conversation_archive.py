@@ -0,0 +1,492 @@
+import os
+import json
+import glob
+import random
+import itertools
+import argparse
+from typing import List, Dict, Any, Iterator, Iterable, Optional, Tuple
+
+import numpy as np
+
+from bm25_index import detect_language
+from conversation_store import CONVERSATION_DB_PATH, ConversationStore
+
+# Configuration
+# Directory the archive is written to
+ARCHIVE_DIR = os.environ.get("CONVERSATION_ARCHIVE_DIR", "conversation_archive")
+SEGMENT_CONVERSATIONS = 10000  # Conversations per segment file
+# Conversations in the store are archived once idle for this long, in seconds
+STORE_IDLE_SECONDS = 7 * 24 * 3600
+ARCHIVE_LANGUAGES = ["english", "french", "arabic"]  # Stored by their position
+
+# Columns stored next to each segment, one value per conversation
+COLUMNS = {
+    "offset": np.int64,  # Where the conversation's line starts in the segment
+    "length": np.int32,  # Length of the line in bytes
+    "language": np.int8,  # Position in ARCHIVE_LANGUAGES
+    "user_turns": np.int32,
+    "assistant_turns": np.int32,
+    "user_chars": np.int64,
+    "assistant_chars": np.int64,
+    "created_at": np.float64,  # When the conversation was last saved
+}
+
+
+def _write_atomically(path: str, write):
+    """Write a file through a temporary file, so readers never see half of it."""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        write(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def _add_counts(histogram: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Add values to a histogram of non-negative integers, growing it if needed."""
+    counts = np.bincount(values.astype(np.int64, copy=False))
+    if len(counts) > len(histogram):
+        counts[: len(histogram)] += histogram
+        return counts
+    histogram[: len(counts)] += counts
+    return histogram
+
+
+def _summarize_counts(histogram: np.ndarray) -> Dict[str, float]:
+    """Mean, percentiles and maximum of the values counted in a histogram."""
+    total = int(histogram.sum())
+    if not total:
+        return {"count": 0, "mean": 0.0, "p50": 0, "p95": 0, "max": 0}
+
+    cumulative = np.cumsum(histogram)
+
+    def percentile(q: float) -> int:
+        rank = max(int(np.ceil(q / 100 * total)), 1)
+        return int(np.searchsorted(cumulative, rank))
+
+    return {
+        "count": total,
+        "mean": float(np.dot(np.arange(len(histogram)), histogram) / total),
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "max": int(np.flatnonzero(histogram)[-1]),
+    }
+
+
+class ConversationArchive:
+    """
+    Append-only archive of conversations, built for scanning.
+
+    Conversations are stored as compact JSON lines in segment files of up to
+    SEGMENT_CONVERSATIONS each. Next to every segment, an .npz file holds one
+    column per statistic (see COLUMNS), plus the length of every response,
+    so aggregates never need to parse the JSON and only hold one segment's
+    columns at a time. The offset column indexes the lines, so single
+    conversations can be read without scanning their segment.
+
+    The columns are written after the lines they describe, and readers only
+    trust lines the columns cover, so an interrupted write is ignored.
+    """
+
+    def __init__(self, path: str = ARCHIVE_DIR):
+        self.path = path
+        self.manifest_path = os.path.join(path, "manifest.json")
+        self.sources_path = os.path.join(path, "sources.txt")
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as file:
+                self.manifest = json.load(file)
+        except FileNotFoundError:
+            self.manifest = {"segments": []}
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        """Whether a directory contains an archive."""
+        return os.path.exists(os.path.join(path, "manifest.json"))
+
+    def _segment_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.jsonl")
+
+    def _columns_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.npz")
+
+    def columns(self, name: str) -> Dict[str, np.ndarray]:
+        """Load the columns of a segment (empty ones if none were written yet)."""
+        try:
+            with np.load(self._columns_path(name)) as data:
+                return {key: data[key] for key in data.files}
+        except FileNotFoundError:
+            empty = {key: np.array([], dtype=dtype) for key, dtype in COLUMNS.items()}
+            empty["response_chars"] = np.array([], dtype=np.int32)
+            return empty
+
+    def sources(self) -> set:
+        """Names of the conversation files and stored conversations already archived."""
+        try:
+            with open(self.sources_path, "r", encoding="utf-8") as file:
+                return {line.rstrip("\n") for line in file if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def append(self, conversations: Iterable[Tuple[str, Dict[str, Any], float]]) -> int:
+        """
+        Add conversations to the end of the archive.
+
+        Args:
+            conversations: (source name, conversation, creation time) tuples;
+                           conversations have "messages" and optionally
+                           "language" and "reflection"
+
+        Returns:
+            Number of conversations added
+        """
+        os.makedirs(self.path, exist_ok=True)
+        segments = self.manifest["segments"]
+
+        def open_segment():
+            # Continue the last segment unless it is full
+            if segments and segments[-1]["conversations"] < SEGMENT_CONVERSATIONS:
+                name = segments[-1]["name"]
+            else:
+                name = f"segment_{len(segments):05d}"
+                segments.append({"name": name, "conversations": 0})
+            stored = self.columns(name)
+            columns = {key: list(stored[key]) for key in stored}
+            end = 0
+            if len(stored["offset"]):
+                end = int(stored["offset"][-1] + stored["length"][-1])
+            file = open(self._segment_path(name), "ab+")
+            # Drop lines left behind by an interrupted write
+            file.truncate(end)
+            file.seek(end)
+            return name, columns, file
+
+        def close_segment(name, columns, file):
+            file.flush()
+            os.fsync(file.fileno())
+            file.close()
+            arrays = {
+                key: np.array(columns[key], dtype=dtype)
+                for key, dtype in COLUMNS.items()
+            }
+            arrays["response_chars"] = np.array(
+                columns["response_chars"], dtype=np.int32
+            )
+            _write_atomically(self._columns_path(name), lambda f: np.savez(f, **arrays))
+            segments[-1]["conversations"] = len(columns["offset"])
+
+        added = 0
+        sources = []
+        name, columns, file = open_segment()
+        try:
+            for source, conversation, created_at in conversations:
+                if len(columns["offset"]) >= SEGMENT_CONVERSATIONS:
+                    close_segment(name, columns, file)
+                    name, columns, file = open_segment()
+
+                messages = [
+                    {"role": m["role"], "content": m["content"]}
+                    for m in conversation.get("messages", [])
+                ]
+                user = [m["content"] for m in messages if m["role"] == "user"]
+                responses = [len(m["content"]) for m in messages if m["role"] != "user"]
+                language = conversation.get("language") or detect_language(
+                    " ".join(user)
+                )
+                record = {
+                    "source": source,
+                    "language": language,
+                    "created_at": created_at,
+                    "messages": messages,
+                    "reflection": conversation.get("reflection"),
+                }
+                line = (
+                    json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+                ).encode("utf-8")
+
+                columns["offset"].append(file.tell())
+                columns["length"].append(len(line))
+                columns["language"].append(
+                    ARCHIVE_LANGUAGES.index(language)
+                    if language in ARCHIVE_LANGUAGES
+                    else 0
+                )
+                columns["user_turns"].append(len(user))
+                columns["assistant_turns"].append(len(responses))
+                columns["user_chars"].append(sum(len(text) for text in user))
+                columns["assistant_chars"].append(sum(responses))
+                columns["created_at"].append(created_at)
+                columns["response_chars"].extend(responses)
+                file.write(line)
+                sources.append(source)
+                added += 1
+        finally:
+            close_segment(name, columns, file)
+
+        _write_atomically(
+            self.manifest_path,
+            lambda f: f.write(json.dumps(self.manifest, indent=2).encode("utf-8")),
+        )
+        with open(self.sources_path, "a", encoding="utf-8") as file:
+            file.writelines(f"{source}\n" for source in sources)
+        return added
+
+    def read(self, segment: int, position: int) -> Dict[str, Any]:
+        """
+        Read one conversation using the offset index.
+
+        Args:
+            segment: Position of the segment in the archive
+            position: Position of the conversation in the segment
+
+        Returns:
+            The archived conversation
+        """
+        name = self.manifest["segments"][segment]["name"]
+        columns = self.columns(name)
+        with open(self._segment_path(name), "rb") as file:
+            file.seek(int(columns["offset"][position]))
+            return json.loads(file.read(int(columns["length"][position])))
+
+    def conversations(self, language: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the archived conversations in the order they were added.
+
+        Args:
+            language: Only return conversations in this language
+
+        Yields:
+            Archived conversations
+        """
+        code = ARCHIVE_LANGUAGES.index(language) if language else None
+        for segment in self.manifest["segments"]:
+            columns = self.columns(segment["name"])
+            with open(self._segment_path(segment["name"]), "rb") as file:
+                # Lines past the last one the columns cover are ignored
+                for line_language in columns["language"]:
+                    line = file.readline()
+                    if code is None or line_language == code:
+                        yield json.loads(line)
+
+    def sample(self, count: int, seed: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Read a random sample of conversations, without scanning the segments.
+
+        Args:
+            count: Number of conversations to read (all of them if fewer)
+            seed: Random seed, for repeatable samples
+
+        Returns:
+            The sampled conversations
+        """
+        sizes = [segment["conversations"] for segment in self.manifest["segments"]]
+        picks = random.Random(seed).sample(range(sum(sizes)), min(count, sum(sizes)))
+        bounds = np.cumsum(sizes)
+
+        sampled = []
+        for pick in sorted(picks):
+            segment = int(np.searchsorted(bounds, pick, side="right"))
+            position = pick - (int(bounds[segment - 1]) if segment else 0)
+            sampled.append(self.read(segment, position))
+        return sampled
+
+    def stats(self, language: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Aggregate the archive's columns, one segment at a time.
+
+        Args:
+            language: Only count conversations in this language
+
+        Returns:
+            Dictionary with the number of conversations, the language mix, and
+            the distributions of user turns per conversation, user message
+            lengths and response lengths (in characters)
+        """
+        code = ARCHIVE_LANGUAGES.index(language) if language else None
+        languages = np.zeros(len(ARCHIVE_LANGUAGES), dtype=np.int64)
+        turns = np.zeros(1, dtype=np.int64)
+        responses = np.zeros(1, dtype=np.int64)
+        user_chars = 0
+        user_turns = 0
+
+        for segment in self.manifest["segments"]:
+            columns = self.columns(segment["name"])
+            selected = (
+                np.ones(len(columns["offset"]), dtype=bool)
+                if code is None
+                else columns["language"] == code
+            )
+            # Responses are stored flat; repeat the filter for each of them
+            selected_responses = np.repeat(selected, columns["assistant_turns"])
+
+            languages += np.bincount(
+                columns["language"][selected], minlength=len(ARCHIVE_LANGUAGES)
+            )
+            turns = _add_counts(turns, columns["user_turns"][selected])
+            responses = _add_counts(
+                responses, columns["response_chars"][selected_responses]
+            )
+            user_chars += int(columns["user_chars"][selected].sum())
+            user_turns += int(columns["user_turns"][selected].sum())
+
+        total = int(languages.sum())
+        return {
+            "conversations": total,
+            "languages": {
+                name: {
+                    "conversations": int(count),
+                    "share": float(count / total) if total else 0.0,
+                }
+                for name, count in zip(ARCHIVE_LANGUAGES, languages)
+            },
+            "user_turns": _summarize_counts(turns),
+            "user_message_chars_mean": user_chars / user_turns if user_turns else 0.0,
+            "response_chars": _summarize_counts(responses),
+        }
+
+
+def archive_directory(
+    directory: str = "conversations",
+    archive_path: str = ARCHIVE_DIR,
+    remove: bool = False,
+) -> Dict[str, Any]:
+    """
+    Move conversation_*.json files into the archive.
+
+    Files archived by an earlier run are skipped, so this can run repeatedly
+    (e.g. from cron) while new conversations keep being saved.
+
+    Args:
+        directory: Directory containing conversation_*.json files
+        archive_path: Directory of the archive
+        remove: Delete the files once they are archived
+
+    Returns:
+        Dictionary with the number of conversations "archived", the number of
+        files "skipped" because they were already archived, and the archive's
+        number of "segments"
+    """
+    archive = ConversationArchive(archive_path)
+    archived_sources = archive.sources()
+    files = sorted(glob.glob(os.path.join(directory, "conversation_*.json")))
+    new_files = [f for f in files if os.path.basename(f) not in archived_sources]
+
+    def read_files():
+        # One file at a time, so memory use doesn't grow with the directory
+        for file_path in new_files:
+            with open(file_path, "r", encoding="utf-8") as file:
+                conversation = json.load(file)
+            yield os.path.basename(file_path), conversation, os.path.getmtime(file_path)
+
+    archived = archive.append(read_files()) if new_files else 0
+    if remove:
+        for file_path in new_files:
+            os.remove(file_path)
+
+    return {
+        "archived": archived,
+        "skipped": len(files) - len(new_files),
+        "segments": len(archive.manifest["segments"]),
+    }
+
+
+def archive_store(
+    store_path: str = CONVERSATION_DB_PATH,
+    archive_path: str = ARCHIVE_DIR,
+    idle_seconds: float = STORE_IDLE_SECONDS,
+    remove: bool = False,
+) -> Dict[str, Any]:
+    """
+    Copy conversations from the conversation store into the archive.
+
+    Only conversations idle for `idle_seconds` are archived, each once; its
+    source name is "db:<conversation ID>". Like archive_directory, this can
+    run repeatedly.
+
+    Args:
+        store_path: SQLite database of the conversation store
+        archive_path: Directory of the archive
+        idle_seconds: How long a conversation must have been idle
+        remove: Delete the conversations from the store once they are archived
+
+    Returns:
+        Dictionary with the number of conversations "archived", the number
+        "skipped" because they were already archived, and the archive's
+        number of "segments"
+    """
+    store = ConversationStore(store_path)
+    archive = ConversationArchive(archive_path)
+    archived_sources = archive.sources()
+    new_ids = []
+    skipped = 0
+
+    def read_store():
+        nonlocal skipped
+        for conversation in store.conversations(idle_seconds):
+            source = f"db:{conversation['conversation_id']}"
+            if source in archived_sources:
+                skipped += 1
+                continue
+            new_ids.append(conversation["conversation_id"])
+            yield source, conversation, conversation["updated_at"]
+
+    conversations = read_store()
+    first = next(conversations, None)
+    archived = archive.append(itertools.chain([first], conversations)) if first else 0
+    if remove:
+        for conversation_id in new_ids:
+            store.clear(conversation_id)
+
+    return {
+        "archived": archived,
+        "skipped": skipped,
+        "segments": len(archive.manifest["segments"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Archive saved conversations and query statistics about them"
+    )
+    parser.add_argument("--archive", default=ARCHIVE_DIR, help="Archive directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    archive_parser = commands.add_parser(
+        "archive", help="Add new conversation files to the archive"
+    )
+    archive_parser.add_argument("directory", nargs="?", default="conversations")
+    archive_parser.add_argument(
+        "--remove", action="store_true", help="Delete the files once archived"
+    )
+
+    store_parser = commands.add_parser(
+        "archive-store", help="Add idle conversations from the conversation store"
+    )
+    store_parser.add_argument("store", nargs="?", default=CONVERSATION_DB_PATH)
+    store_parser.add_argument(
+        "--idle-days",
+        type=float,
+        default=STORE_IDLE_SECONDS / 86400,
+        help="Only archive conversations idle for this many days",
+    )
+    store_parser.add_argument(
+        "--remove", action="store_true", help="Delete the conversations once archived"
+    )
+
+    stats_parser = commands.add_parser("stats", help="Print aggregate statistics")
+    stats_parser.add_argument("--language", choices=ARCHIVE_LANGUAGES)
+
+    args = parser.parse_args()
+
+    if args.command == "archive":
+        results = archive_directory(args.directory, args.archive, remove=args.remove)
+    elif args.command == "archive-store":
+        results = archive_store(
+            args.store, args.archive, args.idle_days * 86400, remove=args.remove
+        )
+    else:
+        results = ConversationArchive(args.archive).stats(language=args.language)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
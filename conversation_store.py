@@ -0,0 +1,177 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from typing import List, Dict, Any, Iterator, Optional
+
+from dotenv import load_dotenv
+from flask import session
+
+# Load environment variables
+load_dotenv()
+
+# Configuration
+# SQLite database file
+CONVERSATION_DB_PATH = os.environ.get("CONVERSATION_DB_PATH", "conversations.db")
+HISTORY_PAGE_SIZE = 20  # Messages rendered with the page and loaded per scroll
+MAX_HISTORY_PAGE_SIZE = 100  # Largest page the history API returns
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation
+    ON messages (conversation_id, id);
+"""
+
+
+class ConversationStore:
+    """
+    Chat messages, stored in SQLite instead of the session.
+
+    The session only holds a conversation ID, so loading and saving it costs
+    the same however long the conversation gets, and the page can render
+    just the latest messages. Like UserStore, each thread gets its own
+    connection in WAL mode.
+    """
+
+    def __init__(self, path: str = CONVERSATION_DB_PATH):
+        self.path = path
+        self.local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        # Connections can't be shared with processes forked after they were opened
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def append(self, conversation_id: str, messages: List[Dict[str, Any]]):
+        """
+        Add messages to the end of a conversation.
+
+        Args:
+            conversation_id: Conversation to add to
+            messages: Messages with "role" and "content", oldest first
+        """
+        now = time.time()
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT INTO messages (conversation_id, role, content, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (conversation_id, message["role"], message["content"], now)
+                    for message in messages
+                ],
+            )
+
+    def messages(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """
+        Get a whole conversation, e.g. as history for the prompt.
+
+        Args:
+            conversation_id: Conversation to read
+
+        Returns:
+            Messages with "role" and "content", oldest first
+        """
+        rows = self._connection().execute(
+            "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY id",
+            (conversation_id,),
+        )
+        return [dict(row) for row in rows]
+
+    def page(
+        self,
+        conversation_id: str,
+        before: Optional[int] = None,
+        limit: int = HISTORY_PAGE_SIZE,
+    ) -> Dict[str, Any]:
+        """
+        Get one page of a conversation, newest messages first.
+
+        Args:
+            conversation_id: Conversation to read
+            before: Cursor returned with the previous page (None for the latest page)
+            limit: Maximum number of messages to return
+
+        Returns:
+            Dictionary with "messages" (each with "id", "role" and "content",
+            newest first) and the "next_cursor" for older messages, or None
+            if there are none
+        """
+        query = "SELECT id, role, content FROM messages WHERE conversation_id = ?"
+        params: List[Any] = [conversation_id]
+        if before is not None:
+            query += " AND id < ?"
+            params.append(before)
+        query += " ORDER BY id DESC LIMIT ?"
+        # Fetch one extra message to learn whether there are older ones
+        params.append(limit + 1)
+
+        rows = self._connection().execute(query, params).fetchall()
+        messages = [dict(row) for row in rows[:limit]]
+        next_cursor = messages[-1]["id"] if len(rows) > limit else None
+        return {"messages": messages, "next_cursor": next_cursor}
+
+    def conversations(self, idle_seconds: float = 0.0) -> Iterator[Dict[str, Any]]:
+        """
+        Stream whole conversations, e.g. to archive or evaluate them.
+
+        Args:
+            idle_seconds: Only return conversations without a new message for
+                          at least this long, so ongoing ones are left alone
+
+        Yields:
+            Dictionaries with "conversation_id", "messages" (oldest first)
+            and "updated_at", the time of the last message; oldest
+            conversations first
+        """
+        # Only the IDs are read up front; messages are read one conversation at a time
+        rows = self._connection().execute(
+            "SELECT conversation_id, MAX(created_at) AS updated_at FROM messages "
+            "GROUP BY conversation_id HAVING MAX(created_at) <= ? ORDER BY MIN(id)",
+            (time.time() - idle_seconds,),
+        )
+        for row in rows.fetchall():
+            yield {
+                "conversation_id": row["conversation_id"],
+                "messages": self.messages(row["conversation_id"]),
+                "updated_at": row["updated_at"],
+            }
+
+    def clear(self, conversation_id: str):
+        """Delete every message of a conversation."""
+        with self._connection() as connection:
+            connection.execute(
+                "DELETE FROM messages WHERE conversation_id = ?", (conversation_id,)
+            )
+
+
+# Shared by all requests in this process
+conversation_store = ConversationStore()
+
+
+def session_conversation_id() -> str:
+    """
+    Get the ID of the current session's conversation, starting one if needed.
+
+    History kept in the session by earlier versions is moved into the store.
+    Must be called while handling a Flask request.
+    """
+    if "conversation_id" not in session:
+        session["conversation_id"] = uuid.uuid4().hex
+        legacy_messages = session.pop("messages", None)
+        if legacy_messages:
+            conversation_store.append(session["conversation_id"], legacy_messages)
+    return session["conversation_id"]
@@ -0,0 +1,18 @@
+import os
+
+# Serve the Flask app with several worker processes:
+#   gunicorn -c gunicorn.conf.py
+wsgi_app = "app_flask:app"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+
+# Import the app in the master before forking, so the embedding model and BM25
+# index are loaded once and shared copy-on-write by every worker
+preload_app = True
+
+
+def when_ready(server):
+    """Runs in the master after the app is imported and before workers fork."""
+    from preload import preload_shared_state
+
+    preload_shared_state()
@@ -0,0 +1,363 @@
+import os
+import re
+import sys
+import json
+import glob
+import time
+import hashlib
+import threading
+import unicodedata
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Append every gate decision to this JSONL file for offline evaluation (optional)
+INTENT_GATE_LOG_PATH = os.environ.get("INTENT_GATE_LOG_PATH")
+
+# Messages longer than this always go through retrieval
+MAX_SMALL_TALK_WORDS = 6
+
+# Words that make up greetings, thanks, goodbyes and acknowledgements
+GREETING_WORDS = {
+    "hi",
+    "hello",
+    "hey",
+    "hiya",
+    "morning",
+    "afternoon",
+    "evening",
+    "bonjour",
+    "bonsoir",
+    "salut",
+    "coucou",
+    "مرحبا",
+    "اهلا",
+    "السلام",
+    "عليكم",
+    "صباح",
+    "مساء",
+    "الخير",
+    "النور",
+}
+THANKS_WORDS = {
+    "thanks",
+    "thank",
+    "thx",
+    "ty",
+    "appreciate",
+    "merci",
+    "شكرا",
+    "جزيلا",
+}
+GOODBYE_WORDS = {
+    "bye",
+    "goodbye",
+    "goodnight",
+    "night",
+    "later",
+    "cya",
+    "au",
+    "revoir",
+    "bonne",
+    "nuit",
+    "soirée",
+    "journée",
+    "السلامه",
+    "وداعا",
+    "تصبح",
+}
+ACKNOWLEDGEMENT_WORDS = {
+    "ok",
+    "okay",
+    "k",
+    "yes",
+    "yeah",
+    "yep",
+    "nope",
+    "sure",
+    "alright",
+    "cool",
+    "great",
+    "nice",
+    "fine",
+    "good",
+    "got",
+    "oui",
+    "non",
+    "d'accord",
+    "daccord",
+    "bien",
+    "super",
+    "parfait",
+    "نعم",
+    "حسنا",
+    "تمام",
+    "طيب",
+}
+FILLER_WORDS = {
+    "you",
+    "so",
+    "much",
+    "very",
+    "a",
+    "lot",
+    "for",
+    "all",
+    "again",
+    "and",
+    "too",
+    "there",
+    "everyone",
+    "de",
+    "rien",
+    "beaucoup",
+    "vous",
+    "toi",
+    "tout",
+    "le",
+    "monde",
+    "الف",
+}
+# Small-talk phrases with a word that isn't small talk on its own ("it"),
+# replaced by one of their small-talk words before the check
+SMALL_TALK_PHRASES = {
+    "got it": "got",
+}
+SMALL_TALK_PATTERN = re.compile(
+    r"\b(" + "|".join(SMALL_TALK_PHRASES) + r")\b", re.UNICODE
+)
+SMALL_TALK_WORDS = (
+    GREETING_WORDS | THANKS_WORDS | GOODBYE_WORDS | ACKNOWLEDGEMENT_WORDS | FILLER_WORDS
+)
+
+# How many previous messages each intent needs (None keeps the full history).
+# A short "thanks", "bye" or "ok" after a hard moment still depends on it.
+HISTORY_MESSAGES = {
+    "greeting": 0,
+    "thanks": None,
+    "goodbye": None,
+    "acknowledgement": None,
+    "informational": None,
+}
+
+# Phrases that suggest a risk of suicide or self-harm, as regular expressions
+# matched against the normalized words of a message
+CRISIS_PHRASES = [
+    # English
+    r"suicid\w*",
+    r"(kill|killing|hurt|hurting|harm|harming|cut|cutting) myself",
+    r"kms",
+    r"self harm\w*",
+    r"end(ing)? (my life|it all)",
+    r"(want|wanna|going) (to )?die",
+    r"(don't|dont|do not) (want|wanna) (to )?(live|be alive|exist)",
+    r"(don't|dont|do not) (want|wanna) (to )?be (here|around) (anymore|any more)",
+    r"(want to|wanna|wish i could) disappear",
+    r"no reason to live",
+    r"better off dead",
+    r"overdos\w*",
+    r"(took|taken|take|swallowed) (too many|all (my|the)|a bunch of) "
+    r"(pills|tablets|meds)",
+    # French
+    r"me (tuer|suicider)",
+    r"en finir",
+    r"me faire du mal",
+    r"mettre fin à (ma vie|mes jours)",
+    r"(envie de|veux) mourir",
+    r"plus envie de vivre",
+    r"veux (plus|pas) vivre",
+    r"(envie de|veux) disparaître",
+    # Arabic, with an optional article or conjunction prefix
+    r"(ال|و|ب)?انتحار",
+    r"انتحر",
+    r"اقتل نفسي",
+    r"اؤذي نفسي",
+    r"انهي حياتي",
+    r"(اريد ان|ابي) اموت",
+]
+CRISIS_PATTERN = re.compile(r"\b(" + "|".join(CRISIS_PHRASES) + r")\b", re.UNICODE)
+ARABIC_ALEF_VARIANTS = str.maketrans("أإآ", "ااا")
+
+WORD_PATTERN = re.compile(r"[\w']+", re.UNICODE)
+ARABIC_DIACRITICS = re.compile(r"[\u064B-\u0652\u0670\u0640]")
+
+_log_lock = threading.Lock()
+
+
+def _words(message: str) -> List[str]:
+    """Lowercase, normalize and split a message into words."""
+    text = unicodedata.normalize("NFKC", message).lower().replace("’", "'")
+    text = ARABIC_DIACRITICS.sub("", text).replace("ة", "ه")
+    return WORD_PATTERN.findall(text)
+
+
+def classify_turn(message: str) -> Dict[str, Any]:
+    """
+    Decide whether a chat turn needs knowledge base retrieval and history.
+
+    Only messages made up entirely of greeting, thanks, goodbye and
+    acknowledgement words skip retrieval; anything with a single other word
+    ("exams", "bye forever") is treated as informational.
+
+    Args:
+        message: The user's message
+
+    Returns:
+        Dictionary with the detected "intent", whether to "retrieve", and how
+        many previous messages to keep in "history" (None for all of them)
+    """
+    words = SMALL_TALK_PATTERN.sub(
+        lambda match: SMALL_TALK_PHRASES[match.group(0)], " ".join(_words(message))
+    ).split()
+
+    if len(words) > MAX_SMALL_TALK_WORDS or any(
+        w not in SMALL_TALK_WORDS for w in words
+    ):
+        intent = "informational"
+    elif any(w in GOODBYE_WORDS for w in words):
+        intent = "goodbye"
+    elif any(w in THANKS_WORDS for w in words):
+        intent = "thanks"
+    elif any(w in GREETING_WORDS for w in words):
+        intent = "greeting"
+    else:
+        # Acknowledgements, and messages with no words at all (emoji, "...")
+        intent = "acknowledgement"
+
+    return {
+        "intent": intent,
+        "retrieve": intent == "informational",
+        "history": HISTORY_MESSAGES[intent],
+    }
+
+
+def classify_risk(message: str) -> Dict[str, Any]:
+    """
+    Check a message for signs of suicide or self-harm risk.
+
+    This is a cheap keyword match that runs before anything else, so crisis
+    messages can be answered and prioritized immediately. It errs on the side
+    of flagging: a false positive only costs a safety message.
+
+    Args:
+        message: The user's message
+
+    Returns:
+        Dictionary with whether the message is a "crisis" and the matched
+        "phrase" (None if there was no match)
+    """
+    text = " ".join(_words(message)).translate(ARABIC_ALEF_VARIANTS)
+    match = CRISIS_PATTERN.search(text)
+    return {"crisis": match is not None, "phrase": match.group(0) if match else None}
+
+
+def record_decision(
+    message: str,
+    decision: Dict[str, Any],
+    language: str = "english",
+    log_path: Optional[str] = INTENT_GATE_LOG_PATH,
+):
+    """
+    Append a gate decision to the JSONL decision log.
+
+    Only a hash and the length of the message are stored, not its text.
+
+    Args:
+        message: The user's message
+        decision: The decision returned by classify_turn
+        language: Language of the session
+        log_path: File to append to (nothing is recorded if None)
+    """
+    if not log_path:
+        return
+
+    entry = {
+        "timestamp": time.time(),
+        "message_sha256": hashlib.sha256(message.encode("utf-8")).hexdigest(),
+        "message_length": len(message),
+        "word_count": len(_words(message)),
+        "language": language,
+        **decision,
+    }
+
+    try:
+        with _log_lock, open(log_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(entry) + "\n")
+    except OSError as e:
+        print(f"Could not record intent gate decision: {e}")
+
+
+def _saved_conversations(path: str) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """Name and messages of every conversation in a directory, archive or store."""
+    # Imported here so the gate itself doesn't depend on Flask or NumPy
+    from conversation_archive import ConversationArchive
+    from conversation_store import ConversationStore
+
+    if os.path.isfile(path):
+        for conversation in ConversationStore(path).conversations():
+            yield f"db:{conversation['conversation_id']}", conversation["messages"]
+    elif ConversationArchive.exists(path):
+        for conversation in ConversationArchive(path).conversations():
+            yield conversation["source"], conversation["messages"]
+    else:
+        for file_path in sorted(glob.glob(os.path.join(path, "*.json"))):
+            with open(file_path, "r", encoding="utf-8") as file:
+                conversation = json.load(file)
+            yield os.path.basename(file_path), conversation.get("messages", [])
+
+
+def evaluate_conversations(directory: str = "conversations") -> Dict[str, Any]:
+    """
+    Replay the gate over the user turns of saved conversations.
+
+    Args:
+        directory: Directory containing conversation JSON files, a
+                   conversation archive, or the conversation store's
+                   SQLite database (e.g. conversations.db)
+
+    Returns:
+        Dictionary with the number of turns, counts per intent, the share of
+        turns that skip retrieval and the skipped messages for manual review
+    """
+    intents: Dict[str, int] = {}
+    skipped = []
+    turns = 0
+
+    for name, messages in _saved_conversations(directory):
+        for msg in messages:
+            if msg["role"] != "user":
+                continue
+            decision = classify_turn(msg["content"])
+            turns += 1
+            intents[decision["intent"]] = intents.get(decision["intent"], 0) + 1
+            if not decision["retrieve"]:
+                skipped.append({"file": name, "message": msg["content"]})
+
+    return {
+        "turns": turns,
+        "intents": intents,
+        "skip_rate": len(skipped) / turns if turns else 0.0,
+        "skipped": skipped,
+    }
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else "conversations"
+    results = evaluate_conversations(directory)
+
+    print(f"Evaluated {results['turns']} user turns from {directory}")
+    for intent, count in sorted(results["intents"].items()):
+        print(f"  {intent}: {count}")
+    print(f"Retrieval skipped for {results['skip_rate']:.0%} of turns")
+
+    if results["skipped"]:
+        print("\nSkipped messages:")
+        for item in results["skipped"]:
+            print(f"  [{item['file']}] {item['message'].strip()}")
+
+
+if __name__ == "__main__":
+    main()
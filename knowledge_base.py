@@ -0,0 +1,547 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import hashlib
+import threading
+from typing import List, Dict, Any, Optional
+
+from dotenv import load_dotenv
+
+from astra_connection import connect_to_astradb
+from telemetry import observe, register_gauge, span
+from bm25_index import (
+    BM25Index,
+    BM25_INDEX_PATH,
+    get_bm25_index,
+    release_bm25_index,
+)
+from retrieval import clear_retrieval_cache
+from translation import TRANSLATED_LANGUAGES, translate_chunks
+from text_to_vector_db import (
+    EMBEDDING_MODEL,
+    MULTILINGUAL_EMBEDDING_MODEL,
+    get_embedding_model,
+    process_text_files,
+    setup_vector_collection,
+    store_in_astradb,
+)
+
+# Load environment variables
+load_dotenv()
+
+# Configuration
+DATASET_DIR = os.environ.get("KB_DATASET_DIR", "dataset")  # Watched .txt files
+KB_MANIFEST_PATH = os.environ.get("KB_MANIFEST_PATH", "knowledge_base.json")
+COLLECTION_PREFIX = "text_vectors"  # Versioned collections are text_vectors_v<N>
+MANIFEST_CHECK_INTERVAL = 1.0  # Seconds between manifest checks in the readers
+WATCH_INTERVAL = 5.0  # Seconds between dataset scans in the watcher
+WATCH_DEBOUNCE = 10.0  # Seconds the dataset must stay unchanged before rebuilding
+# Languages to pre-translate the knowledge base into (comma-separated, may be empty)
+KB_LANGUAGES = [
+    language.strip()
+    for language in os.environ.get("KB_LANGUAGES", "arabic,french").split(",")
+    if language.strip() in TRANSLATED_LANGUAGES
+]
+
+# What readers use before any versioned knowledge base has been built
+DEFAULT_INDEX = {
+    "version": 0,
+    "collection": COLLECTION_PREFIX,
+    "bm25_index_path": BM25_INDEX_PATH,
+    "languages": ["english"],
+    "dataset_fingerprint": None,
+    "dataset_mtime": None,
+    "built_at": None,
+    "previous": None,
+}
+
+# The version this process currently reads from; replaced, never mutated
+_active_index: Dict[str, Any] = DEFAULT_INDEX
+_manifest_mtime: Optional[int] = None
+_last_check = 0.0
+_swap_lock = threading.Lock()
+
+
+def dataset_fingerprint(dataset_dir: str = DATASET_DIR) -> Dict[str, Any]:
+    """
+    Summarize the .txt files of a dataset directory without reading them.
+
+    Args:
+        dataset_dir: Directory containing the knowledge base .txt files
+
+    Returns:
+        Dictionary with a "fingerprint" hash of every file's name, size and
+        modification time, and the newest modification time as "mtime"
+    """
+    digest = hashlib.sha256()
+    newest = 0.0
+    for file_path in sorted(glob.glob(os.path.join(dataset_dir, "*.txt"))):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            # Deleted while scanning; the next scan will see the change
+            continue
+        digest.update(
+            f"{os.path.basename(file_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode()
+        )
+        newest = max(newest, stat.st_mtime)
+    return {"fingerprint": digest.hexdigest(), "mtime": newest}
+
+
+def language_index(index: Dict[str, Any], language: str) -> Dict[str, Any]:
+    """
+    Pick the collection, BM25 index and encoder to search for a session language.
+
+    Args:
+        index: Knowledge base version, as returned by get_active_index
+        language: Session language
+
+    Returns:
+        Dictionary with the "language" the chunks are written in, and the
+        "collection", "bm25_index_path" and "model_name" to search with. Falls
+        back to the English chunks if the version wasn't translated into
+        the language.
+    """
+    if language in TRANSLATED_LANGUAGES and language in index.get("languages", []):
+        code = TRANSLATED_LANGUAGES[language]
+        return {
+            "language": language,
+            "collection": f"{index['collection']}_{code}",
+            "bm25_index_path": os.path.join(index["bm25_index_path"], code),
+            "model_name": MULTILINGUAL_EMBEDDING_MODEL,
+        }
+    return {
+        "language": "english",
+        "collection": index["collection"],
+        "bm25_index_path": index["bm25_index_path"],
+        "model_name": EMBEDDING_MODEL,
+    }
+
+
+def _bm25_paths(index: Dict[str, Any]) -> List[str]:
+    return [
+        language_index(index, language)["bm25_index_path"]
+        for language in index.get("languages", ["english"])
+    ]
+
+
+def read_manifest(manifest_path: str = KB_MANIFEST_PATH) -> Dict[str, Any]:
+    """
+    Read the manifest describing the active knowledge base version.
+
+    Args:
+        manifest_path: Path of the manifest file
+
+    Returns:
+        The manifest, or DEFAULT_INDEX if none has been written yet
+    """
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return DEFAULT_INDEX
+
+
+def write_manifest(manifest: Dict[str, Any], manifest_path: str = KB_MANIFEST_PATH):
+    """
+    Atomically replace the manifest, so readers see either the old or the new one.
+
+    Args:
+        manifest: The manifest to write
+        manifest_path: Path of the manifest file
+    """
+    temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, manifest_path)
+
+
+def _swap_to_manifest(manifest_path: str, initial: bool = False):
+    """Load the index of a newly published manifest, then switch readers to it."""
+    global _active_index, _manifest_mtime
+    try:
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == _manifest_mtime:
+            return
+
+        manifest = read_manifest(manifest_path)
+        previous = _active_index
+        if manifest["version"] != previous["version"]:
+            start = time.perf_counter()
+            # Load the new BM25 indexes first; requests keep using the old
+            # version until the reference below is replaced
+            new_paths = _bm25_paths(manifest)
+            for path in new_paths:
+                get_bm25_index(path)
+            _active_index = manifest
+            clear_retrieval_cache()
+            for path in _bm25_paths(previous):
+                if path not in new_paths:
+                    # In-flight searches still hold their own reference to it
+                    release_bm25_index(path)
+
+            if not initial:
+                observe(
+                    "echomind_kb_swap_duration_seconds", time.perf_counter() - start
+                )
+                if manifest.get("dataset_mtime"):
+                    observe(
+                        "echomind_kb_staleness_seconds",
+                        max(0.0, time.time() - manifest["dataset_mtime"]),
+                    )
+                print(
+                    f"Knowledge base swapped from version {previous['version']} "
+                    f"to version {manifest['version']}"
+                )
+        _manifest_mtime = mtime
+    except Exception as e:
+        # Keep serving the current version and try again on the next check
+        print(f"Error switching knowledge base version: {e}")
+    finally:
+        _swap_lock.release()
+
+
+def get_active_index(manifest_path: str = KB_MANIFEST_PATH) -> Dict[str, Any]:
+    """
+    Return the knowledge base version requests should read from.
+
+    At most once per MANIFEST_CHECK_INTERVAL this starts a background check of
+    the manifest (only the very first call checks it in the foreground). A new
+    version is loaded off the request path and swapped in with a single
+    reference assignment, so no request ever waits for it.
+
+    Args:
+        manifest_path: Path of the manifest file
+
+    Returns:
+        Dictionary with the "version", "collection" and "bm25_index_path" to use
+    """
+    global _last_check
+    now = time.monotonic()
+    if _last_check == 0.0:
+        # The first call reads the manifest before returning, so no request
+        # is ever served from the unversioned collection by mistake
+        _swap_lock.acquire()
+        _last_check = now
+        _swap_to_manifest(manifest_path, initial=True)
+    elif now - _last_check >= MANIFEST_CHECK_INTERVAL and _swap_lock.acquire(
+        blocking=False
+    ):
+        _last_check = now
+        threading.Thread(
+            target=_swap_to_manifest, args=(manifest_path,), daemon=True
+        ).start()
+    return _active_index
+
+
+def _latest_version(manifest: Dict[str, Any]) -> int:
+    """Highest version number ever built, including ones rolled back from."""
+    previous = manifest.get("previous") or {}
+    return max(
+        manifest.get("latest_version", manifest["version"]),
+        previous.get("version", 0),
+    )
+
+
+def _drop_version(db, manifest: Optional[Dict[str, Any]], keep: List[int]):
+    """Delete the collection and BM25 index of a superseded version."""
+    if not manifest or manifest["version"] == 0:
+        # Never delete the unversioned collection and index
+        return
+    if manifest["version"] in keep:
+        print(f"Not dropping knowledge base version {manifest['version']}: in use")
+        return
+    for language in manifest.get("languages", ["english"]):
+        collection = language_index(manifest, language)["collection"]
+        try:
+            db.drop_collection(collection)
+            print(f"Dropped collection '{collection}'")
+        except Exception as e:
+            print(f"Error dropping collection '{collection}': {e}")
+    # Translated BM25 indexes live inside the version's directory
+    shutil.rmtree(manifest["bm25_index_path"], ignore_errors=True)
+
+
+def _summary(manifest: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in manifest.items() if key != "previous"}
+
+
+def build_translated_index(
+    db,
+    chunks: List[Dict[str, Any]],
+    language: str,
+    collection: str,
+    bm25_index_path: str,
+):
+    """
+    Translate a version's chunks and store them in that language's collection and BM25 index.
+
+    Translations are cached on disk, so only new or changed chunks are sent
+    to Gemini. The translated chunks keep the IDs, file paths and chunk
+    indexes of the English ones.
+
+    Args:
+        db: AstraDB database client
+        chunks: English chunks of the version being built
+        language: Language to translate into
+        collection: English collection of the version being built
+        bm25_index_path: English BM25 index directory of the version being built
+    """
+    target = language_index(
+        {
+            "collection": collection,
+            "bm25_index_path": bm25_index_path,
+            "languages": [language],
+        },
+        language,
+    )
+    with span("kb_translate"):
+        translated = translate_chunks(chunks, language)
+
+    with span("ingest_embed"):
+        model = get_embedding_model(target["model_name"])
+        embeddings = model.encode([chunk["chunk_text"] for chunk in translated])
+        for chunk, embedding in zip(translated, embeddings):
+            chunk["$vector"] = embedding.tolist()
+
+    with span("ingest_bm25"):
+        # Stem the chunks the way queries in this language are stemmed
+        index = BM25Index.build(translated, language=target["language"])
+        index.save(target["bm25_index_path"])
+
+    setup_vector_collection(db, target["collection"])
+    store_in_astradb(db, translated, target["collection"])
+
+
+def rebuild(
+    dataset_dir: str = DATASET_DIR,
+    manifest_path: str = KB_MANIFEST_PATH,
+    db=None,
+) -> Dict[str, Any]:
+    """
+    Ingest the dataset into a new versioned collection and BM25 index, then publish it.
+
+    The live version is left untouched until the new one is complete. The
+    version it replaces is kept for rollback; the one before that is deleted.
+    Chunks are also translated into each of KB_LANGUAGES; a language whose
+    translation fails is left out, and its sessions search the English chunks.
+
+    Args:
+        dataset_dir: Directory containing the knowledge base .txt files
+        manifest_path: Path of the manifest file
+        db: AstraDB database client (connects if not given)
+
+    Returns:
+        The new manifest
+    """
+    current = read_manifest(manifest_path)
+    # Never reuse the number of a version that was rolled back from; its
+    # collection and index may still exist
+    version = _latest_version(current) + 1
+    dataset = dataset_fingerprint(dataset_dir)
+    collection = f"{COLLECTION_PREFIX}_v{version}"
+    bm25_index_path = os.path.join(BM25_INDEX_PATH, f"v{version}")
+
+    print(f"Building knowledge base version {version} from {dataset_dir}")
+    with span("kb_rebuild"):
+        chunks = process_text_files(dataset_dir, bm25_index_path=bm25_index_path)
+        if not chunks:
+            raise ValueError(f"No chunks found in {dataset_dir}")
+
+        if db is None:
+            db = connect_to_astradb()
+        setup_vector_collection(db, collection)
+        store_in_astradb(db, chunks, collection)
+
+        languages = ["english"]
+        for language in KB_LANGUAGES:
+            try:
+                build_translated_index(
+                    db, chunks, language, collection, bm25_index_path
+                )
+                languages.append(language)
+            except Exception as e:
+                print(f"Error building the {language} knowledge base: {e}")
+
+    manifest = {
+        "version": version,
+        "latest_version": version,
+        "collection": collection,
+        "bm25_index_path": bm25_index_path,
+        "languages": languages,
+        "dataset_fingerprint": dataset["fingerprint"],
+        "dataset_mtime": dataset["mtime"],
+        "built_at": time.time(),
+        "previous": _summary(current),
+    }
+    write_manifest(manifest, manifest_path)
+    print(f"Published knowledge base version {version} ({len(chunks)} chunks)")
+
+    # Only the version being replaced is kept for rollback
+    _drop_version(db, current.get("previous"), keep=[version, current["version"]])
+    return manifest
+
+
+def rollback(manifest_path: str = KB_MANIFEST_PATH) -> Dict[str, Any]:
+    """
+    Switch readers back to the previous version.
+
+    The version rolled back from becomes the new "previous", so rolling back
+    twice returns to it.
+
+    Args:
+        manifest_path: Path of the manifest file
+
+    Returns:
+        The new manifest
+    """
+    current = read_manifest(manifest_path)
+    previous = current.get("previous")
+    if not previous:
+        raise ValueError("There is no previous knowledge base version to roll back to")
+
+    manifest = {
+        **previous,
+        "latest_version": _latest_version(current),
+        "previous": _summary(current),
+    }
+    write_manifest(manifest, manifest_path)
+    print(
+        f"Rolled back knowledge base from version {current['version']} "
+        f"to version {previous['version']}"
+    )
+    return manifest
+
+
+class KnowledgeBaseWatcher(threading.Thread):
+    """
+    Background thread that rebuilds the knowledge base when the dataset changes.
+
+    Changes are debounced: a rebuild starts only once the dataset has stayed
+    the same for `debounce` seconds, so copying in several files triggers one
+    rebuild instead of one per file.
+    """
+
+    def __init__(
+        self,
+        dataset_dir: str = DATASET_DIR,
+        manifest_path: str = KB_MANIFEST_PATH,
+        interval: float = WATCH_INTERVAL,
+        debounce: float = WATCH_DEBOUNCE,
+    ):
+        super().__init__(name="knowledge-base-watcher", daemon=True)
+        self.dataset_dir = dataset_dir
+        self.manifest_path = manifest_path
+        self.interval = interval
+        self.debounce = debounce
+        self.pending = None
+        self.pending_since = 0.0
+        self.stopped = threading.Event()
+
+    def check(self) -> bool:
+        """
+        Scan the dataset once and rebuild if it changed and has settled.
+
+        Returns:
+            True if a new version was published
+        """
+        fingerprint = dataset_fingerprint(self.dataset_dir)["fingerprint"]
+        manifest = read_manifest(self.manifest_path)
+        # After a rollback the dataset matches the previous version instead
+        built = {manifest["dataset_fingerprint"]}
+        if manifest.get("previous"):
+            built.add(manifest["previous"]["dataset_fingerprint"])
+        if fingerprint in built:
+            self.pending = None
+            return False
+
+        if fingerprint != self.pending:
+            # Still changing; wait for it to settle
+            self.pending = fingerprint
+            self.pending_since = time.monotonic()
+            return False
+        if time.monotonic() - self.pending_since < self.debounce:
+            return False
+
+        try:
+            rebuild(self.dataset_dir, self.manifest_path)
+            return True
+        except Exception as e:
+            # The dataset is rescanned, and the rebuild retried, after another debounce
+            print(f"Error rebuilding knowledge base: {e}")
+            self.pending = None
+            return False
+
+    def run(self):
+        print(f"Watching {self.dataset_dir} for knowledge base changes")
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def _version_gauge():
+    return [({}, _active_index["version"])]
+
+
+def _staleness_gauge():
+    # How long the dataset has had changes that readers don't see yet
+    newest = dataset_fingerprint()["mtime"]
+    built_from = _active_index.get("dataset_mtime") or 0.0
+    return [({}, max(0.0, time.time() - newest) if newest > built_from else 0.0)]
+
+
+register_gauge(
+    "echomind_kb_version",
+    "Knowledge base version this worker reads from",
+    _version_gauge,
+)
+register_gauge(
+    "echomind_kb_stale_seconds",
+    "Seconds since the dataset changed without a new version being served",
+    _staleness_gauge,
+)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+
+    if command == "watch":
+        watcher = KnowledgeBaseWatcher()
+        watcher.start()
+        try:
+            while watcher.is_alive():
+                watcher.join(1.0)
+        except KeyboardInterrupt:
+            watcher.stop()
+    elif command == "rebuild":
+        rebuild()
+    elif command == "rollback":
+        rollback()
+    elif command == "status":
+        manifest = read_manifest()
+        previous = manifest.get("previous")
+        print(f"Active version: {manifest['version']}")
+        print(f"Collection: {manifest['collection']}")
+        print(f"BM25 index: {manifest['bm25_index_path']}")
+        print(f"Languages: {', '.join(manifest.get('languages', ['english']))}")
+        if previous:
+            print(f"Previous version (for rollback): {previous['version']}")
+        current = dataset_fingerprint()["fingerprint"]
+        up_to_date = current == manifest["dataset_fingerprint"]
+        print(f"Dataset changed since last build: {'no' if up_to_date else 'yes'}")
+    else:
+        print("Usage: python knowledge_base.py [status|watch|rebuild|rollback]")
+
+
+if __name__ == "__main__":
+    main()
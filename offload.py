@@ -0,0 +1,33 @@
+import sys
+
+
+def eventlet_patched() -> bool:
+    """Whether eventlet.monkey_patch() has replaced threads with green threads."""
+    eventlet = sys.modules.get("eventlet")
+    return eventlet is not None and eventlet.patcher.is_monkey_patched("thread")
+
+
+def run_cpu_bound(function, *args, **kwargs):
+    """
+    Run CPU-heavy work (encoding, BM25 scoring, password hashing) so it
+    doesn't stall other requests.
+
+    Under the eventlet server (python chat_server.py) every connection runs
+    on one OS thread, so the work is sent to eventlet's pool of real threads;
+    numpy, torch and hashlib release the GIL while they compute. Everywhere
+    else the caller's thread is already a real one and the function simply
+    runs on it.
+
+    Args:
+        function: Function to run; it mustn't use eventlet itself
+        *args: Positional arguments for the function
+        **kwargs: Keyword arguments for the function
+
+    Returns:
+        What the function returns
+    """
+    if eventlet_patched():
+        from eventlet import tpool
+
+        return tpool.execute(function, *args, **kwargs)
+    return function(*args, **kwargs)
@@ -0,0 +1,175 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from astra_connection import connect_to_astradb
+from intent_gate import classify_turn
+from telemetry import increment, span
+from throttle import MAX_TRACKED_KEYS, TokenBucketLimiter
+from therapeutic_assistant import retrieve_knowledge
+
+# Configuration
+PREFETCH_WORKERS = 2  # Drafts searched at the same time, per process
+MAX_QUEUED_PREFETCHES = 16  # Drafts waiting for a worker before more are skipped
+MIN_PREFETCH_CHARS = 12  # Shorter drafts aren't worth searching for yet
+PREFETCH_BURST = 3  # Prefetches a session may start at once...
+PREFETCH_PER_SECOND = 0.5  # ...and then at this rate
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class Prefetcher:
+    """
+    Warms the retrieval caches with a user's draft message while they type.
+
+    The browser sends the draft after a pause in typing, tagged with an
+    increasing generation number. Only the newest draft of a session is
+    searched: older ones still waiting for a worker are dropped, and sending
+    the message drops any that haven't started yet. When the sent message
+    matches a finished prefetch, its retrieval comes from the cache, and the
+    time the prefetch spent is counted as saved.
+    """
+
+    def __init__(
+        self,
+        workers: int = PREFETCH_WORKERS,
+        max_queued: int = MAX_QUEUED_PREFETCHES,
+        limiter: Optional[TokenBucketLimiter] = None,
+    ):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="prefetch"
+        )
+        self.max_queued = max_queued
+        self.limiter = limiter or TokenBucketLimiter(
+            "prefetch", capacity=PREFETCH_BURST, refill_per_second=PREFETCH_PER_SECOND
+        )
+        self.lock = threading.Lock()
+        self.queued = 0
+        # client -> (newest generation, generation up to which drafts are cancelled)
+        self.generations: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+        # (client, normalized draft) -> seconds its retrieval took
+        self.finished: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self.local = threading.local()
+        # Encoder and search time spent on prefetches, against the time saved
+        self.totals = {
+            "prefetched": 0,
+            "used": 0,
+            "work_seconds": 0.0,
+            "saved_seconds": 0.0,
+        }
+
+    def _remember(self, mapping: OrderedDict, key, value):
+        mapping[key] = value
+        mapping.move_to_end(key)
+        if len(mapping) > MAX_TRACKED_KEYS:
+            mapping.popitem(last=False)
+
+    def schedule(self, client: str, text: str, language: str, generation: int) -> str:
+        """
+        Start searching for a draft message in the background.
+
+        Args:
+            client: Whose draft it is (see admission.client_key)
+            text: The draft message
+            language: Session language
+            generation: Number of the draft; must grow with every draft a
+                        client sends
+
+        Returns:
+            "scheduled", "throttled", or "skipped" if the draft is stale,
+            too short, small talk, already prefetched or the workers are busy
+        """
+        key = (client, _normalize(text))
+        if len(key[1]) < MIN_PREFETCH_CHARS or not classify_turn(text)["retrieve"]:
+            return self._count("skipped")
+
+        with self.lock:
+            newest, cancelled = self.generations.get(client, (-1, -1))
+            if generation <= newest:
+                return self._count("skipped")
+            self._remember(self.generations, client, (generation, cancelled))
+            if key in self.finished or self.queued >= self.max_queued:
+                return self._count("skipped")
+
+        if not self.limiter.allow(client)[0]:
+            return self._count("throttled")
+
+        with self.lock:
+            self.queued += 1
+        self.executor.submit(self._run, key, text, language, generation)
+        return "scheduled"
+
+    def _count(self, result: str) -> str:
+        increment("echomind_prefetch_total", result=result)
+        return result
+
+    def _run(self, key: Tuple[str, str], text: str, language: str, generation: int):
+        client = key[0]
+        with self.lock:
+            self.queued -= 1
+            newest, cancelled = self.generations.get(client, (-1, -1))
+        if generation != newest or generation <= cancelled:
+            self._count("cancelled")
+            return
+
+        start = time.perf_counter()
+        try:
+            with span("prefetch"):
+                if getattr(self.local, "db", None) is None:
+                    self.local.db = connect_to_astradb()
+                retrieve_knowledge(self.local.db, text, language)
+        except Exception as e:
+            print(f"Prefetch failed: {e}")
+            self._count("failed")
+            return
+        elapsed = time.perf_counter() - start
+
+        increment("echomind_prefetch_work_seconds_total", elapsed)
+        with self.lock:
+            self._remember(self.finished, key, elapsed)
+            self.totals["prefetched"] += 1
+            self.totals["work_seconds"] += elapsed
+        self._count("done")
+
+    def cancel(self, client: str):
+        """Drop a client's drafts that haven't been searched yet, e.g. on send."""
+        with self.lock:
+            newest, _ = self.generations.get(client, (-1, -1))
+            self._remember(self.generations, client, (newest, newest))
+
+    def record_send(self, client: str, text: str, timings: Dict[str, float]) -> float:
+        """
+        Count the latency a prefetch saved for a message that has been answered.
+
+        Args:
+            client: Who sent the message
+            text: The sent message
+            timings: Stage timings of its response; a retrieval served from
+                     the cache has no "search_ms"
+
+        Returns:
+            Seconds saved, or 0.0 if no prefetch was used
+        """
+        with self.lock:
+            saved = self.finished.pop((client, _normalize(text)), None)
+        if saved is None or "search_ms" in timings:
+            return 0.0
+        with self.lock:
+            self.totals["used"] += 1
+            self.totals["saved_seconds"] += saved
+        increment("echomind_prefetch_hits_total")
+        increment("echomind_prefetch_saved_seconds_total", saved)
+        return saved
+
+    def stats(self) -> Dict[str, float]:
+        """Prefetches finished and used so far, with the time spent and saved."""
+        with self.lock:
+            return dict(self.totals)
+
+
+# Shared by all requests in this process
+prefetcher = Prefetcher()
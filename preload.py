@@ -0,0 +1,141 @@
+import os
+import gc
+import sys
+from typing import List, Dict, Optional
+
+from telemetry import register_gauge, span
+from knowledge_base import get_active_index, language_index
+from bm25_index import get_bm25_index
+from text_to_vector_db import get_embedding_model
+
+# Fields of /proc/<pid>/smaps_rollup included in memory reports
+MEMORY_FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared_clean",
+    "Shared_Dirty": "shared_dirty",
+    "Private_Clean": "private_clean",
+    "Private_Dirty": "private_dirty",
+}
+
+
+def preload_shared_state(warm_up: bool = False):
+    """
+    Load the embedding models and BM25 indexes of the active knowledge base
+    version before worker processes are forked.
+
+    Workers inherit both copy-on-write, so the weights and the index are held
+    in memory once instead of once per worker. The BM25 postings are
+    memory-mapped and share the page cache even across unrelated processes.
+    Freezing the garbage collector afterwards keeps collections in the workers
+    from writing to (and so un-sharing) the pages of these preloaded objects.
+
+    Args:
+        warm_up: Also run one encode in the master. Off by default, because
+                 forking after torch has started its OpenMP thread pool can
+                 hang the workers' first encode on some platforms.
+    """
+    try:
+        with span("preload"):
+            model = get_embedding_model()
+            index = get_active_index()
+            for language in index.get("languages", ["english"]):
+                target = language_index(index, language)
+                get_embedding_model(target["model_name"])
+                get_bm25_index(target["bm25_index_path"])
+            if warm_up:
+                model.encode("warm up")
+        print(f"Preloaded embedding model and BM25 index in process {os.getpid()}")
+    except Exception as e:
+        # Workers will load what they need lazily instead
+        print(f"Preloading failed, workers will load models themselves: {e}")
+
+    gc.collect()
+    gc.freeze()
+
+
+def memory_report(pid: Optional[int] = None) -> Dict[str, int]:
+    """
+    Read a process's memory usage from /proc (Linux only).
+
+    PSS (proportional set size) splits each shared page between the processes
+    that map it, so summing PSS over the master and its workers gives their
+    real combined footprint; Private_Dirty is what each worker owns outright.
+
+    Args:
+        pid: Process to inspect (default: the current process)
+
+    Returns:
+        Dictionary of memory figures in bytes, empty if /proc isn't available
+    """
+    path = f"/proc/{pid or os.getpid()}/smaps_rollup"
+    report = {}
+    try:
+        with open(path, "r") as file:
+            for line in file:
+                field, _, value = line.partition(":")
+                if field in MEMORY_FIELDS:
+                    report[MEMORY_FIELDS[field]] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return report
+
+
+def child_pids(pid: int) -> List[int]:
+    """List the direct child processes of a process (Linux only)."""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as file:
+                # The parent pid is the second field after the "(comm)" field
+                fields = file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def _memory_gauge():
+    return [({"kind": kind}, value) for kind, value in memory_report().items()]
+
+
+register_gauge(
+    "echomind_process_memory_bytes",
+    "Memory of this worker process, from /proc/self/smaps_rollup",
+    _memory_gauge,
+)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python preload.py <gunicorn master pid>")
+        return
+
+    master = int(sys.argv[1])
+    processes = [("master", master)] + [("worker", p) for p in child_pids(master)]
+
+    print(f"{'process':<8} {'pid':>8} {'RSS MB':>10} {'PSS MB':>10} {'private MB':>12}")
+    total_rss = total_pss = 0
+    for role, pid in processes:
+        report = memory_report(pid)
+        if not report:
+            continue
+        private = report["private_clean"] + report["private_dirty"]
+        total_rss += report["rss"]
+        total_pss += report["pss"]
+        print(
+            f"{role:<8} {pid:>8} {report['rss'] / 2**20:>10.1f} "
+            f"{report['pss'] / 2**20:>10.1f} {private / 2**20:>12.1f}"
+        )
+
+    # RSS counts shared pages once per process; PSS counts them once in total
+    print(f"{'total':<8} {'':>8} {total_rss / 2**20:>10.1f} {total_pss / 2**20:>10.1f}")
+    if total_rss:
+        print(f"Shared pages save {1 - total_pss / total_rss:.0%} of summed RSS")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from intent_gate import classify_risk
+from knowledge_base import get_active_index, language_index
+from retrieval import embed_query
+from telemetry import increment, register_gauge
+
+# Load environment variables
+load_dotenv()
+
+# Configuration
+# Reuse responses to low-temperature first messages (off by default)
+CACHE_RESPONSES = os.environ.get("RESPONSE_CACHE", "").lower() in ("1", "true", "yes")
+# SQLite database file shared by all workers on the machine
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", "response_cache.db")
+# How long a cached response may be served, in seconds
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_SIZE = 512  # Cache keys kept in memory per process
+MAX_ENTRIES_PER_KEY = 8  # Differently worded messages kept per cache key
+SIMILARITY_THRESHOLD = 0.95  # Minimum cosine similarity between the messages
+MAX_CACHED_TEMPERATURE = 0.2  # Higher temperatures are meant to vary
+MAX_CACHED_HISTORY_MESSAGES = 2  # Longer histories always get a fresh response
+PRUNE_EVERY = 100  # Stores between deletions of expired responses from disk
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cache_key TEXT NOT NULL,
+    query TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    response TEXT NOT NULL,
+    sources TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_by_key ON responses (cache_key, created_at);
+CREATE INDEX IF NOT EXISTS responses_by_age ON responses (created_at);
+"""
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class ResponseCache:
+    """
+    Responses to low-temperature first messages, reused for similar messages.
+
+    A response is only reused for a message that gets exactly the same
+    prompt apart from its wording: same knowledge base version, language,
+    temperature bucket (0.0, 0.1 or 0.2), retrieved chunks and (empty or
+    short) history. Within that key, the message must be the same once
+    normalized, or its embedding close enough to the cached one's.
+
+    Recently used keys are kept in memory, up to `max_keys`; all entries are
+    also stored in SQLite, so workers share them and they survive restarts.
+    Entries expire after `ttl` seconds. Crisis messages and turns with more
+    than MAX_CACHED_HISTORY_MESSAGES of history are never cached.
+    """
+
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_PATH,
+        enabled: bool = CACHE_RESPONSES,
+        max_keys: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL,
+        similarity: float = SIMILARITY_THRESHOLD,
+    ):
+        self.path = path
+        self.enabled = enabled
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.similarity = similarity
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # cache key -> entries, each with "query", "embedding", "response",
+        # "sources" and "created_at"
+        self.entries: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self.stores = 0
+        # language -> {"hits": ..., "misses": ...}
+        self.counts: Dict[str, Dict[str, int]] = {}
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        # Connections can't be shared with processes forked after they were opened
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def _count(self, language: str, result: str):
+        increment(
+            "echomind_response_cache_requests_total", language=language, result=result
+        )
+        if result == "skipped":
+            return
+        with self.lock:
+            counts = self.counts.setdefault(language, {"hits": 0, "misses": 0})
+            counts["misses" if result == "miss" else "hits"] += 1
+
+    def _load(self, cache_key: str) -> List[Dict[str, Any]]:
+        """Read the unexpired entries of a key from disk, newest first."""
+        rows = self._connection().execute(
+            "SELECT query, embedding, response, sources, created_at FROM responses "
+            "WHERE cache_key = ? AND created_at > ? ORDER BY created_at DESC LIMIT ?",
+            (cache_key, time.time() - self.ttl, MAX_ENTRIES_PER_KEY),
+        )
+        return [
+            {
+                "query": row["query"],
+                "embedding": np.frombuffer(row["embedding"], dtype=np.float32),
+                "response": row["response"],
+                "sources": json.loads(row["sources"]),
+                "created_at": row["created_at"],
+            }
+            for row in rows
+        ]
+
+    def _remember(self, cache_key: str, entries: List[Dict[str, Any]]):
+        with self.lock:
+            self.entries[cache_key] = entries
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.max_keys:
+                self.entries.popitem(last=False)
+
+    def _match(
+        self, entries: List[Dict[str, Any]], query: str, embedding: np.ndarray
+    ) -> Optional[Dict[str, Any]]:
+        oldest = time.time() - self.ttl
+        for entry in entries:
+            if entry["created_at"] <= oldest:
+                continue
+            if entry["query"] == query or (
+                float(np.dot(entry["embedding"], embedding)) >= self.similarity
+            ):
+                return entry
+        return None
+
+    def lookup(
+        self,
+        user_query: str,
+        language: str,
+        temperature: float,
+        chunk_ids: List[str],
+        conversation_history=None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Look for a cached response to a message.
+
+        Args:
+            user_query: The user's message
+            language: Language of the response
+            temperature: Temperature of the response
+            chunk_ids: Identifiers of the retrieved chunks, in prompt order
+                       (empty for turns without retrieval)
+            conversation_history: The conversation so far, before any trimming
+
+        Returns:
+            None if the turn can't be cached; otherwise a dictionary to pass
+            to store(), whose "response" and "sources" are set on a hit and
+            None on a miss
+        """
+        history = conversation_history or []
+        if (
+            not self.enabled
+            or temperature > MAX_CACHED_TEMPERATURE
+            or len(history) > MAX_CACHED_HISTORY_MESSAGES
+            or classify_risk(user_query)["crisis"]
+        ):
+            if self.enabled:
+                self._count(language, "skipped")
+            return None
+
+        active_index = get_active_index()
+        history_hash = hashlib.sha256(
+            json.dumps(
+                [[m["role"], _normalize(m["content"])] for m in history],
+                ensure_ascii=False,
+            ).encode("utf-8")
+        ).hexdigest()
+        cache_key = hashlib.sha256(
+            json.dumps(
+                [
+                    active_index["version"],
+                    language,
+                    round(temperature, 1),
+                    list(chunk_ids),
+                    history_hash,
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+
+        # Same encoder as retrieval, so the embedding usually comes from its cache
+        model_name = language_index(active_index, language)["model_name"]
+        embedding = np.asarray(embed_query(user_query, model_name), dtype=np.float32)
+        embedding = embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+        query = _normalize(user_query)
+        lookup = {
+            "cache_key": cache_key,
+            "query": query,
+            "embedding": embedding,
+            "language": language,
+            "response": None,
+            "sources": None,
+        }
+
+        with self.lock:
+            entries = self.entries.get(cache_key)
+            if entries is not None:
+                self.entries.move_to_end(cache_key)
+        entry = self._match(entries or [], query, embedding)
+        result = "memory_hit"
+        if entry is None:
+            # Other workers may have cached a response since
+            try:
+                entries = self._load(cache_key)
+            except sqlite3.Error as e:
+                print(f"Could not read the response cache: {e}")
+                entries = []
+            self._remember(cache_key, entries)
+            entry = self._match(entries, query, embedding)
+            result = "disk_hit"
+
+        self._count(language, result if entry else "miss")
+        if entry:
+            lookup["response"] = entry["response"]
+            lookup["sources"] = list(entry["sources"])
+        return lookup
+
+    def store(self, lookup: Dict[str, Any], response: str, sources: List[str]):
+        """
+        Cache a freshly generated response.
+
+        Args:
+            lookup: What lookup() returned for the message
+            response: The generated response
+            sources: Sources returned with it
+        """
+        entry = {
+            "query": lookup["query"],
+            "embedding": lookup["embedding"],
+            "response": response,
+            "sources": list(sources),
+            "created_at": time.time(),
+        }
+        cache_key = lookup["cache_key"]
+        with self.lock:
+            entries = [entry] + self.entries.get(cache_key, [])
+            self.stores += 1
+            prune = self.stores % PRUNE_EVERY == 0
+        self._remember(cache_key, entries[:MAX_ENTRIES_PER_KEY])
+
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    "INSERT INTO responses "
+                    "(cache_key, query, embedding, response, sources, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        cache_key,
+                        entry["query"],
+                        entry["embedding"].tobytes(),
+                        response,
+                        json.dumps(entry["sources"], ensure_ascii=False),
+                        entry["created_at"],
+                    ),
+                )
+                if prune:
+                    connection.execute(
+                        "DELETE FROM responses WHERE created_at <= ?",
+                        (time.time() - self.ttl,),
+                    )
+        except sqlite3.Error as e:
+            print(f"Could not write to the response cache: {e}")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Hits, misses and hit rate of this process, per language."""
+        with self.lock:
+            return {
+                language: {
+                    **counts,
+                    "hit_rate": counts["hits"] / (counts["hits"] + counts["misses"]),
+                }
+                for language, counts in self.counts.items()
+            }
+
+
+# Shared by all requests in this process
+response_cache = ResponseCache()
+
+
+register_gauge(
+    "echomind_response_cache_keys",
+    "Response cache keys held in memory by this worker",
+    lambda: [({}, len(response_cache.entries))],
+)
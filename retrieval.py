@@ -0,0 +1,329 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from telemetry import record_cache, register_cache, span
+from bm25_index import BM25_INDEX_PATH
+from offload import run_cpu_bound
+from text_to_vector_db import EMBEDDING_MODEL, get_embedding_model, hybrid_search
+
+# Configuration
+CANDIDATE_MULTIPLIER = 4  # Over-fetch this many candidates per requested chunk
+SIMILARITY_THRESHOLD = 0.62  # Minimum Astra $similarity, i.e. (1 + cosine) / 2
+CONTEXT_TOKEN_BUDGET = 600  # Maximum prompt tokens spent on retrieved context
+CHARS_PER_TOKEN = 4  # Rough token estimate used for budgeting
+MMR_LAMBDA = 0.7  # Relevance vs. diversity trade-off for MMR (1.0 = relevance only)
+RERANK_METHOD = "mmr"  # "mmr", "cross-encoder" or "none"
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RETRIEVAL_CACHE_SIZE = 256  # Retrieval results kept per process (0 disables the cache)
+EMBEDDING_CACHE_SIZE = 256  # Query embeddings kept per process (0 disables the cache)
+
+# Recent retrieval results, keyed by knowledge base version and query
+_retrieval_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_retrieval_cache_lock = threading.Lock()
+
+# Recent query embeddings, keyed by encoder and query
+_embedding_cache: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_cross_encoder(model_name: str = CROSS_ENCODER_MODEL):
+    """
+    Load a cross-encoder model once and reuse it for every later call.
+
+    Args:
+        model_name: Name of the CrossEncoder model to load
+
+    Returns:
+        The loaded model
+    """
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(model_name)
+
+
+register_cache("cross_encoder", get_cross_encoder)
+
+
+def clear_retrieval_cache():
+    """Forget all cached retrieval results, e.g. after a knowledge base swap."""
+    with _retrieval_cache_lock:
+        _retrieval_cache.clear()
+
+
+def embed_query(query: str, model_name: str = EMBEDDING_MODEL) -> np.ndarray:
+    """
+    Encode a query, reusing the embedding of an identical recent query.
+
+    Args:
+        query: The user's message
+        model_name: Name of the SentenceTransformer model to use
+
+    Returns:
+        The query embedding
+    """
+    cache_key = (model_name, " ".join(query.split()))
+    with _embedding_cache_lock:
+        cached = _embedding_cache.get(cache_key)
+        if cached is not None:
+            _embedding_cache.move_to_end(cache_key)
+    record_cache("query_embedding", cached is not None)
+    if cached is not None:
+        return cached
+
+    embedding = run_cpu_bound(get_embedding_model(model_name).encode, query)
+    if EMBEDDING_CACHE_SIZE > 0:
+        with _embedding_cache_lock:
+            _embedding_cache[cache_key] = embedding
+            while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+                _embedding_cache.popitem(last=False)
+    return embedding
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate how many prompt tokens a text will use."""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale vectors to unit length so dot products are cosine similarities."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def attach_embeddings(
+    candidates: List[Dict[str, Any]],
+    query_embedding: np.ndarray,
+    model_name: str = EMBEDDING_MODEL,
+) -> np.ndarray:
+    """
+    Make sure every candidate has a vector and a $similarity score.
+
+    Vector hits already carry both from Astra. Chunks found only by the BM25
+    index are encoded locally, and their similarity is computed on the same
+    (1 + cosine) / 2 scale Astra uses.
+
+    Args:
+        candidates: Retrieved chunk dictionaries (updated in place)
+        query_embedding: Embedding of the user query
+        model_name: Name of the SentenceTransformer model to use
+
+    Returns:
+        Matrix of unit-length candidate embeddings, one row per candidate
+    """
+    missing = [i for i, chunk in enumerate(candidates) if "$vector" not in chunk]
+    if missing:
+        model = get_embedding_model(model_name)
+        encoded = run_cpu_bound(
+            model.encode, [candidates[i]["chunk_text"] for i in missing]
+        )
+        for i, vector in zip(missing, encoded):
+            candidates[i]["$vector"] = vector.tolist()
+
+    vectors = _normalize(np.array([chunk["$vector"] for chunk in candidates]))
+    query_vector = _normalize(np.asarray(query_embedding))
+    for chunk, cosine in zip(candidates, vectors @ query_vector):
+        chunk.setdefault("$similarity", (1.0 + float(cosine)) / 2.0)
+
+    return vectors
+
+
+def maximal_marginal_relevance(
+    query_embedding: np.ndarray,
+    vectors: np.ndarray,
+    limit: int,
+    lambda_mult: float = MMR_LAMBDA,
+) -> List[int]:
+    """
+    Pick chunks that are relevant to the query but not redundant with each other.
+
+    Args:
+        query_embedding: Embedding of the user query
+        vectors: Unit-length candidate embeddings, one row per candidate
+        limit: Maximum number of chunks to select
+        lambda_mult: Weight of relevance against diversity
+
+    Returns:
+        Indices of the selected candidates, in selection order
+    """
+    relevance = vectors @ _normalize(np.asarray(query_embedding))
+    pairwise = vectors @ vectors.T
+
+    selected: List[int] = []
+    remaining = list(range(len(vectors)))
+    while remaining and len(selected) < limit:
+        if selected:
+            redundancy = pairwise[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy
+        best = remaining[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+
+    return selected
+
+
+def trim_to_token_budget(
+    chunks: List[Dict[str, Any]], token_budget: int = CONTEXT_TOKEN_BUDGET
+) -> List[Dict[str, Any]]:
+    """
+    Keep chunks in ranked order until the context token budget is used up.
+
+    Args:
+        chunks: Ranked chunk dictionaries
+        token_budget: Maximum number of tokens for all chunk texts combined
+
+    Returns:
+        The chunks that fit; the first chunk is truncated if it alone is too long
+    """
+    kept = []
+    used = 0
+    for chunk in chunks:
+        tokens = estimate_tokens(chunk["chunk_text"])
+        if used + tokens > token_budget:
+            if not kept:
+                truncated = chunk["chunk_text"][: token_budget * CHARS_PER_TOKEN]
+                kept.append({**chunk, "chunk_text": truncated})
+            break
+        kept.append(chunk)
+        used += tokens
+    return kept
+
+
+def retrieve_context(
+    db,
+    query: str,
+    top_k: int = 3,
+    language: Optional[str] = None,
+    collection_name: str = "text_vectors",
+    candidate_multiplier: int = CANDIDATE_MULTIPLIER,
+    similarity_threshold: float = SIMILARITY_THRESHOLD,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    rerank_method: str = RERANK_METHOD,
+    bm25_index_path: str = BM25_INDEX_PATH,
+    index_version: int = 0,
+    model_name: str = EMBEDDING_MODEL,
+    query_embedding: Optional[np.ndarray] = None,
+) -> Dict[str, Any]:
+    """
+    Retrieve, re-rank and trim knowledge base chunks for a user query.
+
+    Over-fetches candidates with hybrid search, drops those below the
+    similarity threshold, re-ranks the rest and keeps as many as fit the token
+    budget. The number of chunks returned adapts between 0 and top_k.
+    Results are cached per knowledge base version, so a repeated query skips
+    all of this until the index is swapped.
+
+    Args:
+        db: AstraDB database client
+        query: The user's message
+        top_k: Maximum number of chunks to return
+        language: Language of the query
+        collection_name: Name of the collection to search in
+        candidate_multiplier: How many candidates to fetch per returned chunk
+        similarity_threshold: Minimum $similarity a chunk needs to be kept
+        token_budget: Maximum number of context tokens
+        rerank_method: "mmr", "cross-encoder" or "none"
+        bm25_index_path: Directory of the BM25 index to search
+        index_version: Knowledge base version the collection and index belong to
+        model_name: Encoder the collection's vectors were made with
+        query_embedding: Precomputed embedding of the query (encoded if not given)
+
+    Returns:
+        Dictionary with the selected "chunks", the number of "candidates"
+        fetched and per-stage "timings" in milliseconds
+    """
+    timings = {}
+
+    cache_key = (
+        index_version,
+        collection_name,
+        " ".join(query.lower().split()),
+        language,
+        top_k,
+        candidate_multiplier,
+        similarity_threshold,
+        token_budget,
+        rerank_method,
+    )
+    with _retrieval_cache_lock:
+        cached = _retrieval_cache.get(cache_key)
+        if cached is not None:
+            _retrieval_cache.move_to_end(cache_key)
+    record_cache("retrieval", cached is not None)
+    if cached is not None:
+        return {
+            "chunks": [dict(chunk) for chunk in cached["chunks"]],
+            "candidates": cached["candidates"],
+            "timings": timings,
+        }
+
+    # Encode the query once and reuse it for search and re-ranking
+    if query_embedding is None:
+        with span("embed", timings):
+            query_embedding = embed_query(query, model_name)
+
+    with span("search", timings):
+        candidates = hybrid_search(
+            db=db,
+            query=query,
+            model_name=model_name,
+            collection_name=collection_name,
+            limit=top_k * candidate_multiplier,
+            language=language,
+            query_embedding=query_embedding,
+            include_vectors=True,
+            bm25_index_path=bm25_index_path,
+        )
+
+    # Drop weak matches before spending any effort re-ranking them
+    with span("filter", timings):
+        chunks = []
+        if candidates:
+            vectors = attach_embeddings(candidates, query_embedding, model_name)
+            keep = [
+                i
+                for i, chunk in enumerate(candidates)
+                if chunk["$similarity"] >= similarity_threshold
+            ]
+            chunks = [candidates[i] for i in keep]
+            vectors = vectors[keep]
+
+    with span("rerank", timings):
+        if len(chunks) > 1:
+            if rerank_method == "mmr":
+                order = maximal_marginal_relevance(query_embedding, vectors, top_k)
+                chunks = [chunks[i] for i in order]
+            elif rerank_method == "cross-encoder":
+                scores = run_cpu_bound(
+                    get_cross_encoder().predict,
+                    [(query, chunk["chunk_text"]) for chunk in chunks],
+                )
+                order = np.argsort(-np.asarray(scores), kind="stable")
+                chunks = [chunks[i] for i in order]
+            else:
+                chunks.sort(key=lambda chunk: chunk["$similarity"], reverse=True)
+        chunks = chunks[:top_k]
+
+    with span("trim", timings):
+        chunks = trim_to_token_budget(chunks, token_budget)
+
+    # The stored vectors are only needed for re-ranking
+    for chunk in chunks:
+        chunk.pop("$vector", None)
+
+    if RETRIEVAL_CACHE_SIZE > 0:
+        with _retrieval_cache_lock:
+            _retrieval_cache[cache_key] = {
+                "chunks": [dict(chunk) for chunk in chunks],
+                "candidates": len(candidates),
+            }
+            while len(_retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+                _retrieval_cache.popitem(last=False)
+
+    return {"chunks": chunks, "candidates": len(candidates), "timings": timings}
@@ -271,14 +271,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
         
         // Also update server-side setting
-        fetch('/api/set_tts', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ enabled: isTtsEnabled })
-        })
-        .catch(error => console.error('Error updating TTS setting:', error));
+        saveSetting('/api/set_tts', { enabled: isTtsEnabled }, { tts_enabled: isTtsEnabled });
     }
     
     // Toggle theme (dark/light mode)
@@ -447,42 +440,227 @@ document.addEventListener('DOMContentLoaded', () => {
         temperatureValue.textContent = temperature;
         
         // Update the server-side setting
-        fetch('/api/set_temperature', {
+        saveSetting('/api/set_temperature', { temperature }, { temperature });
+    }
+
+    // Read a JSON response, turning error statuses into exceptions
+    async function readResponse(response) {
+        if (!response.ok) {
+            const errorText = await response.text();
+            let errorMessage;
+            
+            try {
+                // Try to parse the error response as JSON
+                const errorData = JSON.parse(errorText);
+                errorMessage = errorData.error || 'An unknown error occurred';
+            } catch (e) {
+                // If not JSON, use the text directly
+                errorMessage = errorText || `Error: ${response.status} ${response.statusText}`;
+            }
+            
+            throw new Error(errorMessage);
+        }
+        
+        return { ok: true, data: await response.json() };
+    }
+
+    // Safe fetch with error handling
+    async function safeFetch(url, options) {
+        try {
+            return await readResponse(await fetch(url, options));
+        } catch (error) {
+            console.error('Network error:', error.message);
+            throw error;
+        }
+    }
+
+    // WebSocket chat channel; the HTTP endpoints are used whenever it isn't open
+    let chatSocket = null;
+    let socketReady = false;
+    let streamingMessage = null;
+    // Requests waiting for their reply, keyed by request type
+    const pendingReplies = {};
+
+    function connectSocket() {
+        if (!('WebSocket' in window)) return;
+
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const socket = new WebSocket(`${protocol}//${window.location.host}/ws`);
+        let opened = false;
+
+        socket.addEventListener('open', () => {
+            opened = true;
+        });
+        socket.addEventListener('message', (event) => {
+            handleSocketMessage(JSON.parse(event.data));
+        });
+        socket.addEventListener('close', () => {
+            chatSocket = null;
+            socketReady = false;
+            Object.keys(pendingReplies).forEach(request => {
+                pendingReplies[request].reject(new Error('Connection lost'));
+                delete pendingReplies[request];
+            });
+            // Only reconnect if the server supports the channel
+            if (opened) {
+                setTimeout(connectSocket, 2000);
+            }
+        });
+
+        chatSocket = socket;
+    }
+
+    // Send a request over the socket and wait for its reply
+    function socketRequest(payload, replyType) {
+        return new Promise((resolve, reject) => {
+            pendingReplies[payload.type] = { replyType, resolve, reject };
+            chatSocket.send(JSON.stringify(payload));
+        });
+    }
+
+    function handleSocketMessage(data) {
+        if (data.type === 'ready') {
+            socketReady = true;
+            return;
+        }
+        if (data.type === 'token') {
+            appendStreamedText(data.text);
+            return;
+        }
+        if (data.type === 'safety') {
+            // Crisis support, shown before the response is generated
+            addMessage('assistant', data.text);
+            return;
+        }
+        if (data.type === 'reflection' && data.background) {
+            showReflection(data.reflection);
+            return;
+        }
+
+        const request = data.type === 'error'
+            ? data.request
+            : Object.keys(pendingReplies).find(key => pendingReplies[key].replyType === data.type);
+        const pending = pendingReplies[request];
+        if (!pending) return;
+        delete pendingReplies[request];
+
+        if (data.type === 'error') {
+            pending.reject(new Error(data.error));
+        } else {
+            pending.resolve({ ok: true, data });
+        }
+    }
+
+    // Show the response as it is generated, until the complete message arrives
+    function appendStreamedText(text) {
+        if (!streamingMessage) {
+            loadingSpinner.classList.add('hidden');
+            streamingMessage = document.createElement('div');
+            streamingMessage.className = 'assistant-message streaming';
+            const messageContent = document.createElement('div');
+            messageContent.className = 'message-content';
+            streamingMessage.appendChild(messageContent);
+            chatContainer.appendChild(streamingMessage);
+        }
+        streamingMessage.firstChild.textContent += text;
+        chatContainer.scrollTop = chatContainer.scrollHeight;
+    }
+
+    function removeStreamedText() {
+        if (streamingMessage) {
+            streamingMessage.remove();
+            streamingMessage = null;
+        }
+    }
+
+    // Update a server-side setting, over the socket if it is open
+    function saveSetting(url, body, setting) {
+        if (socketReady) {
+            chatSocket.send(JSON.stringify({ type: 'settings', ...setting }));
+            return;
+        }
+        fetch(url, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ temperature })
+            body: JSON.stringify(body)
         })
-        .catch(error => console.error('Error updating temperature setting:', error));
+        .catch(error => console.error(`Error updating setting at ${url}:`, error));
     }
 
-    // Safe fetch with error handling
-    async function safeFetch(url, options) {
-        try {
-            const response = await fetch(url, options);
-            
-            if (!response.ok) {
-                const errorText = await response.text();
-                let errorMessage;
-                
-                try {
-                    // Try to parse the error response as JSON
-                    const errorData = JSON.parse(errorText);
-                    errorMessage = errorData.error || 'An unknown error occurred';
-                } catch (e) {
-                    // If not JSON, use the text directly
-                    errorMessage = errorText || `Error: ${response.status} ${response.statusText}`;
+    // Prefetch knowledge base context for the draft while the user types
+    const PREFETCH_DELAY_MS = 400;
+    const MIN_PREFETCH_CHARS = 12;
+    let prefetchTimer = null;
+    // Numbers the drafts so the server only searches the newest; starting
+    // from the clock keeps it increasing across page reloads
+    let prefetchGeneration = Date.now();
+
+    function schedulePrefetch() {
+        clearTimeout(prefetchTimer);
+        const text = userInput.value.trim();
+        if (text.length < MIN_PREFETCH_CHARS) return;
+
+        prefetchTimer = setTimeout(() => {
+            prefetchGeneration += 1;
+            const draft = { text, generation: prefetchGeneration };
+            if (socketReady) {
+                chatSocket.send(JSON.stringify({ type: 'prefetch', ...draft }));
+                return;
+            }
+            fetch('/api/prefetch', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify(draft)
+            })
+            .catch(error => console.error('Error prefetching context:', error));
+        }, PREFETCH_DELAY_MS);
+    }
+
+    // Send a message over HTTP. Crisis messages are answered with JSON lines,
+    // so their safety response is shown before the reply is generated
+    async function postMessage(message) {
+        const response = await fetch('/api/send_message', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ message })
+        });
+        const contentType = response.headers.get('Content-Type') || '';
+        if (!response.ok || !contentType.startsWith('application/x-ndjson')) {
+            return readResponse(response);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        let reply = null;
+        while (true) {
+            const { done, value } = await reader.read();
+            buffered += decoder.decode(value, { stream: !done });
+            const lines = buffered.split('\n');
+            buffered = done ? '' : lines.pop();
+            for (const line of lines) {
+                if (!line.trim()) continue;
+                const data = JSON.parse(line);
+                if (data.safety) {
+                    addMessage('assistant', data.safety);
+                } else if (data.error) {
+                    throw new Error(data.error);
+                } else {
+                    reply = data;
                 }
-                
-                throw new Error(errorMessage);
             }
-            
-            return response.json();
-        } catch (error) {
-            console.error('Network error:', error.message);
-            throw error;
+            if (done) break;
+        }
+        if (!reply) {
+            throw new Error('The response was cut off');
         }
+        return { ok: true, data: reply };
     }
 
     // Send message to server
@@ -490,6 +668,9 @@ document.addEventListener('DOMContentLoaded', () => {
         const message = userInput.value.trim();
         if (!message) return;
 
+        // The message itself replaces any draft waiting to be prefetched
+        clearTimeout(prefetchTimer);
+
         // Clear input
         userInput.value = '';
 
@@ -501,14 +682,11 @@ document.addEventListener('DOMContentLoaded', () => {
         addMessage('user', message);
 
         try {
-            // Send message to server using safeFetch
-            const result = await safeFetch('/api/send_message', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ message })
-            });
+            // Send message over the socket (streamed), or over HTTP
+            const result = socketReady
+                ? await socketRequest({ type: 'message', message }, 'response')
+                : await postMessage(message);
+            removeStreamedText();
 
             if (result.ok) {
                 // Add assistant response to chat
@@ -529,6 +707,7 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         } catch (error) {
             console.error('Error sending message:', error);
+            removeStreamedText();
             // Add error message to chat so user knows something went wrong
             addMessage('assistant', 'Sorry, I encountered an error processing your message. Please try again.');
         } finally {
@@ -537,8 +716,8 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    // Add message to chat UI
-    function addMessage(role, content) {
+    // Build the element showing one chat message
+    function createMessageElement(role, content) {
         const messageDiv = document.createElement('div');
         messageDiv.className = role === 'user' ? 'user-message' : 'assistant-message';
         
@@ -558,17 +737,62 @@ document.addEventListener('DOMContentLoaded', () => {
             
             messageDiv.appendChild(messageContent);
             messageDiv.appendChild(readButton);
-            
-            // Auto-read if TTS is enabled
-            if (isTtsEnabled) {
-                setTimeout(() => speakText(content), 500);
-            }
         }
-        
-        chatContainer.appendChild(messageDiv);
+
+        return messageDiv;
+    }
+
+    // Add message to chat UI
+    function addMessage(role, content) {
+        chatContainer.appendChild(createMessageElement(role, content));
+
+        // Auto-read if TTS is enabled
+        if (role !== 'user' && isTtsEnabled) {
+            setTimeout(() => speakText(content), 500);
+        }
+
         chatContainer.scrollTop = chatContainer.scrollHeight;
     }
 
+    // Older messages are loaded a page at a time when scrolling to the top
+    const HISTORY_SCROLL_THRESHOLD = 80;
+    let historyCursor = chatContainer.dataset.historyCursor || null;
+    let loadingHistory = false;
+
+    async function loadOlderMessages() {
+        if (!historyCursor || loadingHistory) return;
+        loadingHistory = true;
+
+        try {
+            const result = await safeFetch(`/api/history?before=${encodeURIComponent(historyCursor)}`);
+            if (!result.ok) {
+                throw new Error(result.error || 'Failed to load history');
+            }
+
+            // Messages come newest first; insert them above the oldest one
+            // shown, keeping the visible messages where they are on screen
+            const previousHeight = chatContainer.scrollHeight;
+            const fragment = document.createDocumentFragment();
+            result.data.messages.slice().reverse().forEach(message => {
+                fragment.appendChild(createMessageElement(message.role, message.content));
+            });
+            chatContainer.insertBefore(fragment, chatContainer.firstChild);
+            chatContainer.scrollTop += chatContainer.scrollHeight - previousHeight;
+
+            historyCursor = result.data.next_cursor;
+        } catch (error) {
+            console.error('Error loading history:', error);
+        } finally {
+            loadingHistory = false;
+        }
+    }
+
+    function handleChatScroll() {
+        if (chatContainer.scrollTop < HISTORY_SCROLL_THRESHOLD) {
+            loadOlderMessages();
+        }
+    }
+
     // Update sources in the UI
     function updateSources(sources) {
         sourcesContent.innerHTML = '';
@@ -580,50 +804,57 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // Show a reflection in the chat, replacing the previous one
+    function showReflection(reflection) {
+        // Remove existing reflection if any
+        const existingReflection = document.querySelector('.reflection-container');
+        if (existingReflection) {
+            existingReflection.remove();
+        }
+
+        // Add new reflection
+        const reflectionDiv = document.createElement('div');
+        reflectionDiv.className = 'reflection-container';
+        
+        const contentSpan = document.createElement('span');
+        contentSpan.innerHTML = `<span class="reflection-icon">✨</span> <strong>Reflection:</strong> ${reflection}`;
+        
+        const readButton = document.createElement('button');
+        readButton.className = 'read-aloud-btn';
+        readButton.title = uiText[currentLanguage].readAloud || uiText.english.readAloud;
+        readButton.innerHTML = '<i class="fas fa-volume-up"></i>';
+        readButton.addEventListener('click', () => speakText(reflection));
+        
+        reflectionDiv.appendChild(contentSpan);
+        reflectionDiv.appendChild(readButton);
+        chatContainer.appendChild(reflectionDiv);
+        
+        // Auto-read if TTS is enabled
+        if (isTtsEnabled) {
+            setTimeout(() => speakText(reflection), 500);
+        }
+        
+        chatContainer.scrollTop = chatContainer.scrollHeight;
+    }
+
     // Generate reflection
     async function generateReflection() {
         loadingSpinner.classList.remove('hidden');
         ensureSpinnerHidden(); // Start failsafe timer
 
         try {
-            // Send request using safeFetch
-            const result = await safeFetch('/api/generate_reflection', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                }
-            });
+            // Send request over the socket, or using safeFetch
+            const result = socketReady
+                ? await socketRequest({ type: 'reflection' }, 'reflection')
+                : await safeFetch('/api/generate_reflection', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    }
+                });
 
             if (result.ok) {
-                // Remove existing reflection if any
-                const existingReflection = document.querySelector('.reflection-container');
-                if (existingReflection) {
-                    existingReflection.remove();
-                }
-
-                // Add new reflection
-                const reflectionDiv = document.createElement('div');
-                reflectionDiv.className = 'reflection-container';
-                
-                const contentSpan = document.createElement('span');
-                contentSpan.innerHTML = `<span class="reflection-icon">✨</span> <strong>Reflection:</strong> ${result.data.reflection}`;
-                
-                const readButton = document.createElement('button');
-                readButton.className = 'read-aloud-btn';
-                readButton.title = uiText[currentLanguage].readAloud || uiText.english.readAloud;
-                readButton.innerHTML = '<i class="fas fa-volume-up"></i>';
-                readButton.addEventListener('click', () => speakText(result.data.reflection));
-                
-                reflectionDiv.appendChild(contentSpan);
-                reflectionDiv.appendChild(readButton);
-                chatContainer.appendChild(reflectionDiv);
-                
-                // Auto-read if TTS is enabled
-                if (isTtsEnabled) {
-                    setTimeout(() => speakText(result.data.reflection), 500);
-                }
-                
-                chatContainer.scrollTop = chatContainer.scrollHeight;
+                showReflection(result.data.reflection);
             } else {
                 throw new Error(result.error || 'Failed to generate reflection');
             }
@@ -645,10 +876,12 @@ document.addEventListener('DOMContentLoaded', () => {
         ensureSpinnerHidden(); // Start failsafe timer
 
         try {
-            // Use safeFetch for the request
-            const result = await safeFetch('/api/clear_conversation', {
-                method: 'POST'
-            });
+            // Clear over the socket, or using safeFetch
+            const result = socketReady
+                ? await socketRequest({ type: 'clear' }, 'cleared')
+                : await safeFetch('/api/clear_conversation', {
+                    method: 'POST'
+                });
 
             if (result.ok) {
                 // Get welcome message based on current language
@@ -680,6 +913,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 }
                 
                 // Clear chat UI
+                historyCursor = null;
                 chatContainer.innerHTML = `
                     <div class="intro-card">
                         ${welcomeMessage}
@@ -714,14 +948,16 @@ document.addEventListener('DOMContentLoaded', () => {
         ensureSpinnerHidden(); // Start failsafe timer
         
         try {
-            // Use safeFetch for the request
-            const result = await safeFetch('/api/set_language', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ language: newLanguage })
-            });
+            // Change the language over the socket, or using safeFetch
+            const result = socketReady
+                ? await socketRequest({ type: 'settings', language: newLanguage }, 'settings')
+                : await safeFetch('/api/set_language', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({ language: newLanguage })
+                });
 
             if (result.ok) {
                 currentLanguage = newLanguage;
@@ -763,6 +999,10 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         });
 
+        // Prefetch context for the draft when the user pauses typing
+        userInput.addEventListener('input', schedulePrefetch);
+        chatContainer.addEventListener('scroll', handleChatScroll);
+
         // Language change
         languageSelect.addEventListener('change', changeLanguage);
 
@@ -853,6 +1093,9 @@ document.addEventListener('DOMContentLoaded', () => {
         
         // Set up event listeners
         setupEventListeners();
+
+        // Open the WebSocket chat channel
+        connectSocket();
         
         // Scroll chat to bottom on load
         if (chatContainer) {
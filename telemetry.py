@@ -0,0 +1,306 @@
+import os
+import time
+import threading
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Collect metrics for the /metrics endpoint (off by default)
+METRICS_ENABLED = os.environ.get("ECHOMIND_METRICS", "").lower() in ("1", "true", "yes")
+
+# Also export spans with OpenTelemetry, if it's installed (off by default)
+OTEL_ENABLED = os.environ.get("ECHOMIND_OTEL", "").lower() in ("1", "true", "yes")
+
+# Histogram buckets in seconds, from sub-millisecond lookups to slow generations
+DURATION_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+HELP_TEXT = {
+    "echomind_stage_duration_seconds": "Duration of each processing stage",
+    "echomind_http_request_duration_seconds": "Flask request duration, by endpoint",
+    "echomind_tokens_total": "Gemini tokens used, by call and kind",
+    "echomind_cache_requests_total": "Cache lookups, by cache and result",
+    "echomind_throttled_total": "Requests refused by a rate limiter, by limiter",
+    "echomind_kb_swap_duration_seconds": "Time to load and switch to a new knowledge base version",
+    "echomind_kb_staleness_seconds": "Age of the dataset changes when their knowledge base version was swapped in",
+    "echomind_websocket_messages_total": "Messages received on WebSocket chat connections, by type",
+    "echomind_admission_wait_seconds": "Time chat messages waited for a generation slot, by priority",
+    "echomind_admission_shed_total": "Chat messages turned away with the high demand reply, by reason",
+    "echomind_crisis_messages_total": "Messages answered with the safety response, by language",
+    "echomind_prefetch_total": "Draft prefetch requests, by result",
+    "echomind_prefetch_work_seconds_total": "Encoder and search time spent prefetching drafts",
+    "echomind_prefetch_hits_total": "Sent messages whose retrieval a prefetch had already done",
+    "echomind_prefetch_saved_seconds_total": "Retrieval time taken off sent messages by prefetching",
+    "echomind_response_cache_requests_total": "Response cache lookups, by language and result",
+}
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_histograms: Dict[Tuple[str, Tuple], list] = {}
+_cache_functions = {}
+_gauges = {}
+_tracer = None
+
+
+def _setup_tracer():
+    """Create an OpenTelemetry tracer, exporting over OTLP when the SDK is installed."""
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        print("ECHOMIND_OTEL is set but opentelemetry is not installed")
+        return None
+
+    try:
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        provider = TracerProvider()
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+    except ImportError:
+        # Use whatever tracer provider the application configured
+        pass
+
+    return trace.get_tracer("echomind")
+
+
+if OTEL_ENABLED:
+    _tracer = _setup_tracer()
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+
+def increment(name: str, value: float = 1.0, **labels):
+    """
+    Add to a counter.
+
+    Args:
+        name: Metric name
+        value: Amount to add
+        **labels: Metric labels
+    """
+    if not METRICS_ENABLED:
+        return
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def observe(name: str, value: float, **labels):
+    """
+    Record a value in a histogram.
+
+    Args:
+        name: Metric name
+        value: Observed value, in seconds for durations
+        **labels: Metric labels
+    """
+    if not METRICS_ENABLED:
+        return
+    key = (name, _label_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # Bucket counts, then the running sum and count
+            histogram = _histograms[key] = [0] * len(DURATION_BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup as a hit or a miss."""
+    increment(
+        "echomind_cache_requests_total", cache=cache, result="hit" if hit else "miss"
+    )
+
+
+def record_tokens(call: str, usage_metadata):
+    """
+    Count the prompt and completion tokens reported by Gemini.
+
+    Args:
+        call: Which call used the tokens, e.g. "response" or "reflection"
+        usage_metadata: The usage_metadata of a Gemini response (may be None)
+    """
+    if not METRICS_ENABLED or usage_metadata is None:
+        return
+    prompt_tokens = getattr(usage_metadata, "prompt_token_count", 0) or 0
+    completion_tokens = getattr(usage_metadata, "candidates_token_count", 0) or 0
+    increment("echomind_tokens_total", prompt_tokens, call=call, kind="prompt")
+    increment("echomind_tokens_total", completion_tokens, call=call, kind="completion")
+
+
+def register_cache(name: str, cached_function):
+    """
+    Report the hit rate of an lru_cache-decorated function on /metrics.
+
+    Args:
+        name: Cache label to use in the metrics
+        cached_function: Function wrapped with functools.lru_cache
+    """
+    _cache_functions[name] = cached_function
+
+
+def register_gauge(name: str, help_text: str, callback):
+    """
+    Report a value that is read when /metrics is rendered.
+
+    Args:
+        name: Metric name
+        help_text: Description shown in the metrics page
+        callback: Function returning a list of (labels dict, value) pairs
+    """
+    _gauges[name] = (help_text, callback)
+
+
+class Span:
+    """
+    Times a block of code as one processing stage.
+
+    The duration is recorded in the stage histogram, exported to OpenTelemetry
+    when enabled, and written to `timings` as "<name>_ms" when a dict is given.
+    """
+
+    __slots__ = ("name", "timings", "start", "otel_span")
+
+    def __init__(self, name: str, timings: Optional[Dict[str, float]] = None):
+        self.name = name
+        self.timings = timings
+        self.otel_span = None
+
+    def __enter__(self):
+        if _tracer is not None:
+            self.otel_span = _tracer.start_as_current_span(self.name)
+            self.otel_span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        if self.timings is not None:
+            self.timings[f"{self.name}_ms"] = elapsed * 1000
+        observe("echomind_stage_duration_seconds", elapsed, stage=self.name)
+        if self.otel_span is not None:
+            self.otel_span.__exit__(exc_type, exc, tb)
+        return False
+
+
+class _NoopSpan:
+    """Shared do-nothing span used when nothing would consume the timing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, timings: Optional[Dict[str, float]] = None):
+    """
+    Time a processing stage.
+
+    Usage:
+        with span("generate", timings):
+            response = model.generate_content(prompt)
+
+    Args:
+        name: Stage name
+        timings: Optional dict to also store the duration in, as "<name>_ms"
+
+    Returns:
+        A context manager; a shared no-op one when metrics, tracing and
+        timings are all disabled
+    """
+    if timings is None and not METRICS_ENABLED and _tracer is None:
+        return _NOOP_SPAN
+    return Span(name, timings)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple, extra: Tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus() -> str:
+    """
+    Render all metrics in the Prometheus text exposition format.
+
+    Returns:
+        The metrics page body
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = sorted(_histograms.items())
+
+    # Fold lru_cache statistics into the cache counters
+    for name, cached_function in _cache_functions.items():
+        info = cached_function.cache_info()
+        for result, value in (("hit", info.hits), ("miss", info.misses)):
+            key = (
+                "echomind_cache_requests_total",
+                (("cache", name), ("result", result)),
+            )
+            counters[key] = counters.get(key, 0.0) + value
+
+    lines = []
+    seen = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {HELP_TEXT.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+    for name, (help_text, callback) in sorted(_gauges.items()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in callback():
+            lines.append(f"{name}{_format_labels(_label_key(labels))} {value:g}")
+
+    seen = set()
+    for (name, labels), histogram in histograms:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {HELP_TEXT.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+        for bound, count in zip(DURATION_BUCKETS, histogram):
+            bucket_labels = _format_labels(labels, (("le", f"{bound:g}"),))
+            lines.append(f"{name}_bucket{bucket_labels} {count}")
+        bucket_labels = _format_labels(labels, (("le", "+Inf"),))
+        lines.append(f"{name}_bucket{bucket_labels} {histogram[-1]}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]:g}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+
+    return "\n".join(lines) + "\n"
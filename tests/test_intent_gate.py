@@ -0,0 +1,52 @@
+import pytest
+
+from intent_gate import classify_risk, classify_turn
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "I want to kill myself",
+        "I don't want to be here anymore",
+        "i dont wanna be around any more",
+        "I took too many pills",
+        "kms",
+        "honestly I just want to disappear",
+        "I don't want to live",
+        "je veux plus vivre",
+        "Je ne veux plus vivre",
+        "j'ai envie de disparaître",
+        "أريد أن أموت",
+    ],
+)
+def test_crisis_phrasings_are_flagged(message):
+    assert classify_risk(message)["crisis"]
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "I feel anxious about my exams",
+        "I don't want to be here at this party",
+        "I took my pills this morning",
+        "thanks, that helped",
+        "je veux vivre autrement",
+    ],
+)
+def test_ordinary_messages_are_not_flagged(message):
+    assert not classify_risk(message)["crisis"]
+
+
+@pytest.mark.parametrize(
+    "message, intent",
+    [
+        ("got it", "acknowledgement"),
+        ("Got it, thanks!", "thanks"),
+        ("ok got it", "acknowledgement"),
+        ("hello", "greeting"),
+        ("I got it wrong again", "informational"),
+        ("it is hard", "informational"),
+    ],
+)
+def test_small_talk_intents(message, intent):
+    assert classify_turn(message)["intent"] == intent
@@ -1,7 +1,8 @@
 import os
 import glob
 import uuid
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
@@ -10,17 +11,45 @@ from astrapy.constants import VectorMetric
 
 # Import our AstraDB connection function
 from astra_connection import connect_to_astradb
+from offload import run_cpu_bound
+from telemetry import register_cache, span
+from bm25_index import (
+    BM25Index,
+    BM25_INDEX_PATH,
+    get_bm25_index,
+    reciprocal_rank_fusion,
+)
 
 # Load environment variables
 load_dotenv()
 
 # Configuration
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"  # Model for generating embeddings
+# Model for Arabic and French chunks and queries (also 384 dimensions)
+MULTILINGUAL_EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
 CHUNK_SIZE = 1000  # Characters per chunk
 CHUNK_OVERLAP = 200  # Overlap between chunks
 VECTOR_DIMENSION = 384  # Dimension of the embeddings from MiniLM-L6-v2
 
 
+@lru_cache(maxsize=None)
+def get_embedding_model(model_name: str = EMBEDDING_MODEL) -> SentenceTransformer:
+    """
+    Load a SentenceTransformer model once and reuse it for every later call.
+
+    Args:
+        model_name: Name of the SentenceTransformer model to load
+
+    Returns:
+        The loaded model
+    """
+    with span("model_load"):
+        return SentenceTransformer(model_name)
+
+
+register_cache("embedding_model", get_embedding_model)
+
+
 def setup_vector_collection(db, collection_name: str = "text_vectors"):
     """
     Create a collection in AstraDB for storing vector embeddings if it doesn't exist.
@@ -83,20 +112,24 @@ def chunk_text(
 
 
 def process_text_files(
-    directory_path: str, model_name: str = EMBEDDING_MODEL
+    directory_path: str,
+    model_name: str = EMBEDDING_MODEL,
+    bm25_index_path: Optional[str] = BM25_INDEX_PATH,
 ) -> List[Dict[str, Any]]:
     """
     Process all .txt files in the given directory, chunk them, and generate embeddings.
+    A BM25 lexical index over the same chunks is built alongside the embeddings.
 
     Args:
         directory_path: Path to directory containing .txt files
         model_name: Name of the SentenceTransformer model to use
+        bm25_index_path: Directory to save the BM25 index to (None to skip it)
 
     Returns:
         List of dictionaries containing file information, chunks, and embeddings
     """
     # Load the embedding model
-    model = SentenceTransformer(model_name)
+    model = get_embedding_model(model_name)
 
     # Get all .txt files in the directory
     text_files = glob.glob(os.path.join(directory_path, "*.txt"))
@@ -115,10 +148,12 @@ def process_text_files(
             text = file.read()
 
         # Chunk the text
-        chunks = chunk_text(text)
+        with span("ingest_chunk"):
+            chunks = chunk_text(text)
 
         # Generate embeddings for all chunks
-        embeddings = model.encode(chunks)
+        with span("ingest_embed"):
+            embeddings = model.encode(chunks)
 
         # Store file info, chunks, and embeddings
         for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
@@ -133,6 +168,16 @@ def process_text_files(
             )
 
     print(f"Processed {len(text_files)} files, created {len(all_chunks)} chunks")
+
+    # Build the lexical index with the same chunk IDs as the vector store
+    if bm25_index_path:
+        with span("ingest_bm25"):
+            index = BM25Index.build(all_chunks)
+            index.save(bm25_index_path)
+        print(
+            f"BM25 index with {len(index.vocabulary)} terms saved to {bm25_index_path}"
+        )
+
     return all_chunks
 
 
@@ -158,7 +203,8 @@ def store_in_astradb(
 
     for i in range(0, len(chunks), batch_size):
         batch = chunks[i : i + batch_size]
-        collection.insert_many(batch)
+        with span("ingest_store"):
+            collection.insert_many(batch)
 
         count += len(batch)
         print(f"Inserted {count}/{len(chunks)} chunks")
@@ -172,6 +218,8 @@ def search_similar_text(
     model_name: str = EMBEDDING_MODEL,
     collection_name: str = "text_vectors",
     limit: int = 5,
+    query_embedding: Optional[np.ndarray] = None,
+    include_vectors: bool = False,
 ):
     """
     Search for text similar to the query in the vector database.
@@ -182,13 +230,19 @@ def search_similar_text(
         model_name: Name of the SentenceTransformer model to use
         collection_name: Name of the collection to search in
         limit: Maximum number of results to return
+        query_embedding: Precomputed embedding of the query (encoded if not given)
+        include_vectors: Also return each chunk's stored "$vector"
 
     Returns:
         List of similar text chunks
     """
     # Generate embedding for the query
-    model = SentenceTransformer(model_name)
-    query_embedding = model.encode(query)
+    if query_embedding is None:
+        query_embedding = run_cpu_bound(get_embedding_model(model_name).encode, query)
+
+    projection = ["file_path", "chunk_index", "chunk_text"]
+    if include_vectors:
+        projection.append("$vector")
 
     # Get the collection
     collection = db.get_collection(collection_name)
@@ -199,13 +253,63 @@ def search_similar_text(
         sort={"$vector": query_embedding.tolist()},
         limit=limit,
         include_similarity=True,
-        projection=["file_path", "chunk_index", "chunk_text"],
+        projection=projection,
     )
 
     # Convert cursor to list
     return list(cursor)
 
 
+def hybrid_search(
+    db,
+    query: str,
+    model_name: str = EMBEDDING_MODEL,
+    collection_name: str = "text_vectors",
+    limit: int = 5,
+    language: Optional[str] = None,
+    query_embedding: Optional[np.ndarray] = None,
+    include_vectors: bool = False,
+    bm25_index_path: str = BM25_INDEX_PATH,
+):
+    """
+    Search with both vector similarity and the local BM25 index, and merge the
+    two rankings with reciprocal rank fusion.
+
+    Keyword-heavy queries ("CBT", "panic attack") that embed poorly are still
+    matched lexically. Falls back to pure vector search if no BM25 index exists.
+
+    Args:
+        db: AstraDB database client
+        query: Text to search for
+        model_name: Name of the SentenceTransformer model to use
+        collection_name: Name of the collection to search in
+        limit: Maximum number of results to return
+        language: Language of the query, used for tokenization
+        query_embedding: Precomputed embedding of the query (encoded if not given)
+        include_vectors: Also return each vector hit's stored "$vector"
+        bm25_index_path: Directory of the BM25 index to search
+
+    Returns:
+        List of similar text chunks
+    """
+    vector_results = search_similar_text(
+        db,
+        query,
+        model_name=model_name,
+        collection_name=collection_name,
+        limit=limit,
+        query_embedding=query_embedding,
+        include_vectors=include_vectors,
+    )
+
+    index = get_bm25_index(bm25_index_path)
+    if index is None:
+        return vector_results
+
+    lexical_results = run_cpu_bound(index.search, query, limit=limit, language=language)
+    return reciprocal_rank_fusion([vector_results, lexical_results], limit=limit)
+
+
 def main():
     # Connect to AstraDB
     try:
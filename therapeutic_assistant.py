@@ -1,18 +1,23 @@
 import os
+import time
 import google.generativeai as genai
 from dotenv import load_dotenv
-from text_to_vector_db import search_similar_text
+from retrieval import retrieve_context
+from knowledge_base import get_active_index, language_index
+from intent_gate import classify_turn, record_decision
 from astra_connection import connect_to_astradb
+from response_cache import response_cache
+from telemetry import record_tokens, span
 
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini API
+# Configure Gemini API (the key is only required once a response is generated)
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable is required")
-
-genai.configure(api_key=GEMINI_API_KEY)
+# "rest" avoids gRPC, whose blocking calls would stall an eventlet server
+GEMINI_TRANSPORT = os.environ.get("GEMINI_TRANSPORT") or None
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY, transport=GEMINI_TRANSPORT)
 
 # Define the model name
 GEMINI_MODEL = "gemini-2.0-flash"  # Using the currently available model name
@@ -77,8 +82,7 @@ You are EchoMind, a compassionate AI therapist with expertise in mental wellness
 - If someone is in crisis, gently suggest they seek professional help
 
 ## LANGUAGE INSTRUCTIONS:
-- Respond in {language}
-- If the context is in English but you need to respond in another language, translate the key insights before incorporating them
+- Respond in {language}{translation_instruction}
 
 ## CONTEXT FROM KNOWLEDGE BASE:
 {context}
@@ -89,6 +93,10 @@ You are EchoMind, a compassionate AI therapist with expertise in mental wellness
 Now respond as EchoMind, drawing on the relevant knowledge provided in the context, but maintaining your therapeutic, supportive persona throughout. Your response must be in {language}.
 """
 
+# Only added when the retrieved context isn't already in the response language
+TRANSLATE_CONTEXT_INSTRUCTION = """
+- If the context is in English but you need to respond in another language, translate the key insights before incorporating them"""
+
 # Reflection prompt template
 REFLECTION_PROMPT_TEMPLATE = """
 You are EchoMind, a compassionate AI therapist. You're reviewing the conversation with a person to identify themes, patterns, and opportunities for growth.
@@ -110,12 +118,71 @@ Respond in {language}, using a thoughtful, empathetic tone.
 """
 
 
+def get_generative_model(model_name: str = GEMINI_MODEL):
+    """
+    Create the Gemini model used for responses and reflections.
+
+    Args:
+        model_name: Name of the Gemini model to use
+
+    Returns:
+        A Gemini GenerativeModel
+    """
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY environment variable is required")
+    return genai.GenerativeModel(model_name)
+
+
+def retrieve_knowledge(
+    db, user_query: str, language: str, top_k: int = 3, query_embedding=None
+):
+    """
+    Retrieve context for a message from the active knowledge base version.
+
+    Args:
+        db: AstraDB database client
+        user_query: The user's message
+        language: Session language; its pre-translated chunks are searched if
+                  the active version has them
+        top_k: Maximum number of chunks to retrieve
+        query_embedding: Precomputed embedding of the message, made with the
+                         language's encoder (see knowledge_base.language_index)
+
+    Returns:
+        The result of retrieve_context, plus the "language" the chunks are in
+    """
+    # Read from one knowledge base version for the whole turn, even if a
+    # newer one is swapped in meanwhile
+    active_index = get_active_index()
+
+    # Search the chunks pre-translated into the session language, if this
+    # version has them
+    target = language_index(active_index, language)
+
+    # Retrieve, re-rank and trim relevant chunks to the context budget
+    retrieval = retrieve_context(
+        db=db,
+        query=user_query,
+        top_k=top_k,
+        language=language,
+        collection_name=target["collection"],
+        bm25_index_path=target["bm25_index_path"],
+        index_version=active_index["version"],
+        model_name=target["model_name"],
+        query_embedding=query_embedding,
+    )
+    retrieval["language"] = target["language"]
+    return retrieval
+
+
 def generate_therapeutic_response(
     user_query: str,
     top_k: int = 3,
     conversation_history=None,
     language="english",
     temperature=0.3,
+    retrieval=None,
+    on_token=None,
 ):
     """
     Retrieve relevant text chunks from AstraDB based on the user query,
@@ -123,14 +190,23 @@ def generate_therapeutic_response(
 
     Args:
         user_query: The user's question or concern
-        top_k: Number of relevant chunks to retrieve (default: 3)
+        top_k: Maximum number of relevant chunks to retrieve (default: 3); fewer
+               are used when the rest fall below the similarity threshold or
+               don't fit the context token budget
         conversation_history: Optional list of previous messages for context
         language: Language for the response (default: english)
         temperature: Controls the randomness of responses (0.0 to 1.0, default: 0.3)
                      Lower values are more deterministic, higher values more creative
+        retrieval: Result of retrieve_knowledge computed beforehand (e.g. by
+                   batch_inference), used instead of searching again
+        on_token: Optional callback streaming the response; called with each
+                  piece of text as Gemini generates it
 
     Returns:
-        A therapeutic response from Gemini
+        A dictionary with the response from Gemini, its sources and per-stage
+        timings in milliseconds; "cached" is set when the response came from
+        the response cache, and "error" when generation failed (the response
+        is then an apology for the user)
     """
     try:
         # Set default language if not supported
@@ -142,69 +218,136 @@ def generate_therapeutic_response(
 
         # Set up context and sources
         context = ""
+        context_language = language
         sources = []
-
-        try:
-            # Connect to AstraDB
-            db = connect_to_astradb()
-
-            # Retrieve relevant chunks from the vector database
-            relevant_chunks = search_similar_text(
-                db=db, query=user_query, limit=top_k, collection_name="text_vectors"
-            )
-
-            # Extract the text from the chunks
-            context_texts = [chunk["chunk_text"] for chunk in relevant_chunks]
-
-            # Format source information for reference
-            sources = [
-                f"From: {chunk['file_path']}, Chunk: {chunk['chunk_index']}"
-                for chunk in relevant_chunks
-            ]
-
-            # Combine the chunks into a single context
-            context = "\n\n".join(context_texts)
-
-        except Exception as db_error:
-            # Log the error but continue without database content
-            print(f"AstraDB connection error: {str(db_error)}")
-            db_error_messages = {
-                "english": "Note: I couldn't access my knowledge base at the moment, but I'll still do my best to help you.",
-                "arabic": "ملاحظة: لم أتمكن من الوصول إلى قاعدة معرفتي في الوقت الحالي، لكنني سأبذل قصارى جهدي لمساعدتك.",
-                "french": "Remarque: Je n'ai pas pu accéder à ma base de connaissances pour le moment, mais je ferai de mon mieux pour vous aider.",
+        timings = {}
+        knowledge_base_error = False
+
+        # Small talk doesn't need the knowledge base, and greetings don't
+        # need the history either
+        with span("intent_gate", timings):
+            gate = classify_turn(user_query)
+        record_decision(user_query, gate, language)
+        full_history = conversation_history
+        if conversation_history and gate["history"] is not None:
+            keep = gate["history"]
+            conversation_history = conversation_history[-keep:] if keep else []
+
+        if gate["retrieve"]:
+            try:
+                if retrieval is None:
+                    # Connect to AstraDB
+                    with span("connect", timings):
+                        db = connect_to_astradb()
+
+                    retrieval = retrieve_knowledge(db, user_query, language, top_k)
+                relevant_chunks = retrieval["chunks"]
+                context_language = retrieval["language"]
+                timings.update(retrieval["timings"])
+
+                # Extract the text from the chunks
+                context_texts = [chunk["chunk_text"] for chunk in relevant_chunks]
+
+                # Format source information for reference
+                sources = [
+                    f"From: {chunk['file_path']}, Chunk: {chunk['chunk_index']}"
+                    for chunk in relevant_chunks
+                ]
+
+                # Combine the chunks into a single context
+                context = "\n\n".join(context_texts)
+
+            except Exception as db_error:
+                # Log the error but continue without database content
+                print(f"AstraDB connection error: {str(db_error)}")
+                db_error_messages = {
+                    "english": "Note: I couldn't access my knowledge base at the moment, but I'll still do my best to help you.",
+                    "arabic": "ملاحظة: لم أتمكن من الوصول إلى قاعدة معرفتي في الوقت الحالي، لكنني سأبذل قصارى جهدي لمساعدتك.",
+                    "french": "Remarque: Je n'ai pas pu accéder à ma base de connaissances pour le moment, mais je ferai de mon mieux pour vous aider.",
+                }
+                context = db_error_messages.get(language, db_error_messages["english"])
+                context_language = language
+                knowledge_base_error = True
+
+        # Low-temperature replies to first messages barely vary; reuse them
+        # (the sources identify the retrieved chunks). Whether it is a first
+        # message depends on the whole conversation, not the trimmed history
+        cache_lookup = None
+        if response_cache.enabled and not knowledge_base_error:
+            with span("response_cache", timings):
+                cache_lookup = response_cache.lookup(
+                    user_query, language, temperature, sources, full_history
+                )
+        if cache_lookup and cache_lookup["response"] is not None:
+            if on_token is not None:
+                on_token(cache_lookup["response"])
+            return {
+                "response": cache_lookup["response"],
+                "sources": cache_lookup["sources"],
+                "timings": timings,
+                "cached": True,
             }
-            context = db_error_messages.get(language, db_error_messages["english"])
-
-        # Add conversation history context if provided
-        conversation_context = ""
-        if conversation_history and len(conversation_history) > 0:
-            conversation_context = "## PREVIOUS CONVERSATION:\n"
-            for msg in conversation_history:
-                role = "Person" if msg["role"] == "user" else "EchoMind"
-                conversation_context += f"{role}: {msg['content']}\n\n"
-            conversation_context += "\n"
-
-        # Create prompt from template
-        prompt = ECHOMIND_PROMPT_TEMPLATE.format(
-            context=context, query=user_query, language=language_name
-        )
 
-        # Add conversation history to the prompt if available
-        if conversation_context:
-            prompt = prompt.replace(
-                "## CONTEXT FROM KNOWLEDGE BASE:",
-                f"{conversation_context}## CONTEXT FROM KNOWLEDGE BASE:",
+        with span("prompt", timings):
+            # Add conversation history context if provided
+            conversation_context = ""
+            if conversation_history and len(conversation_history) > 0:
+                conversation_context = "## PREVIOUS CONVERSATION:\n"
+                for msg in conversation_history:
+                    role = "Person" if msg["role"] == "user" else "EchoMind"
+                    conversation_context += f"{role}: {msg['content']}\n\n"
+                conversation_context += "\n"
+
+            # Create prompt from template; Gemini only has to translate the
+            # context when no pre-translated chunks were available
+            translation_instruction = ""
+            if context and context_language != language:
+                translation_instruction = TRANSLATE_CONTEXT_INSTRUCTION
+            prompt = ECHOMIND_PROMPT_TEMPLATE.format(
+                context=context,
+                query=user_query,
+                language=language_name,
+                translation_instruction=translation_instruction,
             )
 
+            # Add conversation history to the prompt if available
+            if conversation_context:
+                prompt = prompt.replace(
+                    "## CONTEXT FROM KNOWLEDGE BASE:",
+                    f"{conversation_context}## CONTEXT FROM KNOWLEDGE BASE:",
+                )
+
         # Initialize Gemini model
-        model = genai.GenerativeModel(GEMINI_MODEL)
+        model = get_generative_model()
 
         # Generate the response with the specified temperature
         generation_config = {"temperature": temperature}
-        response = model.generate_content(prompt, generation_config=generation_config)
-
-        # Return the response and sources
-        return {"response": response.text, "sources": sources}
+        generate_start = time.perf_counter()
+        with span("generate", timings):
+            if on_token is None:
+                response = model.generate_content(
+                    prompt, generation_config=generation_config
+                )
+                response_text = response.text
+            else:
+                response = model.generate_content(
+                    prompt, generation_config=generation_config, stream=True
+                )
+                pieces = []
+                for chunk in response:
+                    if not pieces:
+                        timings["first_token_ms"] = (
+                            time.perf_counter() - generate_start
+                        ) * 1000
+                    pieces.append(chunk.text)
+                    on_token(chunk.text)
+                response_text = "".join(pieces)
+        record_tokens("response", getattr(response, "usage_metadata", None))
+        if cache_lookup and response_text:
+            response_cache.store(cache_lookup, response_text, sources)
+
+        # Return the response, sources and stage timings
+        return {"response": response_text, "sources": sources, "timings": timings}
 
     except Exception as e:
         error_messages = {
@@ -215,7 +358,7 @@ def generate_therapeutic_response(
 
         error_msg = error_messages.get(language, error_messages["english"])
 
-        return {"response": error_msg, "sources": []}
+        return {"response": error_msg, "sources": [], "timings": {}, "error": str(e)}
 
 
 def generate_positive_reflection(
@@ -260,23 +403,28 @@ def generate_positive_reflection(
                 )
             }
 
-        # Format conversation history for the prompt
-        formatted_history = ""
-        for msg in conversation_history:
-            role = "Person" if msg["role"] == "user" else "EchoMind"
-            formatted_history += f"{role}: {msg['content']}\n\n"
+        with span("reflection_prompt"):
+            # Format conversation history for the prompt
+            formatted_history = ""
+            for msg in conversation_history:
+                role = "Person" if msg["role"] == "user" else "EchoMind"
+                formatted_history += f"{role}: {msg['content']}\n\n"
 
-        # Create prompt from template
-        prompt = REFLECTION_PROMPT_TEMPLATE.format(
-            conversation_history=formatted_history, language=language_name
-        )
+            # Create prompt from template
+            prompt = REFLECTION_PROMPT_TEMPLATE.format(
+                conversation_history=formatted_history, language=language_name
+            )
 
         # Initialize Gemini model
-        model = genai.GenerativeModel(GEMINI_MODEL)
+        model = get_generative_model()
 
         # Generate the reflection with the specified temperature
         generation_config = {"temperature": temperature}
-        response = model.generate_content(prompt, generation_config=generation_config)
+        with span("reflection_generate"):
+            response = model.generate_content(
+                prompt, generation_config=generation_config
+            )
+        record_tokens("reflection", getattr(response, "usage_metadata", None))
 
         return {"reflection": response.text}
 
@@ -292,10 +440,26 @@ def generate_positive_reflection(
         return {"reflection": error_msg}
 
 
+def get_not_enough_history_text(language):
+    """Get message for not enough history for reflection."""
+    texts = {
+        "english": "We need to chat a bit more before I can offer a meaningful reflection.",
+        "arabic": "نحتاج إلى الدردشة قليلاً أكثر قبل أن أتمكن من تقديم تفكير مفيد.",
+        "french": "Nous devons discuter un peu plus avant que je puisse offrir une réflexion significative.",
+    }
+    return texts.get(language, texts["english"])
+
+
 def main():
     """
     Interactive therapeutic assistant using AstraDB and Gemini with language support.
     """
+    if not GEMINI_API_KEY:
+        print(
+            "Gemini API key not found. Please add it to your .env file as GEMINI_API_KEY."
+        )
+        return
+
     print("🌈 EchoMind Therapeutic Assistant")
     print("Available languages: English (en), Arabic (ar), French (fr)")
 
@@ -376,6 +540,12 @@ def main():
             for source in result["sources"]:
                 print(f"• {source}")
 
+        if result["timings"]:
+            stages = ", ".join(
+                f"{stage[:-3]} {ms:.0f}ms" for stage, ms in result["timings"].items()
+            )
+            print(f"\n--- Timings: {stages} ---")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,85 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+from telemetry import increment
+
+# Configuration
+MAX_TRACKED_KEYS = 10000  # Buckets per limiter; least recently used are dropped
+
+
+class TokenBucketLimiter:
+    """
+    Per-key token bucket rate limiter, e.g. one bucket per client IP.
+
+    Each key starts with `capacity` tokens and regains `refill_per_second`
+    tokens per second up to that capacity. A request is allowed if its
+    bucket still holds enough tokens. Buckets live in this process only, so
+    with several workers each one enforces the limit separately.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        capacity: float,
+        refill_per_second: float,
+        max_keys: int = MAX_TRACKED_KEYS,
+    ):
+        self.name = name
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        # key -> (tokens, time of the last update)
+        self.buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def allow(self, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        """
+        Take tokens from a key's bucket if it has enough.
+
+        Args:
+            key: Who is being limited, e.g. an IP address or account
+            cost: Number of tokens the request uses
+
+        Returns:
+            Whether the request is allowed, and if not, how many seconds to
+            wait before it would be
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (self.capacity, now))
+            tokens = min(
+                self.capacity, tokens + (now - updated) * self.refill_per_second
+            )
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                # Forgetting an idle bucket only ever resets it to full
+                self.buckets.popitem(last=False)
+
+        if allowed:
+            return True, 0.0
+        increment("echomind_throttled_total", limiter=self.name)
+        return False, (cost - tokens) / self.refill_per_second
+
+    def wait(self, key: str = "", cost: float = 1.0):
+        """
+        Block until a key's bucket has enough tokens, then take them.
+
+        Args:
+            key: Who is being limited
+            cost: Number of tokens the request uses
+        """
+        while True:
+            allowed, retry_after = self.allow(key, cost)
+            if allowed:
+                return
+            time.sleep(retry_after)
+
+    def reset(self, key: str):
+        """Refill a key's bucket, e.g. after a successful login."""
+        with self.lock:
+            self.buckets.pop(key, None)
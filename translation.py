@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any
+
+from dotenv import load_dotenv
+
+from telemetry import record_cache, record_tokens
+
+# Load environment variables
+load_dotenv()
+
+# Configuration
+TRANSLATION_MODEL = "gemini-2.0-flash"  # Gemini model used to translate chunks
+TRANSLATION_CACHE_DIR = "translation_cache"  # One JSON file per target language
+TRANSLATION_WORKERS = 4  # Concurrent translation requests during ingestion
+
+# Languages the knowledge base is translated into, with their file/collection codes
+TRANSLATED_LANGUAGES = {"arabic": "ar", "french": "fr"}
+
+TRANSLATION_PROMPT_TEMPLATE = """
+Translate the following excerpt from a mental wellness knowledge base into {language}.
+Keep its meaning, tone and the names of therapeutic techniques. Reply with the translation only.
+
+{text}
+"""
+
+LANGUAGE_NAMES = {"arabic": "Arabic", "french": "French"}
+
+
+class TranslationCache:
+    """
+    Translations of chunk texts, stored on disk so re-ingesting unchanged
+    chunks never calls Gemini again.
+
+    Entries are keyed by the SHA-256 of the source text, so a chunk is only
+    translated again when its text changes.
+    """
+
+    def __init__(self, language: str, cache_dir: str = TRANSLATION_CACHE_DIR):
+        self.path = os.path.join(cache_dir, f"{TRANSLATED_LANGUAGES[language]}.json")
+        self.entries: Dict[str, str] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as file:
+                self.entries = json.load(file)
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, text: str):
+        return self.entries.get(self.key(text))
+
+    def put(self, text: str, translation: str):
+        self.entries[self.key(text)] = translation
+
+    def save(self):
+        """Write the cache atomically, so an interrupted run never corrupts it."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self.entries, file, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+
+def _translation_model():
+    # Imported here because therapeutic_assistant imports the knowledge base,
+    # which imports this module; it configures Gemini once for the process
+    from therapeutic_assistant import get_generative_model
+
+    return get_generative_model(TRANSLATION_MODEL)
+
+
+def translate_text(text: str, language: str, model=None) -> str:
+    """
+    Translate one text with Gemini.
+
+    Args:
+        text: English text to translate
+        language: Target language ("arabic" or "french")
+        model: Gemini model to use (created if not given)
+
+    Returns:
+        The translated text
+    """
+    if model is None:
+        model = _translation_model()
+
+    prompt = TRANSLATION_PROMPT_TEMPLATE.format(
+        language=LANGUAGE_NAMES[language], text=text
+    )
+    response = model.generate_content(prompt, generation_config={"temperature": 0.0})
+    record_tokens("translation", getattr(response, "usage_metadata", None))
+    return response.text.strip()
+
+
+def translate_chunks(
+    chunks: List[Dict[str, Any]],
+    language: str,
+    cache_dir: str = TRANSLATION_CACHE_DIR,
+    model=None,
+) -> List[Dict[str, Any]]:
+    """
+    Translate knowledge base chunks, reusing cached translations.
+
+    Args:
+        chunks: Chunk dictionaries from process_text_files
+        language: Target language ("arabic" or "french")
+        cache_dir: Directory of the translation cache
+        model: Gemini model to use (created if not given)
+
+    Returns:
+        Copies of the chunks with translated "chunk_text" and without "$vector",
+        so they can be embedded in the target language
+    """
+    cache = TranslationCache(language, cache_dir)
+    texts = list({chunk["chunk_text"] for chunk in chunks})
+    missing = [text for text in texts if cache.get(text) is None]
+    for text in texts:
+        record_cache("translation", text not in missing)
+
+    if missing:
+        print(f"Translating {len(missing)} chunks into {LANGUAGE_NAMES[language]}")
+        if model is None:
+            # One model for all chunks, instead of one per chunk
+            model = _translation_model()
+        try:
+            with ThreadPoolExecutor(max_workers=TRANSLATION_WORKERS) as executor:
+                translations = executor.map(
+                    lambda text: translate_text(text, language, model), missing
+                )
+                for text, translation in zip(missing, translations):
+                    cache.put(text, translation)
+        finally:
+            # Keep whatever was translated before a failure
+            cache.save()
+
+    translated = []
+    for chunk in chunks:
+        copy = {key: value for key, value in chunk.items() if key != "$vector"}
+        copy["chunk_text"] = cache.get(chunk["chunk_text"])
+        translated.append(copy)
+    return translated
@@ -0,0 +1,169 @@
+import os
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
+
+from dotenv import load_dotenv
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from offload import eventlet_patched, run_cpu_bound
+from telemetry import span
+
+# Load environment variables
+load_dotenv()
+
+# Configuration
+USER_DB_PATH = os.environ.get("USER_DB_PATH", "users.db")  # SQLite database file
+KDF_WORKERS = 2  # Password hashes computed at the same time, per process
+KDF_MAX_PENDING = 32  # Hashes allowed to wait for a worker before logins are refused
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY COLLATE NOCASE,
+    name TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    created_at REAL NOT NULL
+)
+"""
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when too many password hashes are already waiting to be computed."""
+
+
+# Password hashing (scrypt/PBKDF2) is deliberately slow; running it on a small
+# pool keeps a burst of logins from using every CPU that chat requests need.
+# hashlib releases the GIL while hashing, so the pool threads run in parallel.
+# Under eventlet the pool's threads would be green, so the hashing is sent
+# to eventlet's real threads instead, KDF_WORKERS at a time.
+_kdf_executor = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="kdf")
+_kdf_slots = threading.BoundedSemaphore(KDF_WORKERS + KDF_MAX_PENDING)
+_kdf_workers = threading.BoundedSemaphore(KDF_WORKERS)
+
+# Checked against when an account doesn't exist, so that takes as long as a
+# wrong password and doesn't reveal which emails are registered
+_dummy_hash = None
+
+
+def _run_kdf(function, *args):
+    """Run a password hashing function on the KDF pool and wait for its result."""
+    if not _kdf_slots.acquire(blocking=False):
+        raise PasswordHashingBusy("Too many logins are being processed")
+    try:
+        with span("kdf"):
+            if eventlet_patched():
+                with _kdf_workers:
+                    return run_cpu_bound(function, *args)
+            return _kdf_executor.submit(function, *args).result()
+    finally:
+        _kdf_slots.release()
+
+
+def hash_password(password: str) -> str:
+    """Hash a password on the KDF pool."""
+    return _run_kdf(generate_password_hash, password)
+
+
+def check_password(password_hash: str, password: str) -> bool:
+    """Check a password against its hash on the KDF pool."""
+    return _run_kdf(check_password_hash, password_hash, password)
+
+
+class UserStore:
+    """
+    Registered users, stored in SQLite so they survive restarts and are
+    shared by all worker processes on the machine.
+
+    Each thread gets its own connection; WAL mode lets readers in other
+    workers continue while one writes.
+    """
+
+    def __init__(self, path: str = USER_DB_PATH):
+        self.path = path
+        self.local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        # Connections can't be shared with processes forked after they were opened
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def get_user(self, email: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a user by email (case-insensitive).
+
+        Args:
+            email: The user's email address
+
+        Returns:
+            Dictionary with "email", "name" and "password_hash", or None
+        """
+        row = (
+            self._connection()
+            .execute(
+                "SELECT email, name, password_hash FROM users WHERE email = ?",
+                (email,),
+            )
+            .fetchone()
+        )
+        return dict(row) if row else None
+
+    def create_user(self, name: str, email: str, password: str) -> bool:
+        """
+        Register a new user.
+
+        Args:
+            name: Display name
+            email: Email address, used to log in
+            password: Plain-text password; only its hash is stored
+
+        Returns:
+            True if the user was created, False if the email is already taken
+        """
+        if self.get_user(email):
+            return False
+
+        password_hash = hash_password(password)
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    "INSERT INTO users (email, name, password_hash, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (email, name, password_hash, time.time()),
+                )
+        except sqlite3.IntegrityError:
+            # Registered by a concurrent request in the meantime
+            return False
+        return True
+
+    def authenticate(self, email: str, password: str) -> Optional[Dict[str, Any]]:
+        """
+        Check an email and password.
+
+        Args:
+            email: Email address
+            password: Plain-text password
+
+        Returns:
+            The user (without the password hash) if the password is correct,
+            otherwise None
+        """
+        global _dummy_hash
+        user = self.get_user(email)
+        if user is None:
+            if _dummy_hash is None:
+                _dummy_hash = hash_password("not a real password")
+            check_password(_dummy_hash, password)
+            return None
+
+        if not check_password(user["password_hash"], password):
+            return None
+        return {"email": user["email"], "name": user["name"]}